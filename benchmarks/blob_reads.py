@@ -0,0 +1,59 @@
+# Compares N sequential blob reads with a BlobService per read (the old
+# single-use lifecycle) against one BlobService kept open for all reads.
+# Runs against Azurite by default: python -m benchmarks.blob_reads --reads 200
+from services.blob_service import BlobService
+import argparse, asyncio, os, time
+
+AZURITE_CONNECTION_STRING = "UseDevelopmentStorage=true"
+
+
+async def read_with_new_service(conn_str, container_name, blob_name, reads):
+    for _ in range(reads):
+        async with BlobService(
+            storageaccount_endpoint=None, conn_str=conn_str
+        ) as blob_service:
+            await blob_service.read_container_file(blob_name, container_name)
+
+
+async def read_with_shared_service(conn_str, container_name, blob_name, reads):
+    async with BlobService(
+        storageaccount_endpoint=None, conn_str=conn_str
+    ) as blob_service:
+        for _ in range(reads):
+            await blob_service.read_container_file(blob_name, container_name)
+
+
+async def main(args):
+    async with BlobService(
+        storageaccount_endpoint=None, conn_str=args.conn_str
+    ) as blob_service:
+        await blob_service.upload_blob_to_container(
+            # read_container_file decodes UTF-8, so the payload is runbook text
+            data=(b"# runbook\n" * (args.size // 10 + 1))[: args.size],
+            file_name=args.blob,
+            container_name=args.container,
+        )
+    print(f"{'mode':<10}{'reads':>8}{'seconds':>10}{'ms/read':>10}")
+    for mode, runner in (
+        ("before", read_with_new_service),
+        ("after", read_with_shared_service),
+    ):
+        started = time.perf_counter()
+        await runner(args.conn_str, args.container, args.blob, args.reads)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{mode:<10}{args.reads:>8}{elapsed:>10.2f}{elapsed / args.reads * 1000:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reads", type=int, default=100)
+    parser.add_argument("--size", type=int, default=16 * 1024)
+    parser.add_argument("--container", default="benchmark")
+    parser.add_argument("--blob", default="runbook.py")
+    parser.add_argument(
+        "--conn-str",
+        default=os.getenv("storage_connection_str", AZURITE_CONNECTION_STRING),
+    )
+    asyncio.run(main(parser.parse_args()))
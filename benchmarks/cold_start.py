@@ -0,0 +1,83 @@
+# Measures cold-start cost of the function app: import time of function_app in a
+# fresh interpreter and, optionally, the latency of the first and second
+# invocation of the trigger in that same process (cold vs warm clients).
+# Compare two trees by pointing --tree at a checkout of the older revision:
+#   git worktree add /tmp/before <rev>
+#   python -m benchmarks.cold_start --tree /tmp/before --tree .
+#   python -m benchmarks.cold_start --invoke --param dry_run=true --param report_format=none
+import argparse, json, os, statistics, subprocess, sys
+
+PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import function_app
+result = {"import": time.perf_counter() - started, "modules": len(sys.modules)}
+if {invoke}:
+    import azure.functions as func
+
+    trigger = function_app.http_trigger_automation_account
+    if hasattr(trigger, "build"):
+        trigger = trigger.build().get_user_function()
+
+    async def invoke():
+        latencies = []
+        for _ in range(2):
+            request = func.HttpRequest(
+                method="GET",
+                url="/api/http_trigger_automation_account",
+                body=b"",
+                params={params},
+            )
+            started = time.perf_counter()
+            await trigger(request)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    result["first_request"], result["second_request"] = asyncio.run(invoke())
+print(json.dumps(result))
+"""
+
+
+def probe(tree, invoke, params):
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            PROBE.replace("{invoke}", repr(invoke)).replace("{params}", repr(params)),
+        ],
+        cwd=tree,
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    params = dict(param.split("=", 1) for param in args.param)
+    print(
+        f"{'tree':<30}{'import ms':>12}{'modules':>10}{'first ms':>12}{'second ms':>12}"
+    )
+    for tree in args.tree or ["."]:
+        runs = [probe(tree, args.invoke, params) for _ in range(args.runs)]
+        row = f"{tree[-30:]:<30}"
+        row += f"{statistics.median(r['import'] for r in runs) * 1000:>12.1f}"
+        row += f"{statistics.median(r['modules'] for r in runs):>10.0f}"
+        if args.invoke:
+            row += (
+                f"{statistics.median(r['first_request'] for r in runs) * 1000:>12.1f}"
+            )
+            row += (
+                f"{statistics.median(r['second_request'] for r in runs) * 1000:>12.1f}"
+            )
+        print(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", action="append")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--invoke", action="store_true")
+    parser.add_argument("--param", action="append", default=[])
+    main(parser.parse_args())
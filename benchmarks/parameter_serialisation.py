@@ -0,0 +1,212 @@
+# Serialisation cost of the Automation request bodies per run. "model" builds the
+# SDK parameter model per account and serialises it the way the client does for a
+# model argument (Serializer.body, then json.dumps when the request is built).
+# "template" is the cached body template from Automationaccountutils, which the
+# client sends as is.
+#   python -m benchmarks.parameter_serialisation
+#   python -m benchmarks.parameter_serialisation --accounts 10000 --runs 5
+import argparse, json, statistics, time
+from azure.mgmt.automation.models import (
+    AutomationAccountCreateOrUpdateParameters,
+    RunbookCreateOrUpdateParameters,
+    VariableCreateOrUpdateParameters,
+    ScheduleCreateOrUpdateParameters,
+    JobScheduleCreateParameters,
+    ScheduleAssociationProperty,
+    RunbookAssociationProperty,
+)
+from utils.automationaccountutils import Automationaccountutils
+
+RUNBOOKS = [
+    {
+        "name": name,
+        "tags": {"servicenow_instance": "itsm.sap.com", "contenthash": "ab" * 32},
+        "publish_content_link": {
+            "uri": f"https://benchstorage.blob.core.windows.net/runbooks/{name}.py?sv=2022-11-02&sig=fake",
+            "content_hash": {"algorithm": "SHA256", "value": "ab" * 32},
+            "version": "v1",
+        },
+    }
+    for name in ("afs_backuprunbook", "afs_deletionrunbook")
+]
+VARIABLES = [
+    "EXCLUDE_AFS",
+    "OBJECT_STORAGE",
+    "RESOURCE_GROUP",
+    "RetentionDays",
+    "SUBSCRIPTION_ID",
+]
+SCHEDULE = {
+    "schedule_name": "afs_daily",
+    "start_time": "2026-10-19T00:00:00+00:00",
+    "frequency": "Day",
+    "description": None,
+    "expiry_time": None,
+    "interval": "1",
+    "time_zone": "UTC",
+    "advanced_schedule": None,
+}
+
+
+def accounts(count):
+    return [
+        {
+            "automationaccountname": f"aahec{index % 100:02d}p{index:05d}backup0001",
+            "location": ("westeurope", "northeurope", "eastus")[index % 3],
+            "rg_name": f"HEC{index % 100:02d}-P{index:05d}-rg",
+        }
+        for index in range(count)
+    ]
+
+
+def model_bodies(account):
+    serializer = Automationaccountutils.serializer()
+    bodies = [
+        serializer.body(
+            AutomationAccountCreateOrUpdateParameters(
+                name=account["automationaccountname"],
+                location=account["location"],
+                tags={"accounttype": "hec"},
+                sku={"name": "Basic"},
+            ),
+            "AutomationAccountCreateOrUpdateParameters",
+        )
+    ]
+    for runbook in RUNBOOKS:
+        bodies.append(
+            serializer.body(
+                RunbookCreateOrUpdateParameters(
+                    runbook_type="Python3",
+                    name=runbook["name"],
+                    location=account["location"],
+                    tags=runbook["tags"],
+                    log_verbose="true",
+                    log_progress="true",
+                    publish_content_link=runbook["publish_content_link"],
+                    description="publishing runbook",
+                    log_activity_trace=0,
+                ),
+                "RunbookCreateOrUpdateParameters",
+            )
+        )
+    for variable in VARIABLES:
+        bodies.append(
+            serializer.body(
+                VariableCreateOrUpdateParameters(
+                    name=variable,
+                    value=json.dumps(account["rg_name"]),
+                    description="runbook_variable",
+                    is_encrypted=False,
+                ),
+                "VariableCreateOrUpdateParameters",
+            )
+        )
+    bodies.append(
+        serializer.body(
+            ScheduleCreateOrUpdateParameters(
+                name=SCHEDULE["schedule_name"],
+                **{
+                    key: value
+                    for key, value in SCHEDULE.items()
+                    if key != "schedule_name"
+                },
+            ),
+            "ScheduleCreateOrUpdateParameters",
+        )
+    )
+    for runbook in RUNBOOKS:
+        bodies.append(
+            serializer.body(
+                JobScheduleCreateParameters(
+                    schedule=ScheduleAssociationProperty(
+                        name=SCHEDULE["schedule_name"]
+                    ),
+                    runbook=RunbookAssociationProperty(name=runbook["name"]),
+                ),
+                "JobScheduleCreateParameters",
+            )
+        )
+    # azure-core encodes json= bodies when the request is built
+    return [json.dumps(body).encode() for body in bodies]
+
+
+def template_bodies(account):
+    bodies = [
+        Automationaccountutils.aacreate_or_update_parameters(
+            accountname=account["automationaccountname"],
+            location=account["location"],
+            tags={"accounttype": "hec"},
+            sku={"name": "Basic"},
+        )
+    ]
+    for runbook in RUNBOOKS:
+        bodies.append(
+            Automationaccountutils.aacreate_or_update_runbook_parameter(
+                name=runbook["name"],
+                location=account["location"],
+                tags=runbook["tags"],
+                log_verbose="true",
+                log_progress="true",
+                runbook_type="Python3",
+                publish_content_link=runbook["publish_content_link"],
+                description="publishing runbook",
+                log_activity_trace=0,
+            )
+        )
+    for variable in VARIABLES:
+        bodies.append(
+            Automationaccountutils.aaupdate_runbook_variables(
+                variable_name=variable,
+                variable_value=json.dumps(account["rg_name"]),
+                description="runbook_variable",
+                is_encrypted=False,
+            )
+        )
+    bodies.append(
+        Automationaccountutils.aacreate_or_update_schedule_parameter(**SCHEDULE)
+    )
+    for runbook in RUNBOOKS:
+        bodies.append(
+            Automationaccountutils.aalink_runbook_to_aa(
+                schedule_name=SCHEDULE["schedule_name"],
+                runbook_name=runbook["name"],
+                run_on=None,
+                addparameters=None,
+            )
+        )
+    return bodies
+
+
+def measure(builder, estate, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        for account in estate:
+            builder(account)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main(args):
+    estate = accounts(args.accounts)
+    sample = estate[0]
+    assert [json.loads(body) for body in model_bodies(sample)] == [
+        json.loads(body) for body in template_bodies(sample)
+    ], "template bodies differ from the SDK serialisation"
+    bodies = len(model_bodies(sample))
+    print(f"{args.accounts} accounts, {bodies} request bodies per account")
+    print(f"{'builder':<12}{'total ms':>12}{'us/account':>14}{'us/body':>10}")
+    for name, builder in (("model", model_bodies), ("template", template_bodies)):
+        elapsed = measure(builder, estate, args.runs)
+        print(
+            f"{name:<12}{elapsed * 1000:>12.1f}{elapsed / args.accounts * 1e6:>14.1f}"
+            f"{elapsed / args.accounts / bodies * 1e6:>10.2f}"
+        )
+    print(f"template cache {Automationaccountutils.stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=3)
+    main(parser.parse_args())
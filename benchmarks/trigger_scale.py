@@ -0,0 +1,175 @@
+# Drives the whole http_trigger_automation_account against the offline fake in
+# fakes/azure_backend.py for synthetic estates of increasing size and reports wall
+# time, peak memory, request count and connections opened. Every size runs in a
+# fresh interpreter so peak RSS and the module level caches start clean.
+#   python -m benchmarks.trigger_scale
+#   python -m benchmarks.trigger_scale --sizes 10 100 --latency 0.05 --throttle-rate 0.02
+#   python -m benchmarks.trigger_scale --param discovery_backend=resourcegraph --param reconcile=true
+# The ARM rate limit and package polling are scaled down so the numbers measure
+# this code rather than the configured waits; override them with --env.
+import argparse, base64, json, os, resource, subprocess, sys, tempfile, time
+
+SETTINGS = {
+    "scriptstoragename": "benchstorage",
+    "containername": "runbooks",
+    "backuprunbookblob": "afs_backuprunbook.py",
+    "deletionrunbookblob": "afs_deletionrunbook.py",
+    "backupsastoken": "?sv=2022-11-02&sp=r&sig=fake",
+    "deletionsastoken": "?sv=2022-11-02&sp=r&sig=fake",
+    "storageaccountendpoint": "https://benchstorage.blob.core.windows.net",
+    "storage_connection_str": (
+        "DefaultEndpointsProtocol=https;AccountName=benchstorage;"
+        f"AccountKey={base64.b64encode(b'0' * 64).decode()};EndpointSuffix=core.windows.net"
+    ),
+    "schedule_name": "afs_daily",
+    "automationaccounttags": "hec",
+    "automationaccountsku": "Basic",
+    "RetentionDays": "30",
+    "report_format": "none",
+    "arm_requests_per_second": "100000",
+    "arm_request_burst": "100000",
+    "arm_backoff_base": "0.05",
+    "arm_backoff_max": "1",
+    "python_package_poll_interval": "0.05",
+    "python_package_poll_max_interval": "0.2",
+    "publish_progress_interval": "3600",
+}
+
+
+async def run_trigger(size, args):
+    import azure.functions as func
+    import function_app
+    from fakes.azure_backend import (
+        FakeAzureBackend,
+        FakeClientRegistry,
+        synthetic_estate,
+    )
+    from services.blob_service import BlobService
+
+    subscriptions = [
+        sub["subid"]
+        for tenant in function_app.subscription_list()
+        for sub in tenant["data"]
+    ]
+    backend = FakeAzureBackend(
+        synthetic_estate(size, subscriptions),
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        failure_rate=args.failure_rate,
+        connection_limit_per_host=int(
+            os.getenv("http_connection_limit_per_host", "50")
+        ),
+    )
+    for setting in ("backuprunbookblob", "deletionrunbookblob"):
+        backend.put_blob(
+            os.environ["containername"], os.environ[setting], b"# runbook\n" * 2048
+        )
+    BlobService.transport_factory = backend.transport
+    client_registry = FakeClientRegistry(backend).install()
+    trigger = function_app.http_trigger_automation_account
+    if hasattr(trigger, "build"):
+        trigger = trigger.build().get_user_function()
+    request = func.HttpRequest(
+        method="GET",
+        url="/api/http_trigger_automation_account",
+        body=b"",
+        params=dict(param.split("=", 1) for param in args.param),
+    )
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    await trigger(request)
+    wall = time.perf_counter() - started
+    await client_registry.close()
+    return {
+        "size": size,
+        "wall": wall,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_growth_mb": (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        )
+        / 1024,
+        "accounts": len(backend.resources),
+        **backend.stats,
+        "operations": dict(backend.operations),
+    }
+
+
+def child(args):
+    import asyncio
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # The package hash is read from a local mirror instead of PyPI
+        with open(
+            os.path.join(workdir, "azure_mgmt_resource-23.2.0-py3-none-any.whl"), "wb"
+        ) as wheel:
+            wheel.write(os.urandom(256 * 1024))
+        os.environ.setdefault("python_package_mirror", workdir)
+        os.environ.setdefault(
+            "runbook_cache_path", os.path.join(workdir, "runbook_cache.json")
+        )
+        for key, value in SETTINGS.items():
+            os.environ.setdefault(key, value)
+        result = asyncio.run(run_trigger(args.size, args))
+    print(json.dumps(result))
+
+
+def probe(size, args):
+    command = [
+        sys.executable,
+        "-m",
+        "benchmarks.trigger_scale",
+        "--child",
+        "--size",
+        str(size),
+        "--latency",
+        str(args.latency),
+        "--throttle-rate",
+        str(args.throttle_rate),
+        "--failure-rate",
+        str(args.failure_rate),
+    ]
+    for param in args.param:
+        command += ["--param", param]
+    output = subprocess.run(
+        command,
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, **dict(env.split("=", 1) for env in args.env)},
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    if args.child:
+        return child(args)
+    print(
+        f"{'resource groups':>16}{'accounts':>10}{'wall s':>9}{'peak MB':>9}{'growth MB':>11}"
+        f"{'requests':>10}{'429':>7}{'5xx':>7}{'connections':>13}{'peak in flight':>16}"
+    )
+    for size in args.sizes:
+        result = probe(size, args)
+        print(
+            f"{size:>16}{result['accounts']:>10}{result['wall']:>9.2f}"
+            f"{result['peak_rss_mb']:>9.1f}{result['rss_growth_mb']:>11.1f}"
+            f"{result['requests']:>10}{result['throttled']:>7}{result['failed']:>7}"
+            f"{result['connections_opened']:>13}{result['peak_in_flight']:>16}"
+        )
+        if args.operations:
+            for operation, count in sorted(result["operations"].items()):
+                print(f"{'':>16}{operation:<40}{count:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--param", action="append", default=[])
+    parser.add_argument("--env", action="append", default=[])
+    parser.add_argument("--operations", action="store_true")
+    parser.add_argument("--child", action="store_true")
+    parser.add_argument("--size", type=int)
+    main(parser.parse_args())
@@ -0,0 +1,525 @@
+# Offline stand-in for the Automation, Resource Manager, Resource Graph and Blob
+# endpoints the trigger talks to. The real SDK clients are kept, only their
+# transport is swapped, so serialisation, paging, retries and the ARM scheduler
+# all run as in production. Latency, 429 and failure rates are injected per
+# request, and a keep-alive pool per host is simulated to count connections.
+from services.client_registry import AutomationClientRegistry
+from collections import Counter
+from email.utils import formatdate
+from urllib.parse import parse_qs, urlencode, urlparse, unquote
+from azure.core.credentials import AccessToken
+from azure.core.pipeline.transport import AsyncHttpTransport
+from azure.core.rest._http_response_impl_async import AsyncHttpResponseImpl
+from azure.core.utils import case_insensitive_dict
+import asyncio, hashlib, json, random, time
+
+
+def synthetic_estate(
+    resource_groups,
+    subscriptions,
+    storage_per_rg=1,
+    other_groups_ratio=0.1,
+    location="westeurope",
+):
+    """Spreads HEC resource groups round robin over the subscriptions, plus some
+    groups discovery has to skip, in the shape fakes.discovery uses"""
+    estate = {subscription_id: [] for subscription_id in subscriptions}
+    for index in range(resource_groups):
+        subscription_id = subscriptions[index % len(subscriptions)]
+        resources = [
+            {
+                "name": f"hec{index:05d}afs{number}",
+                "kind": "FileStorage",
+                "type": "Microsoft.Storage/storageAccounts",
+            }
+            for number in range(storage_per_rg)
+        ]
+        resources.append(
+            {
+                "name": f"hec{index:05d}diag",
+                "kind": "StorageV2",
+                "type": "Microsoft.Storage/storageAccounts",
+            }
+        )
+        estate[subscription_id].append(
+            {
+                "name": f"HEC{index % 100:02d}-P{index:05d}-rg",
+                "location": location,
+                "resources": resources,
+            }
+        )
+    for index in range(int(resource_groups * other_groups_ratio)):
+        subscription_id = subscriptions[index % len(subscriptions)]
+        estate[subscription_id].append(
+            {"name": f"shared-{index:05d}-rg", "location": location, "resources": []}
+        )
+    return estate
+
+
+class FakeCredential:
+
+    async def get_token(self, *scopes, **kwargs):
+        return AccessToken("fake-token", int(time.time()) + 3600)
+
+    async def close(self):
+        pass
+
+
+class FakeInternalResponse:
+
+    async def close(self):
+        pass
+
+
+class FakeStreamDownload:
+
+    def __init__(self, response) -> None:
+        self.response = response
+        self.content_length = len(response.body())
+
+    def __aiter__(self):
+        return self.response.stream_download_generator(self.response)
+
+
+class FakeResponse(AsyncHttpResponseImpl):
+
+    def __init__(self, request, status_code, body=b"", headers=None) -> None:
+        headers = case_insensitive_dict(headers or {})
+        super().__init__(
+            request=request,
+            internal_response=FakeInternalResponse(),
+            status_code=status_code,
+            reason=FakeAzureBackend.reasons.get(status_code, "OK"),
+            content_type=headers.get("Content-Type"),
+            headers=headers,
+            stream_download_generator=FakeResponse.stream_download_generator,
+        )
+        self._body = body
+        self._content = body
+
+    @staticmethod
+    async def stream_download_generator(
+        response, pipeline=None, decompress=True, **kwargs
+    ):
+        for offset in range(0, len(response._body), response._block_size):
+            yield response._body[offset : offset + response._block_size]
+
+    def body(self):
+        return self._body
+
+    def stream_download(self, pipeline=None, **kwargs):
+        # Storage sets the blob properties on the object it gets back
+        return FakeStreamDownload(self)
+
+    async def load_body(self):
+        self._content = self._body
+
+    async def read(self):
+        self._content = self._body
+        return self._body
+
+
+class FakeAzureBackend:
+
+    reasons = {
+        200: "OK",
+        201: "Created",
+        206: "Partial Content",
+        304: "Not Modified",
+        404: "Not Found",
+        409: "Conflict",
+        429: "Too Many Requests",
+        500: "Internal Server Error",
+    }
+
+    def __init__(
+        self,
+        estate,
+        latency=0.0,
+        jitter=0.5,
+        throttle_rate=0.0,
+        failure_rate=0.0,
+        retry_after_ms=100,
+        package_polls=2,
+        page_size=1000,
+        connection_limit_per_host=50,
+        seed=0,
+    ) -> None:
+        self.estate = estate
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.retry_after_ms = retry_after_ms
+        self.package_polls = package_polls
+        self.page_size = page_size
+        self.connection_limit_per_host = connection_limit_per_host
+        self.random = random.Random(seed)
+        self.resources = {}
+        self.package_gets = Counter()
+        self.blobs = {}
+        self.operations = Counter()
+        self._idle = Counter()
+        self._host_limits = {}
+        self._in_flight = 0
+        self.stats = {
+            "requests": 0,
+            "throttled": 0,
+            "failed": 0,
+            "connections_opened": 0,
+            "connections_reused": 0,
+            "peak_in_flight": 0,
+        }
+
+    def put_blob(self, container_name, blob_name, content):
+        self.blobs[(container_name, blob_name)] = {
+            "content": content,
+            "etag": f'"0x{hashlib.md5(content).hexdigest()[:16].upper()}"',
+        }
+
+    def transport(self):
+        return FakeTransport(self)
+
+    # Connection accounting, a keep-alive pool per host bounded like the connector
+
+    async def _acquire(self, host):
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(self.connection_limit_per_host)
+            self._host_limits[host] = limit
+        await limit.acquire()
+        if self._idle[host]:
+            self._idle[host] -= 1
+            self.stats["connections_reused"] += 1
+        else:
+            self.stats["connections_opened"] += 1
+        self._in_flight += 1
+        self.stats["peak_in_flight"] = max(
+            self.stats["peak_in_flight"], self._in_flight
+        )
+
+    def _release(self, host):
+        self._in_flight -= 1
+        self._idle[host] += 1
+        self._host_limits[host].release()
+
+    async def send(self, request):
+        url = urlparse(request.url)
+        await self._acquire(url.netloc)
+        try:
+            if self.latency:
+                await asyncio.sleep(
+                    self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+                )
+            self.stats["requests"] += 1
+            roll = self.random.random()
+            if roll < self.throttle_rate:
+                self.stats["throttled"] += 1
+                return self.error(
+                    request,
+                    429,
+                    "TooManyRequests",
+                    headers={"x-ms-retry-after-ms": str(self.retry_after_ms)},
+                )
+            if roll < self.throttle_rate + self.failure_rate:
+                self.stats["failed"] += 1
+                return self.error(request, 500, "InternalServerError")
+            if url.netloc.endswith(".blob.core.windows.net"):
+                return self.blob(request, url)
+            return self.arm(request, url)
+        finally:
+            self._release(url.netloc)
+
+    # Responses
+
+    def json_response(self, request, status_code, body, headers=None):
+        return FakeResponse(
+            request,
+            status_code,
+            json.dumps(body).encode(),
+            {"Content-Type": "application/json; charset=utf-8", **(headers or {})},
+        )
+
+    def error(self, request, status_code, code, headers=None):
+        self.operations[f"{request.method} {status_code}"] += 1
+        return self.json_response(
+            request,
+            status_code,
+            {"error": {"code": code, "message": f"Fake {code} for {request.url}"}},
+            {"x-ms-error-code": code, **(headers or {})},
+        )
+
+    def page(self, request, url, items):
+        query = parse_qs(url.query)
+        offset = int(query.get("$skiptoken", ["0"])[0])
+        body = {"value": items[offset : offset + self.page_size]}
+        if offset + self.page_size < len(items):
+            query["$skiptoken"] = [str(offset + self.page_size)]
+            body["nextLink"] = url._replace(query=urlencode(query, doseq=True)).geturl()
+        return self.json_response(request, 200, body)
+
+    # Resource Manager, Resource Graph and Automation
+
+    def arm(self, request, url):
+        segments = [unquote(segment) for segment in url.path.strip("/").split("/")]
+        lowered = [segment.lower() for segment in segments]
+        if lowered[:3] == ["providers", "microsoft.resourcegraph", "resources"]:
+            self.operations["POST resourceGraph"] += 1
+            return self.resource_graph(request)
+        if len(lowered) == 3 and lowered[2] == "resourcegroups":
+            self.operations["GET resourceGroups"] += 1
+            return self.page(
+                request,
+                url,
+                [
+                    {
+                        "id": f"/subscriptions/{segments[1]}/resourceGroups/{rg['name']}",
+                        "name": rg["name"],
+                        "location": rg["location"],
+                        "type": "Microsoft.Resources/resourceGroups",
+                    }
+                    for rg in self.estate.get(segments[1], [])
+                ],
+            )
+        if len(lowered) == 5 and lowered[4] == "resources":
+            self.operations["GET resources"] += 1
+            rg = self.resource_group(segments[1], segments[3])
+            return self.page(
+                request,
+                url,
+                [
+                    {
+                        "id": f"/{'/'.join(segments[:4])}/providers/{resource_type}/{resource['name']}",
+                        "name": resource["name"],
+                        "type": resource_type,
+                        "kind": resource["kind"],
+                        "location": rg["location"] if rg else None,
+                    }
+                    for resource in (rg["resources"] if rg else [])
+                    for resource_type in [
+                        resource.get("type", "Microsoft.Storage/storageAccounts")
+                    ]
+                ],
+            )
+        if "microsoft.storage" in lowered and lowered[-1] == "shares":
+            self.operations["GET fileShares"] += 1
+            return self.page(request, url, [])
+        if "microsoft.automation" in lowered:
+            return self.automation(request, url, segments, lowered)
+        return self.error(request, 404, "ResourceNotFound")
+
+    def resource_group(self, subscription_id, rg_name):
+        for rg in self.estate.get(subscription_id, []):
+            if rg["name"].lower() == rg_name.lower():
+                return rg
+        return None
+
+    def resource_graph(self, request):
+        query = json.loads(request.content or request.body())
+        rows = [
+            {
+                "subscriptionId": subscription_id,
+                "rgName": rg["name"],
+                "rgLocation": rg["location"],
+                "name": resource["name"],
+            }
+            for subscription_id in query["subscriptions"]
+            for rg in self.estate.get(subscription_id, [])
+            if rg["name"].startswith("HEC")
+            for resource in rg["resources"]
+            if resource["kind"] == "FileStorage"
+        ]
+        rows.sort(key=lambda row: (row["subscriptionId"], row["rgName"], row["name"]))
+        options = query.get("options") or {}
+        offset = int(options.get("$skipToken") or 0)
+        top = options.get("$top") or len(rows)
+        data = rows[offset : offset + top]
+        body = {
+            "totalRecords": len(rows),
+            "count": len(data),
+            "resultTruncated": "false",
+            "data": data,
+        }
+        if offset + len(data) < len(rows):
+            body["$skipToken"] = str(offset + len(data))
+        return self.json_response(request, 200, body)
+
+    def automation(self, request, url, segments, lowered):
+        index = lowered.index("automationaccounts")
+        account_key = tuple(lowered[1 : index + 2])
+        account_id = "/" + "/".join(segments[: index + 2])
+        collection = segments[index + 2] if len(segments) > index + 2 else None
+        name = segments[index + 3] if len(segments) > index + 3 else None
+        self.operations[
+            f"{request.method} automationAccounts/{collection or ''}".rstrip("/")
+        ] += 1
+        account = self.resources.get(account_key)
+        if collection is None:
+            if request.method == "PUT":
+                created = account is None
+                body = json.loads(request.content or request.body())
+                account = self.resources.setdefault(account_key, {"collections": {}})
+                account["body"] = self.resource(account_id, segments[index + 1], body)
+                account["body"]["properties"]["state"] = "Ok"
+                return self.json_response(
+                    request, 201 if created else 200, account["body"]
+                )
+            if account is None:
+                return self.error(request, 404, "ResourceNotFound")
+            return self.json_response(request, 200, account["body"])
+        if account is None:
+            return self.error(request, 404, "ParentResourceNotFound")
+        items = account["collections"].setdefault(collection.lower(), {})
+        if name is None:
+            return self.page(request, url, list(items.values()))
+        key = name.lower()
+        if request.method == "PUT":
+            if collection.lower() == "jobschedules" and key in items:
+                return self.error(request, 409, "Conflict")
+            body = json.loads(request.content or request.body())
+            item = self.resource(f"{account_id}/{collection}/{name}", name, body)
+            if collection.lower() == "python3packages":
+                # The version is reported back from the content link
+                item["properties"]["version"] = (
+                    item["properties"].get("contentLink") or {}
+                ).get("version")
+                item["properties"]["provisioningState"] = "Creating"
+                self.package_gets[(account_key, key)] = 0
+            if collection.lower() == "runbooks":
+                item["properties"]["state"] = "Published"
+            if collection.lower() == "jobschedules":
+                item["properties"]["jobScheduleId"] = name
+            items[key] = item
+            return self.json_response(request, 201, item)
+        if key not in items:
+            return self.error(request, 404, "ResourceNotFound")
+        if request.method == "DELETE":
+            del items[key]
+            return FakeResponse(request, 200)
+        if collection.lower() == "python3packages":
+            self.package_gets[(account_key, key)] += 1
+            if self.package_gets[(account_key, key)] >= self.package_polls:
+                items[key]["properties"]["provisioningState"] = "Succeeded"
+        return self.json_response(request, 200, items[key])
+
+    @staticmethod
+    def resource(resource_id, name, body):
+        # The service echoes the parameters back as the resource, properties included
+        body = {key: value for key, value in body.items() if key not in ("id", "name")}
+        body.setdefault("properties", {})
+        return {"id": resource_id, "name": name, **body}
+
+    # Blob storage
+
+    def blob(self, request, url):
+        query = parse_qs(url.query)
+        container_name, _, blob_name = url.path.strip("/").partition("/")
+        blob_name = unquote(blob_name)
+        self.operations[
+            f"{request.method} blob{'' if blob_name else ' container'}"
+        ] += 1
+        if not blob_name:
+            if request.method == "PUT":
+                if (container_name, None) in self.blobs:
+                    return self.blob_error(request, 409, "ContainerAlreadyExists")
+                self.blobs[(container_name, None)] = {}
+                return FakeResponse(request, 201, headers=self.blob_headers('"0x1"'))
+            return self.blob_error(request, 404, "ResourceNotFound")
+        if request.method == "PUT":
+            content = request.content if request.content is not None else request.body()
+            if isinstance(content, str):
+                content = content.encode()
+            content = content or b""
+            if "block" in query.get("comp", []):
+                return FakeResponse(request, 201, headers=self.blob_headers(None))
+            self.put_blob(container_name, blob_name, content)
+            return FakeResponse(
+                request,
+                201,
+                headers=self.blob_headers(
+                    self.blobs[(container_name, blob_name)]["etag"]
+                ),
+            )
+        blob = self.blobs.get((container_name, blob_name))
+        if blob is None:
+            return self.blob_error(request, 404, "BlobNotFound")
+        if request.headers.get("If-None-Match") == blob["etag"]:
+            return FakeResponse(request, 304, headers=self.blob_headers(blob["etag"]))
+        content = blob["content"]
+        byte_range = request.headers.get("x-ms-range") or request.headers.get("Range")
+        headers = self.blob_headers(blob["etag"])
+        headers["x-ms-blob-type"] = "BlockBlob"
+        headers["Content-Type"] = "application/octet-stream"
+        if byte_range:
+            start, _, end = byte_range.split("=", 1)[1].partition("-")
+            start = int(start)
+            end = min(int(end) if end else len(content) - 1, len(content) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+            headers["Content-Length"] = str(end - start + 1)
+            return FakeResponse(request, 206, content[start : end + 1], headers)
+        headers["Content-Length"] = str(len(content))
+        return FakeResponse(request, 200, content, headers)
+
+    @staticmethod
+    def blob_headers(etag):
+        headers = {
+            "Last-Modified": formatdate(usegmt=True),
+            "x-ms-version": "2021-12-02",
+        }
+        if etag is not None:
+            headers["ETag"] = etag
+        return headers
+
+    def blob_error(self, request, status_code, code):
+        self.operations[f"{request.method} {status_code}"] += 1
+        return FakeResponse(
+            request,
+            status_code,
+            headers={"x-ms-error-code": code, **self.blob_headers(None)},
+        )
+
+
+class FakeTransport(AsyncHttpTransport):
+
+    def __init__(self, backend: FakeAzureBackend) -> None:
+        self.backend = backend
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def send(self, request, **kwargs):
+        return await self.backend.send(request)
+
+
+class FakeClientRegistry(AutomationClientRegistry):
+    """Hands every SDK client the fake transport and a static token"""
+
+    def __init__(self, backend: FakeAzureBackend, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.backend = backend
+
+    def transport(self):
+        return self.backend.transport()
+
+    def get_credential(self, tenant_name):
+        credential = self._credentials.get(tenant_name)
+        if credential is None:
+            credential = FakeCredential()
+            self._credentials[tenant_name] = credential
+            self.stats["credentials_created"] += 1
+        return credential
+
+    def install(self):
+        # Taken by AutomationClientRegistry.shared() for the rest of this loop
+        self._loop = asyncio.get_running_loop()
+        AutomationClientRegistry._shared = self
+        return self
@@ -0,0 +1,26 @@
+from fakes.azure_backend import FakeAzureBackend, FakeClientRegistry
+from services.discovery_service import ResourceDiscovery
+from services.resource_graph_discovery import ResourceGraphDiscovery
+
+
+async def compare_discovery_backends(new_sub_list, estate, page_size=2):
+    # Both backends go through the real SDK clients against the same fake estate
+    backend = FakeAzureBackend(estate, page_size=page_size)
+    results = []
+    async with FakeClientRegistry(backend) as registry:
+        for discovery in (
+            ResourceDiscovery(client_registry=registry),
+            ResourceGraphDiscovery(client_registry=registry, page_size=page_size),
+        ):
+            collected = await discovery.collect(new_sub_list)
+            results.append(
+                sorted(
+                    (
+                        {**record, "resource_name": sorted(record["resource_name"])}
+                        for record in collected["data"]
+                    ),
+                    key=lambda record: (record["subscription_id"], record["rg_name"]),
+                )
+            )
+    arm_records, graph_records = results
+    return arm_records == graph_records, arm_records, graph_records
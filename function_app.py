@@ -1,276 +1,465 @@
 import azure.functions as func
-import logging, os, requests
-from azpoe.services import AuthService
-from azure.mgmt.resource import ResourceManagementClient
-from azure.identity import ClientSecretCredential
-from azure.core.credentials import TokenCredential
-import hashlib
-from services.automation_account_service import Automationaccount
-from services.blob_service import BlobService
-from azure.storage.blob.aio import ContainerClient
-import pandas as pd
+import asyncio, logging, os
+from services.runbook_content_cache import runbook_content_cache
+from services.log_policy import log_policy, payload
+
+# The Azure SDKs and the provisioning services are imported inside the trigger,
+# module load only pays for what the Functions host needs to index the app
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
+ACCOUNT_QUEUE = "automation-provisioning"
+AGGREGATE_QUEUE = "automation-aggregate"
 logger = logging.getLogger("azure")
 logger.setLevel(logging.WARNING)
+log_policy.install()
 
 
-def credential_tokenformat(credential_key) -> TokenCredential:
-    try:
-        spn = os.getenv(credential_key, "").strip()
-        if not spn:
-            raise KeyError(f"'{spn}' key not found")
-        spn_values = spn.split(",")
-        cred_dict = {}
-        for v in spn_values:
-            pair = v.split(":")
-            cred_dict[pair[0]] = pair[1]
-        credential = ClientSecretCredential(
-            tenant_id=cred_dict.get("tenantId"),
-            client_id=cred_dict.get("clientId"),
-            client_secret=cred_dict.get("clientSecret"),
-        )
-        return credential
-    except Exception as e:
-        logging.warning(f"Failed to fetch token credential {e}")
-        return None
+async def fetch_runbook_content_link(container_client, runbook_element):
+    from services.blob_service import BlobService
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceNotModifiedError
 
-
-async def fetch_content_link(runbook_publish_names):
-    try:
-        content_link_result = []
-        for runbook_element in runbook_publish_names:
-            blobobj = BlobService(
-                storageaccount_endpoint=os.getenv("storageaccountendpoint"),
-                conn_str=os.getenv("storage_connection_str"),
+    container_name = runbook_element["containername"]
+    blob_name = runbook_element["blobname"]
+    blob_client = container_client.get_blob_client(blob=blob_name)
+    cached = runbook_content_cache.get(container_name, blob_name)
+    if runbook_content_cache.is_fresh(cached):
+        runbook_content_cache.stats["hits"] += 1
+        content_hash_value = cached["content_hash"]
+    else:
+        try:
+            script_stream = await BlobService.hash_blob_stream(
+                blob_client,
+                etag=cached["etag"] if cached is not None else None,
+                match_condition=MatchConditions.IfModified,
             )
-            script_content = await blobobj.read_container_file(
-                blob_name=runbook_element["blobname"],
-                container_name=runbook_element["containername"],
+            logging.info(
+                "Script %s streamed %s bytes", blob_name, script_stream["size"]
             )
-            logging.info(f"Script content is {script_content}")
-            content_hash_value = hashlib.sha256(
-                script_content.encode("utf-8")
-            ).hexdigest()
-            content_hash = {"algorithm": "SHA256", "value": content_hash_value}
-            container_client = ContainerClient.from_connection_string(
-                conn_str=os.getenv("storage_connection_str"),
-                container_name=runbook_element["containername"],
+            content_hash_value = script_stream["hashes"]["sha256"]
+            runbook_content_cache.stats["misses"] += 1
+            runbook_content_cache.put(
+                container_name,
+                blob_name,
+                etag=script_stream["etag"],
+                content_hash=content_hash_value,
+                uri=blob_client.url,
             )
-            blob_client = container_client.get_blob_client(
-                blob=runbook_element["blobname"]
-            )
-            content_link = {
-                "uri": blob_client.url + runbook_element["sastoken"],
-                "content_hash": content_hash,
-                "version": "v1",
-            }
-            content_link_result.append(
-                {
-                    "runbookname": runbook_element["runbookname"],
-                    "contentlink": content_link,
-                }
+        except ResourceNotModifiedError:
+            runbook_content_cache.stats["revalidated"] += 1
+            runbook_content_cache.touch(container_name, blob_name)
+            content_hash_value = cached["content_hash"]
+    content_hash = {"algorithm": "SHA256", "value": content_hash_value}
+    content_link = {
+        "uri": blob_client.url + runbook_element["sastoken"],
+        "content_hash": content_hash,
+        "version": "v1",
+    }
+    return {
+        "runbookname": runbook_element["runbookname"],
+        "contentlink": content_link,
+    }
+
+
+async def fetch_content_link(runbook_publish_names, blob_service):
+    from services.tracing import tracer
+
+    try:
+        with tracer.span("content", operation="fetch_content_link"), log_policy.stage(
+            "content"
+        ):
+            content_link_result = await asyncio.gather(
+                *(
+                    fetch_runbook_content_link(
+                        blob_service.container_client(runbook_element["containername"]),
+                        runbook_element,
+                    )
+                    for runbook_element in runbook_publish_names
+                )
             )
-        logging.info(f"Generating content link succeeded {content_link_result}")
-        return content_link_result
+        runbook_content_cache.save()
+        logging.info(
+            "Generating content link succeeded %s %s",
+            payload([r["runbookname"] for r in content_link_result]),
+            runbook_content_cache.stats,
+        )
+        return list(content_link_result)
     except Exception as e:
         logging.warning(f"Error fetching content link {e}")
 
 
-async def __process(new_sub_list):
+def subscription_list():
+    return [
+        {
+            "tenantName": "CredSAPTenant",
+            "data": [
+                {
+                    "subname": "sap-gcs-az-opseng",
+                    "subid": "b437f37b-b750-489e-bc55-43044286f6e1",
+                    "createdtime": "createdtime",
+                }
+            ],
+        },
+        {
+            "tenantName": "CredSharedTenant",
+            "data": [
+                {
+                    "subname": "sap-gcs-azpoe",
+                    "subid": "2bb552a1-0927-4732-a475-30f97da346b7",
+                    "createdtime": "createdtime",
+                }
+            ],
+        },
+    ]
+
+
+async def desired_state():
+    from services.blob_service import BlobService
+    from utils.variable_registry import VariableRegistry
+    from utils.schedule_spec import ScheduleSpec
+
+    # Onboard variables to the automation accounts
+    variables_names_list = VariableRegistry.names()
+    # Add Runbook to automation account created information
+    runbook_publish_names = [
+        {
+            "runbookname": "afs_backuprunbook",
+            "storagename": os.getenv("scriptstoragename"),
+            "containername": os.getenv("containername"),
+            "blobname": os.getenv("backuprunbookblob"),
+            "sastoken": os.getenv("backupsastoken"),
+        },
+        {
+            "runbookname": "afs_deletionrunbook",
+            "storagename": os.getenv("scriptstoragename"),
+            "containername": os.getenv("containername"),
+            "blobname": os.getenv("deletionrunbookblob"),
+            "sastoken": os.getenv("deletionsastoken"),
+        },
+    ]
+    # fetch content link for runbook
+    async with BlobService(
+        storageaccount_endpoint=os.getenv("storageaccountendpoint"),
+        conn_str=os.getenv("storage_connection_str"),
+    ) as blob_service:
+        runbook_with_contentlink = await fetch_content_link(
+            runbook_publish_names, blob_service=blob_service
+        )
+    if not runbook_with_contentlink:
+        # Publishing nothing would count as complete and be checkpointed as such
+        raise RuntimeError("Runbook content links could not be resolved")
+    # Schedule Automation runbook variables
+    automation_schedule_variables = ScheduleSpec.from_env()
+    # Link Runbooks to schedules created
+    link_runbook_relation_list = ScheduleSpec.links(
+        [runbook["runbookname"] for runbook in runbook_publish_names],
+        automation_schedule_variables,
+    )
+    # import python packages for automation account
+    python_package_list = [
+        {
+            "packagename": "azure-identity",
+            "version": "23.2.0",
+            "packageuri": "https://files.pythonhosted.org/packages/05/ed/85b5e33b2d5ee8ae12228a77f74a484cd6bf58d3288d8524498a02cf0c8c/azure_mgmt_resource-23.2.0-py3-none-any.whl",
+        }
+    ]
+    return {
+        "variables_names_list": variables_names_list,
+        "runbook_with_contentlink": runbook_with_contentlink,
+        "automation_schedule_list": automation_schedule_variables,
+        "link_runbook_relation_list": link_runbook_relation_list,
+        "python_package_list": python_package_list,
+    }
+
+
+async def publish_report(report_writer, rg_with_afs_storage=None):
+    from services.blob_service import BlobService
+
+    report_container = os.getenv("report_container")
+    try:
+        # Rows the run did not stream while provisioning are written here
+        for tenant in rg_with_afs_storage or []:
+            report_writer.start_tenant(tenant["tenantName"])
+            for account in tenant["data"]:
+                report_writer.write(tenant["tenantName"], account)
+    finally:
+        await asyncio.to_thread(report_writer.close)
+    if report_container:
+        async with BlobService(
+            storageaccount_endpoint=os.getenv("storageaccountendpoint"),
+            conn_str=os.getenv("storage_connection_str"),
+        ) as blob_service:
+            await report_writer.upload(blob_service, container_name=report_container)
+
+
+def fanout_orchestrator(backend=None):
+    from services.fanout import FanoutOrchestrator
+    from services.work_queue import WorkQueue
+
+    return FanoutOrchestrator(
+        account_queue=WorkQueue.create(ACCOUNT_QUEUE, backend=backend),
+        aggregate_queue=WorkQueue.create(AGGREGATE_QUEUE, backend=backend),
+        # Nothing else drains local queues, so there is no point waiting
+        aggregate_interval=0.1 if WorkQueue.is_local(backend) else None,
+    )
+
+
+async def provision_account_message(message):
+    from services.provisioning_pipeline import ProvisioningPipeline
+    from services.client_registry import AutomationClientRegistry
+    from services.checkpoint_store import CheckpointStore
+    from services.fanout import FanoutOrchestrator
+    from utils.schedule_spec import ScheduleSpec
+
+    checkpoint_store = CheckpointStore.create(
+        run_id=message["run_id"], backend=message["checkpoint_backend"]
+    )
     try:
-        # subscription_list = [["b437f37b-b750-489e-bc55-43044286f6e1", "CredSAPTenant"]]
-        tenantName = new_sub_list["tenantName"]
-        """subscription_list = [
-            {
-                "subname": "sap-gcs-az-opseng",
-                "subid": "b437f37b-b750-489e-bc55-43044286f6e1",
-                "tenantname": "CredSAPTenant",
-            }
-        ]"""
-        resource_group_with_afs = []
-        for sub in new_sub_list["data"]:
-            credential = credential_tokenformat(credential_key=tenantName)
-            logging.info(f"Processing subscription {sub}")
-            resource_client = ResourceManagementClient(
-                credential=credential,
-                subscription_id=sub["subid"],
-                base_url="https://management.azure.com",
+        # A redelivered message resumes after the stages it already completed
+        await checkpoint_store.load()
+        async with AutomationClientRegistry.scoped(
+            AutomationClientRegistry.shared()
+        ) as client_registry:
+            pipeline = ProvisioningPipeline(
+                **message["desired"],
+                # Start times are set when the message is handled, not when it was
+                # sent, so a delayed or retried message keeps the lead Automation needs
+                automation_schedule_list=ScheduleSpec.build_all(
+                    message["schedule_specs"]
+                ),
+                client_registry=client_registry,
+                reconcile=message["reconcile"],
+                dry_run=message["dry_run"],
+                checkpoint_store=checkpoint_store,
             )
-            rg_list = resource_client.resource_groups.list()
-            filter_query = "resourceType eq 'Microsoft.Storage/storageAccounts'"
-            for rg in rg_list:
-                if rg.name.startswith("HEC"):
-                    resources_list = resource_client.resources.list_by_resource_group(
-                        resource_group_name=rg.name, filter=filter_query
+            try:
+                await FanoutOrchestrator.process(message, pipeline, checkpoint_store)
+            finally:
+                await pipeline.package_hashes.close()
+    finally:
+        await checkpoint_store.close()
+
+
+async def aggregate_run_message(message, orchestrator=None):
+    from services.checkpoint_store import CheckpointStore
+    from services.report_writer import ReportWriter
+
+    orchestrator = orchestrator or fanout_orchestrator(message["work_queue_backend"])
+    checkpoint_store = CheckpointStore.create(
+        run_id=message["run_id"], backend=message["checkpoint_backend"]
+    )
+    try:
+        rg_with_afs_storage = await orchestrator.aggregate(message, checkpoint_store)
+    finally:
+        await checkpoint_store.close()
+    if rg_with_afs_storage is None:
+        return None
+    # Only a complete run writes a report
+    report_writer = ReportWriter.create(report_format=message["report_format"])
+    if report_writer is not None:
+        await publish_report(report_writer, rg_with_afs_storage)
+    return rg_with_afs_storage
+
+
+async def fan_out(req: func.HttpRequest, new_subscription_list):
+    from services.client_registry import AutomationClientRegistry
+    from services.discovery_service import ResourceDiscovery
+    from services.package_hash_cache import PackageHashCache
+    from services.fanout import FanoutOrchestrator
+    from services.work_queue import WorkQueue
+    from utils.schedule_spec import ScheduleSpec
+
+    checkpoint_backend = (
+        req.params.get("checkpoint_backend") or os.getenv("checkpoint_backend", "none")
+    ).lower()
+    backend = (
+        req.params.get("work_queue_backend")
+        or os.getenv("work_queue_backend", "storage")
+    ).lower()
+    # Workers only meet through the checkpoint store. On a shared queue they run on
+    # other instances, where only blob checkpoints are visible
+    if not WorkQueue.is_local(backend) and checkpoint_backend != "blob":
+        raise ValueError(
+            f"Fan-out over the {backend} queue needs checkpoint_backend=blob, "
+            f"got {checkpoint_backend}"
+        )
+    if checkpoint_backend == "none":
+        logging.warning("Fan-out needs a checkpoint store, using sqlite")
+        checkpoint_backend = "sqlite"
+    # Content links and wheel hashes are resolved once here, not once per account
+    desired = await desired_state()
+    # Workers build the schedules from the spec when they handle the message
+    desired.pop("automation_schedule_list")
+    options = {
+        "run_id": req.params.get("run_id") or FanoutOrchestrator.run_id(),
+        "checkpoint_backend": checkpoint_backend,
+        "work_queue_backend": backend,
+        "reconcile": req.params.get("reconcile"),
+        "dry_run": req.params.get("dry_run"),
+        "report_format": req.params.get("report_format"),
+        "desired": desired,
+        "schedule_specs": ScheduleSpec.specs_from_env(),
+    }
+    orchestrator = fanout_orchestrator(backend)
+    async with AutomationClientRegistry.scoped(
+        AutomationClientRegistry.shared()
+    ) as client_registry:
+        async with PackageHashCache(
+            session=client_registry.http_session()
+        ) as package_hashes:
+            for package in desired["python_package_list"]:
+                try:
+                    package["sha256"] = await package_hashes.content_hash(package)
+                except Exception as e:
+                    logging.warning(
+                        f"Error resolving {package['packagename']} {e}, workers retry"
                     )
-                    afs_storage_list = []
-                    for resources in resources_list:
-                        if resources.kind == "FileStorage":
-                            afs_storage_list.append(resources.name)
-                    if len(afs_storage_list) > 0:
-                        automationaccountname = (
-                            "aa"
-                            + str(rg.name.split("-")[0].lower())
-                            + str(rg.name.split("-")[1].lower())
-                            + "backup0001"
-                        )
-                        resource_group_with_afs.append(
-                            {
-                                "subscription_id": sub["subid"],
-                                "subscription_name": sub["subname"],
-                                "rg_name": rg.name,
-                                "resource_name": afs_storage_list,
-                                "createdTime": sub["createdtime"],
-                                "automationaccountname": automationaccountname,
-                                "location": rg.location,
-                            }
-                        )
-        result_dict = {"tenantName": tenantName, "data": resource_group_with_afs}
-        return result_dict
-    except Exception as e:
-        logging.warning(f"Error processing for subscription {e}")
-        return []
+        discovery = ResourceDiscovery.create(
+            client_registry=client_registry,
+            backend=req.params.get("discovery_backend"),
+        )
+        summary = await orchestrator.enqueue(new_subscription_list, discovery, options)
+    if WorkQueue.is_local(backend):
+        summary["result"] = await orchestrator.run_local(
+            handle_account=provision_account_message,
+            handle_aggregate=lambda message: aggregate_run_message(
+                message, orchestrator
+            ),
+        )
+    await orchestrator.account_queue.close()
+    await orchestrator.aggregate_queue.close()
+    return summary
 
 
 @app.route(route="http_trigger_automation_account")
 async def http_trigger_automation_account(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Python HTTP trigger function processed a request.")
-    try:
-        new_subscription_list = [
-            {
-                "tenantName": "CredSAPTenant",
-                "data": [
-                    {
-                        "subname": "sap-gcs-az-opseng",
-                        "subid": "b437f37b-b750-489e-bc55-43044286f6e1",
-                        "createdtime": "createdtime",
-                    }
-                ],
-            },
-            {
-                "tenantName": "CredSharedTenant",
-                "data": [
-                    {
-                        "subname": "sap-gcs-azpoe",
-                        "subid": "2bb552a1-0927-4732-a475-30f97da346b7",
-                        "createdtime": "createdtime",
-                    }
-                ],
-            },
-        ]
-        rg_with_afs_storage = []
-        # fetch resource groups and subscription with AFS account
-        for tenant in new_subscription_list:
-            ans = await __process(tenant)
-            rg_with_afs_storage.append(ans)
-        # Create or update automation account
-        for acc in rg_with_afs_storage:
-            await Automationaccount.create_automation_account(rg_afslist=acc)
-
-        # Onboard variables to the automation accounts
-        variables_names_list = [
-            "EXCLUDE_AFS",
-            "OBJECT_STORAGE",
-            "RESOURCE_GROUP",
-            "RetentionDays",
-            "SUBSCRIPTION_ID",
-        ]
-        for acc in rg_with_afs_storage:
-            await Automationaccount.update_variables_to_automation_account(
-                rg_aa_account_list=acc,
-                variables_names_list=variables_names_list,
-            )
-        # Add Runbook to automation account created information
-        runbook_publish_names = [
-            {
-                "runbookname": "afs_backuprunbook",
-                "storagename": os.getenv("scriptstoragename"),
-                "containername": os.getenv("containername"),
-                "blobname": os.getenv("backuprunbookblob"),
-                "sastoken": os.getenv("backupsastoken"),
-            },
-            {
-                "runbookname": "afs_deletionrunbook",
-                "storagename": os.getenv("scriptstoragename"),
-                "containername": os.getenv("containername"),
-                "blobname": os.getenv("deletionrunbookblob"),
-                "sastoken": os.getenv("deletionsastoken"),
-            },
-        ]
-        # fetch content link for runbook
-        runbook_with_contentlink = await fetch_content_link(runbook_publish_names)
-
-        # publish runbook to the automation accounts
-        for acc in rg_with_afs_storage:
-            await Automationaccount.create_runbook_to_automation_account(
-                rg_automationaccount_list=acc,
-                runbook_with_contentlink=runbook_with_contentlink,
-            )
-        # Schedule Automation runbook variables
-        automation_schedule_variables = [
-            {
-                "name": os.getenv("schedule_name"),
-                "start_time": "2025-01-23T00:00:00Z",
-                "expiry_time": None,
-                "frequency": "Day",
-                "description": None,
-                "interval": "1",
-                "time_zone": "UTC",
-                "advanced_schedule": None,
-            }
-        ]
-        # Create schedules for automation runbooks
-        for acc in rg_with_afs_storage:
-            await Automationaccount.create_automation_account_schedule(
-                automationaccountlist=acc,
-                automation_schedule_list=automation_schedule_variables,
-            )
-        # Link Runbooks to schedules created
-        link_runbook_relation_list = [
-            {
-                "runbookname": "afs_backuprunbook",
-                "schedulename": os.getenv("schedule_name"),
-            },
-            {
-                "runbookname": "afs_deletionrunbook",
-                "schedulename": os.getenv("schedule_name"),
-            },
-        ]
-        for acc in rg_with_afs_storage:
-            await Automationaccount.link_runbook_to_schedule(
-                automationaccountlist=acc,
-                link_runbook_relation_list=link_runbook_relation_list,
+    from services.provisioning_pipeline import ProvisioningPipeline
+    from services.client_registry import AutomationClientRegistry
+    from services.discovery_service import ResourceDiscovery
+    from services.checkpoint_store import CheckpointStore
+    from services.report_writer import ReportWriter
+    from services.tracing import tracer
+
+    new_subscription_list = subscription_list()
+    rg_with_afs_storage = [
+        {"tenantName": tenant["tenantName"], "data": []}
+        for tenant in new_subscription_list
+    ]
+    summary = {}
+    checkpoint_store = None
+    with tracer.run() as run_trace:
+        try:
+            mode = (
+                req.params.get("mode") or os.getenv("provisioning_mode", "inline")
+            ).lower()
+            if mode == "fanout":
+                # Discovery only, every account is provisioned by the queue worker
+                try:
+                    summary = await fan_out(req, new_subscription_list)
+                except ValueError as e:
+                    logging.warning(f"Fan-out rejected {e}")
+                    return func.HttpResponse(str(e), status_code=400)
+                return func.HttpResponse(
+                    "".join(
+                        ReportWriter.json_lines(
+                            summary.pop("result", None) or [], summary
+                        )
+                    ),
+                    status_code=202,
+                    mimetype="application/x-ndjson",
+                )
+            desired = await desired_state()
+            # fetch resource groups and subscription with AFS account and run every
+            # account through all stages as soon as it is discovered
+            checkpoint_store = CheckpointStore.create(
+                run_id=req.params.get("run_id"),
+                backend=req.params.get("checkpoint_backend"),
             )
-        # import python packages for automation account
-        python_package_list = [
-            {
-                "packagename": "azure-identity",
-                "version": "23.2.0",
-                "packageuri": "https://files.pythonhosted.org/packages/05/ed/85b5e33b2d5ee8ae12228a77f74a484cd6bf58d3288d8524498a02cf0c8c/azure_mgmt_resource-23.2.0-py3-none-any.whl",
-            }
-        ]
-        for acc in rg_with_afs_storage:
-            await Automationaccount.install_python_package(
-                automationaccountlist=acc,
-                python_package_list=python_package_list,
+            if checkpoint_store is not None:
+                await checkpoint_store.load()
+            # Rows are streamed to the report as each account finishes
+            report_writer = ReportWriter.create(
+                report_format=req.params.get("report_format")
             )
-        # Report the accounts created
-        with pd.ExcelWriter("automationoutput.xlsx", engine="openpyxl") as writer:
-            for element in rg_with_afs_storage:
-                tenantname = element["tenantName"]
-                data = element["data"]
-                if data:
-                    df = pd.json_normalize(data)
-                    df.to_excel(writer, sheet_name=tenantname[:31], index=False)
-                else:
-                    pd.DataFrame().to_excel(
-                        writer, sheet_name=tenantname[:31], index=False
+            if report_writer is not None:
+                for tenant in new_subscription_list:
+                    report_writer.start_tenant(tenant["tenantName"])
+            async with AutomationClientRegistry.scoped(
+                AutomationClientRegistry.shared()
+            ) as client_registry:
+                # Counters are process wide, this invocation logs its own share
+                stats_baseline = client_registry.snapshot()
+                discovery = ResourceDiscovery.create(
+                    client_registry=client_registry,
+                    backend=req.params.get("discovery_backend"),
+                )
+                pipeline = ProvisioningPipeline(
+                    **desired,
+                    client_registry=client_registry,
+                    concurrency=req.params.get("concurrency"),
+                    reconcile=req.params.get("reconcile"),
+                    dry_run=req.params.get("dry_run"),
+                    checkpoint_store=checkpoint_store,
+                    report_writer=report_writer,
+                )
+                progress_task = asyncio.create_task(pipeline.log_publish_progress())
+                await asyncio.gather(
+                    *(
+                        pipeline.run_stream(
+                            tenant_name=tenant["tenantName"],
+                            accounts=discovery.discover(tenant),
+                            rg_afslist=rg_afslist,
+                        )
+                        for tenant, rg_afslist in zip(
+                            new_subscription_list, rg_with_afs_storage
+                        )
                     )
+                )
+                pipeline.publish_progress.close()
+                await progress_task
+                pipeline.log_plan_summary()
+                pipeline.log_stage_summary()
+                summary["stages"] = pipeline.stage_log.summary()
+                summary["failures"] = pipeline.stage_log.failures()
+                await pipeline.package_hashes.close()
+                client_registry.log_stats(stats_baseline)
+                log_policy.log_stats()
+            # Report the accounts created
+            if report_writer is not None:
+                await publish_report(report_writer)
 
-    except Exception as e:
-        logging.warning(f"Error processing {e}")
+        except Exception as e:
+            logging.warning(f"Error processing {e}")
+        finally:
+            # Stages recorded before a failure are flushed for the next run
+            if checkpoint_store is not None:
+                await checkpoint_store.close()
+    if run_trace is not None:
+        logging.info(f"Run summary\n{run_trace.table()}")
+        summary["trace"] = run_trace.summary()
+    # One json document per account, then the stage and trace summary
     return func.HttpResponse(
-        str(rg_with_afs_storage),
+        "".join(ReportWriter.json_lines(rg_with_afs_storage, summary)),
         status_code=200,
+        mimetype="application/x-ndjson",
     )
+
+
+@app.queue_trigger(
+    arg_name="msg", queue_name=ACCOUNT_QUEUE, connection="AzureWebJobsStorage"
+)
+async def queue_trigger_provision_account(msg: func.QueueMessage) -> None:
+    await provision_account_message(msg.get_json())
+
+
+@app.queue_trigger(
+    arg_name="msg", queue_name=AGGREGATE_QUEUE, connection="AzureWebJobsStorage"
+)
+async def queue_trigger_aggregate_run(msg: func.QueueMessage) -> None:
+    orchestrator = fanout_orchestrator(msg.get_json()["work_queue_backend"])
+    try:
+        await aggregate_run_message(msg.get_json(), orchestrator)
+    finally:
+        await orchestrator.aggregate_queue.close()
+        await orchestrator.account_queue.close()
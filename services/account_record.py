@@ -0,0 +1,122 @@
+import time
+
+
+class AccountRecord:
+    """One discovered automation account and what the stages produced for it.
+
+    Stages keep using account["field"], but only the declared fields exist, so a
+    misspelled key raises instead of quietly becoming a new entry."""
+
+    __slots__ = (
+        "subscription_id",
+        "subscription_name",
+        "rg_name",
+        "resource_name",
+        "createdTime",
+        "automationaccountname",
+        "location",
+        "storage_metrics",
+        "automationaccountid",
+        "variableadditionlist",
+        "published_runbooks",
+        "schedule_id",
+        "schedule_timings",
+        "linkingrunbook",
+        "python_packages",
+        "plannedoperations",
+        "skippedoperations",
+        "stages",
+    )
+    fields = frozenset(__slots__)
+
+    def __init__(self, **values) -> None:
+        for field in self.__slots__:
+            setattr(self, field, None)
+        for key, value in values.items():
+            self[key] = value
+
+    @staticmethod
+    def from_dict(values):
+        if isinstance(values, AccountRecord):
+            return values
+        return AccountRecord(**values)
+
+    @staticmethod
+    def key_of(account):
+        return f"{account['subscription_id']}/{account['rg_name']}/{account['automationaccountname']}"
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(f"AccountRecord has no field {key!r}")
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.fields and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in self.fields else None
+        return default if value is None else value
+
+    def keys(self):
+        return [field for field in self.__slots__ if getattr(self, field) is not None]
+
+    def items(self):
+        return [
+            (field, value)
+            for field in self.__slots__
+            if (value := getattr(self, field)) is not None
+        ]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class StageResultLog:
+    """Append-only outcome of every stage run, one tuple per entry"""
+
+    __slots__ = ("entries",)
+
+    def __init__(self) -> None:
+        self.entries = []
+
+    def append(self, account, stage, status, started=None, error=None):
+        duration = (
+            round(time.perf_counter() - started, 4) if started is not None else 0.0
+        )
+        self.entries.append(
+            (
+                AccountRecord.key_of(account),
+                stage,
+                status,
+                duration,
+                str(error) if error else None,
+            )
+        )
+        # The record keeps the latest status per stage for the report
+        stages = account.get("stages")
+        if stages is None:
+            stages = {}
+            account["stages"] = stages
+        stages[stage] = status
+
+    def summary(self):
+        summary = {}
+        for account_key, stage, status, duration, error in self.entries:
+            counts = summary.setdefault(stage, {})
+            counts[status] = counts.get(status, 0) + 1
+        return summary
+
+    def failures(self):
+        return [
+            {"account": account_key, "stage": stage, "error": error}
+            for account_key, stage, status, duration, error in self.entries
+            if status == "failed"
+        ]
@@ -0,0 +1,212 @@
+from azure.core.pipeline.policies import AsyncHTTPPolicy
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from services.tracing import tracer
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from datetime import datetime, timezone
+import asyncio, logging, os, random, time
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity) -> None:
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    delay = self.blocked_until - now
+                else:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def adapt(self, remaining, low_watermark):
+        if remaining is None:
+            return
+        if remaining >= low_watermark:
+            self.rate = self.base_rate
+        else:
+            self.rate = self.base_rate * max(remaining / low_watermark, 0.1)
+
+
+class ArmRequestScheduler:
+
+    idempotent_methods = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+    retry_statuses = {408, 429, 500, 502, 503, 504}
+    ratelimit_headers = (
+        "x-ms-ratelimit-remaining-subscription-reads",
+        "x-ms-ratelimit-remaining-subscription-writes",
+        "x-ms-ratelimit-remaining-subscription-deletes",
+        "x-ms-ratelimit-remaining-subscription-global-reads",
+        "x-ms-ratelimit-remaining-subscription-global-writes",
+        "x-ms-ratelimit-remaining-tenant-reads",
+        "x-ms-ratelimit-remaining-tenant-writes",
+    )
+
+    def __init__(
+        self,
+        rate=None,
+        burst=None,
+        max_retries=None,
+        backoff_base=None,
+        backoff_max=None,
+    ) -> None:
+        self.rate = float(rate or os.getenv("arm_requests_per_second", "20"))
+        self.burst = float(burst or os.getenv("arm_request_burst", "40"))
+        self.max_retries = int(max_retries or os.getenv("arm_max_retries", "6"))
+        self.backoff_base = float(backoff_base or os.getenv("arm_backoff_base", "1"))
+        self.backoff_max = float(backoff_max or os.getenv("arm_backoff_max", "60"))
+        self.low_watermark = int(os.getenv("arm_ratelimit_low_watermark", "100"))
+        self._buckets = {}
+        self.stats = {}
+
+    def bucket(self, scope):
+        bucket = self._buckets.get(scope)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[scope] = bucket
+            self.stats[scope] = {
+                "requests": 0,
+                "retries": 0,
+                "throttled": 0,
+                "throttle_wait": 0.0,
+            }
+        return bucket
+
+    def policy(self, scope):
+        return ArmThrottlePolicy(self, scope)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    @staticmethod
+    def retry_after(headers):
+        retry_after_ms = headers.get("x-ms-retry-after-ms") or headers.get(
+            "retry-after-ms"
+        )
+        if retry_after_ms:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+        retry_after = headers.get("Retry-After")
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                return None
+
+    def observe(self, scope, headers):
+        remaining = None
+        for header in self.ratelimit_headers:
+            value = headers.get(header)
+            if value is not None:
+                try:
+                    value = int(value)
+                except ValueError:
+                    continue
+                remaining = value if remaining is None else min(remaining, value)
+        self.bucket(scope).adapt(remaining, self.low_watermark)
+
+    @staticmethod
+    def operation(http_request):
+        # "PUT automationAccounts/variables" from the resource types in the path
+        path = urlparse(http_request.url).path.strip("/").split("/")
+        if "providers" in path:
+            provider = len(path) - 1 - path[::-1].index("providers")
+            resource_types = path[provider + 2 :: 2]
+        else:
+            resource_types = path[::2]
+        return f"{http_request.method.upper()} {'/'.join(resource_types)}"
+
+    async def send(self, scope, request, next_send):
+        with tracer.span(
+            "arm", operation=self.operation(request.http_request), subscription=scope
+        ) as span:
+            response = await self._send(scope, request, next_send)
+            if span is not None and response.http_response.status_code >= 400:
+                span.status = str(response.http_response.status_code)
+            return response
+
+    async def _send(self, scope, request, next_send):
+        bucket = self.bucket(scope)
+        stats = self.stats[scope]
+        idempotent = request.http_request.method.upper() in self.idempotent_methods
+        attempt = 0
+        while True:
+            stats["throttle_wait"] += await bucket.acquire()
+            stats["requests"] += 1
+            try:
+                response = await next_send(request)
+            except ServiceRequestError:
+                # The request never reached ARM, safe to resend any method
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+            except ServiceResponseError:
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                headers = response.http_response.headers
+                self.observe(scope, headers)
+                status = response.http_response.status_code
+                # A 429 is rejected before ARM processes it, so any method may resend
+                if (
+                    status not in self.retry_statuses
+                    or not (idempotent or status == 429)
+                    or attempt >= self.max_retries
+                ):
+                    return response
+                delay = self.retry_after(headers)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                if status == 429:
+                    stats["throttled"] += 1
+                    bucket.pause(delay)
+                logging.info(
+                    f"ARM {status} for {scope}, retry {attempt + 1} in {delay:.1f}s"
+                )
+            attempt += 1
+            stats["retries"] += 1
+            tracer.add_retry()
+            stats["throttle_wait"] += delay
+            await asyncio.sleep(delay)
+
+
+class ArmThrottlePolicy(AsyncHTTPPolicy):
+
+    def __init__(self, scheduler: ArmRequestScheduler, scope) -> None:
+        super().__init__()
+        self.scheduler = scheduler
+        self.scope = scope
+
+    async def send(self, request):
+        return await self.scheduler.send(self.scope, request, self.next.send)
@@ -1,435 +1,512 @@
-from azure.mgmt.automation.aio import AutomationClient
-from azpoe.services import AuthService
-from azure.mgmt.automation.operations import Python3PackageOperations
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 from utils.automationaccountutils import Automationaccountutils
-import logging, os, json, random, uuid
+from utils.variable_registry import VariableRegistry
+from utils.schedule_spec import ScheduleSpec
+from services.reconciliation_service import ReconciliationService
+from services.package_hash_cache import PackageHashCache
+from services.log_policy import payload
+import asyncio, functools, logging, os, random, time, uuid
 
 
 class Automationaccount:
 
     @staticmethod
-    async def create_automation_account(rg_afslist: list[dict]):
-
+    async def provision_automation_account(automation_client, account, plan=None):
+        if plan is not None and not plan.needs("automation_account"):
+            account["automationaccountid"] = plan.state["account"]["id"]
+            return
         try:
-            logging.info(f"Processing creation of account {rg_afslist}")
-            credential, cloud = AuthService.get_credential(rg_afslist["tenantName"])
-            async with credential:
-                for account in rg_afslist["data"]:
-                    try:
-                        automation_client = AutomationClient(
-                            credential=credential,
-                            subscription_id=account["subscription_id"],
-                        )
-                        async with automation_client:
-                            creation_aa_result = None
-                            creation_aa_result = await automation_client.automation_account.create_or_update(
-                                resource_group_name=account["rg_name"],
-                                automation_account_name=account[
-                                    "automationaccountname"
-                                ],
-                                parameters=Automationaccountutils.aacreate_or_update_parameters(
-                                    accountname=account["automationaccountname"],
-                                    location=account["location"],
-                                    tags={
-                                        "accounttype": os.getenv(
-                                            "automationaccounttags"
-                                        )
-                                    },
-                                    sku={"name": os.getenv("automationaccountsku")},
-                                ),
-                            )
-                            account["automationaccountid"] = (
-                                creation_aa_result.id if creation_aa_result else None
-                            )
-                            logging.info(
-                                f"Automation Account creation result {creation_aa_result}"
-                            )
-                    except Exception as e:
-                        logging.warning(
-                            f"Error creating account for automation {account['subscription_id']} {e}"
-                        )
-
+            creation_aa_result = None
+            creation_aa_result = (
+                await automation_client.automation_account.create_or_update(
+                    resource_group_name=account["rg_name"],
+                    automation_account_name=account["automationaccountname"],
+                    parameters=Automationaccountutils.aacreate_or_update_parameters(
+                        accountname=account["automationaccountname"],
+                        location=account["location"],
+                        tags={"accounttype": os.getenv("automationaccounttags")},
+                        sku={"name": os.getenv("automationaccountsku")},
+                    ),
+                )
+            )
+            account["automationaccountid"] = (
+                creation_aa_result.id if creation_aa_result else None
+            )
+            logging.info(
+                "Automation Account creation result %s", payload(creation_aa_result)
+            )
         except Exception as e:
-            logging.warning(f"Error creating the automation account {e}")
+            logging.warning(
+                f"Error creating account for automation {account['subscription_id']} {e}"
+            )
+
+    @staticmethod
+    async def provision_runbook(automation_client, account, runbooks):
+        runbookname = runbooks["runbookname"]
+        runbookcontentlink = runbooks["contentlink"]
+        runbook_creation = await automation_client.runbook.create_or_update(
+            resource_group_name=account["rg_name"],
+            automation_account_name=account["automationaccountname"],
+            runbook_name=runbookname,
+            parameters=Automationaccountutils.aacreate_or_update_runbook_parameter(
+                name=runbookname,
+                location=account["location"],
+                tags={
+                    "servicenow_instance": "itsm.sap.com",
+                    "contenthash": runbookcontentlink["content_hash"]["value"],
+                },
+                log_verbose="true",
+                log_progress="true",
+                runbook_type="Python3",
+                publish_content_link=runbookcontentlink,
+                description="publishing runbook",
+                log_activity_trace=0,
+            ),
+        )
+        if runbook_creation is not None:
+            logging.info("Runbook creation succeeded %s", payload(runbook_creation))
+        return {
+            "runbookname": runbookname,
+            "runbookid": (runbook_creation.id if runbook_creation else None),
+            "content_hash": runbookcontentlink["content_hash"]["value"],
+        }
 
     @staticmethod
-    async def create_runbook_to_automation_account(
-        rg_automationaccount_list: list[dict], runbook_with_contentlink
+    async def provision_runbooks(
+        automation_client,
+        account,
+        runbook_with_contentlink,
+        plan=None,
+        progress=None,
     ):
+        published_runbooks = []
+        pending = []
+        for runbooks in runbook_with_contentlink:
+            runbookname = runbooks["runbookname"]
+            if plan is not None and not plan.needs("runbook", runbookname):
+                deployed = plan.state["runbooks"][runbookname]
+                published_runbooks.append(
+                    {
+                        "runbookname": runbookname,
+                        "runbookid": deployed["id"],
+                        "content_hash": deployed["content_hash"],
+                    }
+                )
+                if progress is not None:
+                    progress.record(runbookname, "skipped")
+                continue
+            pending.append(runbooks)
+        results = await asyncio.gather(
+            *(
+                Automationaccount.provision_runbook(
+                    automation_client, account, runbooks
+                )
+                for runbooks in pending
+            ),
+            return_exceptions=True,
+        )
+        for runbooks, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logging.warning(
+                    f"Failed to publish runbook {runbooks['runbookname']} for aa {result}"
+                )
+                outcome = "failed"
+            else:
+                published_runbooks.append(result)
+                outcome = "published"
+            if progress is not None:
+                progress.record(runbooks["runbookname"], outcome)
+        account["published_runbooks"] = published_runbooks
+
+    @staticmethod
+    async def current_variable(automation_client, account, var):
         try:
-            logging.info(f"Processing Runbook creation for {rg_automationaccount_list}")
-            logging.info(f"Processing Runbook creation for {runbook_with_contentlink}")
-            credential, cloud = AuthService.get_credential(
-                rg_automationaccount_list["tenantName"]
+            variable = await automation_client.variable.get(
+                resource_group_name=account["rg_name"],
+                automation_account_name=account["automationaccountname"],
+                variable_name=var,
             )
-            async with credential:
-                for account in rg_automationaccount_list["data"]:
-                    try:
-                        automation_client = AutomationClient(
-                            credential=credential,
-                            subscription_id=account["subscription_id"],
-                        )
-                        async with automation_client:
-                            for runbooks in runbook_with_contentlink:
-                                runbookname = runbooks["runbookname"]
-                                runbookcontentlink = runbooks["contentlink"]
-                                runbook_creation = None
-                                runbook_creation = await automation_client.runbook.create_or_update(
-                                    resource_group_name=account["rg_name"],
-                                    automation_account_name=account[
-                                        "automationaccountname"
-                                    ],
-                                    runbook_name=runbookname,
-                                    parameters=Automationaccountutils.aacreate_or_update_runbook_parameter(
-                                        name=runbookname,
-                                        location=account["location"],
-                                        tags={"servicenow_instance": "itsm.sap.com"},
-                                        log_verbose="true",
-                                        log_progress="true",
-                                        runbook_type="Python3",
-                                        publish_content_link=runbookcontentlink,
-                                        description="publishing runbook",
-                                        log_activity_trace=0,
-                                    ),
-                                )
-                                account["published_runbooks"] = {
-                                    "runbookname": runbookname,
-                                    "runbookid": (
-                                        runbook_creation.id
-                                        if runbook_creation
-                                        else None
-                                    ),
-                                }
-                                if runbook_creation is not None:
-                                    logging.info(
-                                        f"Runbook creation succeeded {runbook_creation}"
-                                    )
-                    except Exception as e:
-                        logging.warning(f"Failed to publish runbook for aa {e}")
+        except ResourceNotFoundError:
+            return None
+        return variable.value
 
-        except Exception as e:
-            logging.warning(f"Error while creating or updating runbook in aa {e} ")
+    @staticmethod
+    async def provision_variable(automation_client, account, var, plan=None):
+        variable = VariableRegistry.get(var)
+        if (plan is None or plan.state is None) and VariableRegistry.sticky(var):
+            # Without a plan nothing was read, a sticky value is kept if it still fits
+            current_value = await Automationaccount.current_variable(
+                automation_client, account, var
+            )
+            if VariableRegistry.matches(account, var, current_value):
+                logging.info("Variable kept %s", var)
+                return {var: current_value}
+        variable_addition_result = await automation_client.variable.create_or_update(
+            resource_group_name=account["rg_name"],
+            automation_account_name=account["automationaccountname"],
+            variable_name=var,
+            parameters=Automationaccountutils.aaupdate_runbook_variables(
+                variable_name=var,
+                variable_value=VariableRegistry.resolve(account, var),
+                description=variable["description"],
+                is_encrypted=variable["is_encrypted"],
+            ),
+        )
+        logging.info("Variable added %s", var)
+        return {variable_addition_result.name: variable_addition_result.value}
 
     @staticmethod
-    async def update_variables_to_automation_account(
-        rg_aa_account_list, variables_names_list
+    async def provision_variables(
+        automation_client, account, variables_names_list, plan=None
     ):
-        logging.info(f"Adding variables to automation account {rg_aa_account_list}")
-        try:
-            credential, cloud = AuthService.get_credential(
-                rg_aa_account_list["tenantName"]
-            )
-            async with credential:
-                for account in rg_aa_account_list["data"]:
-                    try:
-                        automation_client = AutomationClient(
-                            credential=credential,
-                            subscription_id=account["subscription_id"],
-                        )
-                        logging.info(f"Created Automation client {automation_client}")
-                        async with automation_client:
-                            variable_addition_list = []
-                            for var in variables_names_list:
-                                logging.info(f"Adding variable {var}")
-                                variable_addition_result = None
-                                if var == "EXCLUDE_AFS":
-                                    variable_addition_result = await automation_client.variable.create_or_update(
-                                        resource_group_name=account["rg_name"],
-                                        automation_account_name=account[
-                                            "automationaccountname"
-                                        ],
-                                        variable_name=var,
-                                        parameters=Automationaccountutils.aaupdate_runbook_variables(
-                                            variable_name=var,
-                                            variable_value=json.dumps(
-                                                "vol-install-xsc"
-                                            ),
-                                            description="runbook_variable",
-                                            is_encrypted=False,
-                                        ),
-                                    )
-                                    variable_addition_list.append(
-                                        {
-                                            f"{variable_addition_result.name}": {
-                                                variable_addition_result.value
-                                            }
-                                        }
-                                    )
-                                    logging.info(
-                                        f"Variable added {var} {variable_addition_result}"
-                                    )
-                                elif var == "OBJECT_STORAGE":
-                                    variable_addition_result = await automation_client.variable.create_or_update(
-                                        resource_group_name=account["rg_name"],
-                                        automation_account_name=account[
-                                            "automationaccountname"
-                                        ],
-                                        variable_name=var,
-                                        parameters=Automationaccountutils.aaupdate_runbook_variables(
-                                            variable_name=var,
-                                            variable_value=json.dumps(
-                                                random.choice(account["resource_name"])
-                                            ),
-                                            description="runbook_variable",
-                                            is_encrypted=False,
-                                        ),
-                                    )
-                                    variable_addition_list.append(
-                                        {
-                                            f"{variable_addition_result.name}": {
-                                                variable_addition_result.value
-                                            }
-                                        }
-                                    )
-                                    logging.info(
-                                        f"Variable added {var} {variable_addition_result}"
-                                    )
-                                elif var == "RESOURCE_GROUP":
-                                    variable_addition_result = await automation_client.variable.create_or_update(
-                                        resource_group_name=account["rg_name"],
-                                        automation_account_name=account[
-                                            "automationaccountname"
-                                        ],
-                                        variable_name=var,
-                                        parameters=Automationaccountutils.aaupdate_runbook_variables(
-                                            variable_name=var,
-                                            variable_value=json.dumps(
-                                                account["rg_name"]
-                                            ),
-                                            description="runbook_variable",
-                                            is_encrypted=False,
-                                        ),
-                                    )
-                                    variable_addition_list.append(
-                                        {
-                                            f"{variable_addition_result.name}": {
-                                                variable_addition_result.value
-                                            }
-                                        }
-                                    )
-                                    logging.info(
-                                        f"Variable added {var} {variable_addition_result}"
-                                    )
-                                elif var == "RetentionDays":
-                                    variable_addition_result = await automation_client.variable.create_or_update(
-                                        resource_group_name=account["rg_name"],
-                                        automation_account_name=account[
-                                            "automationaccountname"
-                                        ],
-                                        variable_name=var,
-                                        parameters=Automationaccountutils.aaupdate_runbook_variables(
-                                            variable_name=var,
-                                            variable_value=json.dumps(
-                                                os.getenv("RetentionDays")
-                                            ),
-                                            description="runbook_variable",
-                                            is_encrypted=False,
-                                        ),
-                                    )
-                                    variable_addition_list.append(
-                                        {
-                                            f"{variable_addition_result.name}": {
-                                                variable_addition_result.value
-                                            }
-                                        }
-                                    )
-                                    logging.info(
-                                        f"Variable added {var} {variable_addition_result}"
-                                    )
-                                elif var == "SUBSCRIPTION_ID":
-                                    variable_addition_result = await automation_client.variable.create_or_update(
-                                        resource_group_name=account["rg_name"],
-                                        automation_account_name=account[
-                                            "automationaccountname"
-                                        ],
-                                        variable_name=var,
-                                        parameters=Automationaccountutils.aaupdate_runbook_variables(
-                                            variable_name=var,
-                                            variable_value=json.dumps(
-                                                account["subscription_id"]
-                                            ),
-                                            description="runbook_variable",
-                                            is_encrypted=False,
-                                        ),
-                                    )
-                                    variable_addition_list.append(
-                                        {
-                                            f"{variable_addition_result.name}": {
-                                                variable_addition_result.value
-                                            }
-                                        }
-                                    )
-                                    logging.info(
-                                        f"Variable added {var} {variable_addition_result}"
-                                    )
-                            account["variableadditionlist"] = variable_addition_list
-                    except Exception as e:
-                        logging.warning(
-                            f"Error with adding of variables for {account} {e}"
-                        )
-                        logging.error(f"Error with adding variables {e}", exc_info=True)
-                        raise
-        except Exception as e:
-            logging.warning(f"Error updating variables to automation account {e}")
+        variable_addition_list = []
+        pending = []
+        for var in variables_names_list:
+            if VariableRegistry.get(var) is None:
+                logging.warning(f"Variable {var} is not registered")
+                continue
+            if plan is not None and not plan.needs("variable", var):
+                variable_addition_list.append({var: plan.state["variables"][var]})
+                continue
+            pending.append(var)
+        results = await asyncio.gather(
+            *(
+                Automationaccount.provision_variable(
+                    automation_client, account, var, plan
+                )
+                for var in pending
+            ),
+            return_exceptions=True,
+        )
+        errors = []
+        for var, result in zip(pending, results):
+            if isinstance(result, Exception):
+                errors.append(f"{var}: {result}")
+            else:
+                variable_addition_list.append(result)
+        account["variableadditionlist"] = variable_addition_list
+        if errors:
+            raise RuntimeError(f"Failed to add variables {errors}")
+
+    @staticmethod
+    async def existing(plan, kind, lister):
+        # A plan without state means the read failed, list as before
+        if plan is not None and plan.state is not None:
+            return plan.state[kind]
+        return dict(
+            [ReconciliationService.state_entry(kind, item) async for item in lister()]
+        )
+
+    @staticmethod
+    def lister(operations, account):
+        return functools.partial(
+            operations.list_by_automation_account,
+            resource_group_name=account["rg_name"],
+            automation_account_name=account["automationaccountname"],
+        )
+
+    @staticmethod
+    async def provision_schedule(automation_client, account, sch):
+        create_schedule = await automation_client.schedule.create_or_update(
+            resource_group_name=account["rg_name"],
+            automation_account_name=account["automationaccountname"],
+            schedule_name=sch["name"],
+            parameters=Automationaccountutils.aacreate_or_update_schedule_parameter(
+                schedule_name=sch["name"],
+                start_time=sch["start_time"],
+                expiry_time=sch["expiry_time"],
+                frequency=sch["frequency"],
+                description=sch["description"],
+                interval=sch["interval"],
+                time_zone=sch["time_zone"],
+                advanced_schedule=sch["advanced_schedule"],
+            ),
+        )
+        if create_schedule is not None:
+            logging.info("Schedule created with %s", payload(create_schedule))
+        return {
+            "schedule_name": create_schedule.name,
+            "schedule_id": create_schedule.id,
+        }
 
     @staticmethod
-    async def create_automation_account_schedule(
-        automationaccountlist, automation_schedule_list
+    async def provision_schedules(
+        automation_client, account, automation_schedule_list, plan=None
     ):
-        try:
-            logging.info(f"Automation account list {automationaccountlist}")
-            credential, cloud = AuthService.get_credential(
-                automationaccountlist["tenantName"]
-            )
-            async with credential:
-                for account in automationaccountlist["data"]:
-                    try:
-                        automation_client = AutomationClient(
-                            credential=credential,
-                            subscription_id=account["subscription_id"],
-                        )
-                        async with automation_client:
-                            schedule_id_list = []
-                            for sch in automation_schedule_list:
-                                try:
-                                    create_schedule = None
-                                    create_schedule = await automation_client.schedule.create_or_update(
-                                        resource_group_name=account["rg_name"],
-                                        automation_account_name=account[
-                                            "automationaccountname"
-                                        ],
-                                        schedule_name=os.getenv("schedule_name"),
-                                        parameters=Automationaccountutils.aacreate_or_update_schedule_parameter(
-                                            schedule_name=sch["name"],
-                                            start_time=sch["start_time"],
-                                            expiry_time=sch["expiry_time"],
-                                            frequency=sch["frequency"],
-                                            description=sch["description"],
-                                            interval=sch["interval"],
-                                            time_zone=sch["time_zone"],
-                                            advanced_schedule=sch["advanced_schedule"],
-                                        ),
-                                    )
-                                    schedule_id_list.append(
-                                        {
-                                            "schedule_name": create_schedule.name,
-                                            "schedule_id": create_schedule.id,
-                                        }
-                                    )
-                                    if create_schedule is not None:
-                                        logging.info(
-                                            f"Schedule created with {create_schedule}"
-                                        )
+        started = time.perf_counter()
+        existing = await Automationaccount.existing(
+            plan,
+            "schedules",
+            Automationaccount.lister(automation_client.schedule, account),
+        )
+        lookup = time.perf_counter() - started
+        schedule_id_list = []
+        schedule_timings = {}
+        pending = []
+        for sch in automation_schedule_list:
+            if ScheduleSpec.matches(existing.get(sch["name"]), sch):
+                schedule_id_list.append(
+                    {
+                        "schedule_name": sch["name"],
+                        "schedule_id": existing[sch["name"]]["id"],
+                    }
+                )
+                schedule_timings[sch["name"]] = {
+                    "action": "skip",
+                    "lookup": round(lookup, 4),
+                    "write": 0.0,
+                }
+                continue
+            pending.append(sch)
 
-                                except Exception as e:
-                                    logging.warning(
-                                        f"Error creating schedule {sch} {e}"
-                                    )
-                            account["schedule_id"] = schedule_id_list
-                    except Exception as e:
-                        logging.warning(f"Error with automation client {account}")
+        async def timed(sch):
+            write_started = time.perf_counter()
+            try:
+                return await Automationaccount.provision_schedule(
+                    automation_client, account, sch
+                )
+            finally:
+                schedule_timings[sch["name"]] = {
+                    "action": "update" if sch["name"] in existing else "create",
+                    "lookup": round(lookup, 4),
+                    "write": round(time.perf_counter() - write_started, 4),
+                }
 
-        except Exception as e:
-            logging.warning(f"Error creating a Automation account schedule {e}")
+        results = await asyncio.gather(
+            *(timed(sch) for sch in pending), return_exceptions=True
+        )
+        for sch, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logging.warning(f"Error creating schedule {sch['name']} {result}")
+                schedule_timings[sch["name"]]["action"] = "failed"
+                continue
+            schedule_id_list.append(result)
+        account["schedule_id"] = schedule_id_list
+        account["schedule_timings"] = schedule_timings
+        logging.info(
+            "Schedule timings for %s %s",
+            account["automationaccountname"],
+            payload(schedule_timings),
+        )
+
+    @staticmethod
+    def job_schedule_id(account, runbookname, schedulename):
+        # Stable per link so a rerun addresses the same job schedule
+        return str(
+            uuid.uuid5(
+                uuid.NAMESPACE_URL,
+                f"{account['subscription_id']}/{account['rg_name']}/"
+                f"{account['automationaccountname']}/{runbookname}/{schedulename}",
+            )
+        )
 
     @staticmethod
-    async def link_runbook_to_schedule(
-        automationaccountlist, link_runbook_relation_list
+    async def provision_runbook_link(
+        automation_client, account, runbookname, schedulename
     ):
+        job_schedule_id = Automationaccount.job_schedule_id(
+            account, runbookname, schedulename
+        )
         try:
+            link_runbook_result = await automation_client.job_schedule.create(
+                resource_group_name=account["rg_name"],
+                automation_account_name=account["automationaccountname"],
+                job_schedule_id=job_schedule_id,
+                parameters=Automationaccountutils.aalink_runbook_to_aa(
+                    schedule_name=schedulename,
+                    runbook_name=runbookname,
+                    run_on=None,
+                    addparameters=None,
+                ),
+            )
+        except ResourceExistsError:
+            logging.info(f"Runbook already linked to schedule {job_schedule_id}")
+            return job_schedule_id
+        if link_runbook_result is not None:
+            logging.info(
+                f"Runbook linked to schedule {link_runbook_result.job_schedule_id}"
+            )
+            return link_runbook_result.job_schedule_id
+        return job_schedule_id
+
+    @staticmethod
+    async def provision_runbook_links(
+        automation_client, account, link_runbook_relation_list, plan=None
+    ):
+        existing = await Automationaccount.existing(
+            plan,
+            "job_schedules",
+            Automationaccount.lister(automation_client.job_schedule, account),
+        )
+        link_runbook_status_list = []
+        missing = []
+        for runbook in link_runbook_relation_list:
+            key = (runbook["runbookname"], runbook["schedulename"])
+            if key in existing:
+                link_runbook_status_list.append(
+                    {
+                        "runbookname": key[0],
+                        "schedulename": key[1],
+                        "scheduleid": existing[key],
+                    }
+                )
+                continue
+            if key not in missing:
+                missing.append(key)
+        if missing:
             logging.info(
-                f"Automation account currently being used {automationaccountlist}"
+                f"Linking {len(missing)} runbooks for {account['automationaccountname']}"
             )
-            credential, cloud = AuthService.get_credential(
-                automationaccountlist["tenantName"]
+        results = await asyncio.gather(
+            *(
+                Automationaccount.provision_runbook_link(
+                    automation_client, account, runbookname, schedulename
+                )
+                for runbookname, schedulename in missing
+            ),
+            return_exceptions=True,
+        )
+        for (runbookname, schedulename), result in zip(missing, results):
+            if isinstance(result, Exception):
+                logging.warning(f"Error Linking runbook {result}")
+                continue
+            link_runbook_status_list.append(
+                {
+                    "runbookname": runbookname,
+                    "schedulename": schedulename,
+                    "scheduleid": result,
+                }
             )
-            async with credential:
-                for account in automationaccountlist["data"]:
-                    try:
-                        automation_client = AutomationClient(
-                            credential=credential,
-                            subscription_id=account["subscription_id"],
-                        )
-                        async with automation_client:
-                            link_runbook_status_list = []
-                            for runbook in link_runbook_relation_list:
-                                logging.info(
-                                    f"Processing Current runbook now is {runbook}"
-                                )
-                                runbookname = runbook["runbookname"]
-                                schedulename = runbook["schedulename"]
-                                try:
-                                    link_runbook_result = await automation_client.job_schedule.create(
-                                        resource_group_name=account["rg_name"],
-                                        automation_account_name=account[
-                                            "automationaccountname"
-                                        ],
-                                        job_schedule_id=str(uuid.uuid4()),
-                                        parameters=Automationaccountutils.aalink_runbook_to_aa(
-                                            schedule_name=schedulename,
-                                            runbook_name=runbookname,
-                                            run_on=None,
-                                            addparameters=None,
-                                        ),
-                                    )
-                                    link_runbook_status_list.append(
-                                        {
-                                            "runbookname": runbookname,
-                                            "schedulename": schedulename,
-                                            "scheduleid": link_runbook_result.job_schedule_id,
-                                        }
-                                    )
-                                    if link_runbook_result is not None:
-                                        logging.info(
-                                            f"Runbook linked to schedule {link_runbook_result.job_schedule_id}"
-                                        )
-                                except Exception as e:
-                                    logging.warning(f"Error Linking runbook {e}")
-                            account["linkingrunbook"] = link_runbook_status_list
-                    except Exception as e:
-                        logging.warning(f"Error Linking schedule for runbook {e}")
+        account["linkingrunbook"] = link_runbook_status_list
 
-        except Exception as e:
-            logging.warning(f"Error linking the storage account for {e}")
+    @staticmethod
+    async def wait_for_python_package(
+        automation_client, account, packagename, poll_semaphore
+    ):
+        interval = float(os.getenv("python_package_poll_interval", "5"))
+        max_interval = float(os.getenv("python_package_poll_max_interval", "60"))
+        # Kept under the 10 minute functionTimeout in host.json, a package still
+        # installing is reported as such and picked up by the next run
+        deadline = time.monotonic() + float(
+            os.getenv("python_package_poll_timeout", "480")
+        )
+        attempt = 0
+        while True:
+            async with poll_semaphore:
+                package = await automation_client.python3_package.get(
+                    resource_group_name=account["rg_name"],
+                    automation_account_name=account["automationaccountname"],
+                    package_name=packagename,
+                )
+            provisioning_state = ReconciliationService.enum_value(
+                package.provisioning_state
+            )
+            if (
+                provisioning_state.lower() in ("succeeded", "failed", "cancelled")
+                or time.monotonic() >= deadline
+            ):
+                return provisioning_state
+            await asyncio.sleep(
+                random.uniform(0.5, 1.0) * min(max_interval, interval * 2**attempt)
+            )
+            attempt += 1
 
     @staticmethod
-    async def install_python_package(automationaccountlist, python_package_list):
-        try:
-            credential, cloud = AuthService.get_credential(
-                automationaccountlist["tenantName"]
+    async def provision_python_package(
+        automation_client, account, package, package_hashes, poll_semaphore
+    ):
+        content_hash = await package_hashes.content_hash(package)
+        async with poll_semaphore:
+            add_python_package = (
+                await automation_client.python3_package.create_or_update(
+                    resource_group_name=account["rg_name"],
+                    automation_account_name=account["automationaccountname"],
+                    package_name=package["packagename"],
+                    parameters={
+                        "properties": {
+                            "contentLink": {
+                                "contentHash": {
+                                    "algorithm": "sha256",
+                                    "value": content_hash,
+                                },
+                                "uri": package["packageuri"],
+                                "version": package["version"],
+                            }
+                        },
+                        "tags": {},
+                    },
+                )
             )
-            async with credential:
-                for account in automationaccountlist["data"]:
-                    try:
-                        automation_client = AutomationClient(
-                            credential=credential,
-                            subscription_id=account["subscription_id"],
-                        )
-                        async with automation_client:
-                            for package in python_package_list:
-                                add_python_package = await automation_client.python3_package.create_or_update(
-                                    resource_group_name=account["rg_name"],
-                                    automation_account_name=account[
-                                        "automationaccountname"
-                                    ],
-                                    package_name=package["packagename"],
-                                    parameters={
-                                        "properties": {
-                                            "contentLink": {
-                                                "contentHash": {
-                                                    "algorithm": "sha256",
-                                                    "value": "7af2bca928ecd58e57ea7f7731d245f45e9d927036d82f1d30b96baa0c26b569",
-                                                },
-                                                "uri": package["packageuri"],
-                                                "version": package["version"],
-                                            }
-                                        },
-                                        "tags": {},
-                                    },
-                                )
-                                logging.info(f"Add Python package {add_python_package}")
-                    except Exception as e:
-                        logging.warning(f"Error adding python package {e}")
+        logging.info("Add Python package %s", payload(add_python_package))
+        provisioning_state = await Automationaccount.wait_for_python_package(
+            automation_client, account, package["packagename"], poll_semaphore
+        )
+        logging.info(
+            f"Python package {package['packagename']} {provisioning_state} for {account['automationaccountname']}"
+        )
+        return provisioning_state
 
-        except Exception as e:
-            logging.warning(f"Error with python additon {e}")
+    @staticmethod
+    async def provision_python_packages(
+        automation_client,
+        account,
+        python_package_list,
+        plan=None,
+        package_hashes=None,
+        poll_semaphore=None,
+    ):
+        if package_hashes is None:
+            async with PackageHashCache() as package_hashes:
+                return await Automationaccount.provision_python_packages(
+                    automation_client,
+                    account,
+                    python_package_list,
+                    plan=plan,
+                    package_hashes=package_hashes,
+                    poll_semaphore=poll_semaphore,
+                )
+        poll_semaphore = poll_semaphore or asyncio.Semaphore(
+            int(os.getenv("python_package_poll_concurrency", "8"))
+        )
+        existing = await Automationaccount.existing(
+            plan,
+            "packages",
+            Automationaccount.lister(automation_client.python3_package, account),
+        )
+        python_packages = []
+        pending = []
+        for package in python_package_list:
+            current_package = existing.get(package["packagename"])
+            if ReconciliationService.package_matches(current_package, package):
+                python_packages.append(
+                    {
+                        "packagename": package["packagename"],
+                        "version": package["version"],
+                        "provisioning_state": current_package["provisioning_state"],
+                    }
+                )
+                continue
+            pending.append(package)
+        results = await asyncio.gather(
+            *(
+                Automationaccount.provision_python_package(
+                    automation_client, account, package, package_hashes, poll_semaphore
+                )
+                for package in pending
+            ),
+            return_exceptions=True,
+        )
+        for package, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logging.warning(
+                    f"Error adding python package {package['packagename']} {result}"
+                )
+                result = "Failed"
+            python_packages.append(
+                {
+                    "packagename": package["packagename"],
+                    "version": package["version"],
+                    "provisioning_state": result,
+                }
+            )
+        account["python_packages"] = python_packages
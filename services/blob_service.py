@@ -1,55 +1,158 @@
-import logging
+import asyncio, hashlib, logging, os
 from azure.storage.blob.aio import BlobServiceClient
-from azure.storage.blob.aio import ContainerClient
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
 
 
 class BlobService:
 
-    def __init__(self, storageaccount_endpoint, conn_str) -> None:
+    # Replaced by the offline benchmark to route blob calls to a fake backend
+    transport_factory = None
+
+    def __init__(self, storageaccount_endpoint, conn_str, concurrency=None) -> None:
         self.storageaccounturl = storageaccount_endpoint
         self.conn_str = conn_str
+        self.chunk_size = BlobService.chunk_size()
+        self.concurrency = int(concurrency or os.getenv("blob_concurrency", "8"))
+        client_options = {}
+        if BlobService.transport_factory is not None:
+            client_options["transport"] = BlobService.transport_factory()
         self._blobserviceclient = BlobServiceClient.from_connection_string(
-            conn_str=conn_str
+            conn_str=conn_str,
+            max_single_get_size=self.chunk_size,
+            max_chunk_get_size=self.chunk_size,
+            **client_options,
         )
-        self._container_client = None
+        self._container_clients = {}
+        self._existing_containers = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        # Container clients share the service client pipeline, closing it is enough
+        self._container_clients = {}
+        await self._blobserviceclient.close()
+
+    @staticmethod
+    def chunk_size():
+        return int(os.getenv("blob_chunk_size", str(4 * 1024 * 1024)))
+
+    @staticmethod
+    async def hash_blob_stream(
+        blob_client,
+        algorithms=("sha256",),
+        keep_content=False,
+        etag=None,
+        match_condition=None,
+    ):
+        download_kwargs = {}
+        if etag is not None:
+            download_kwargs = {"etag": etag, "match_condition": match_condition}
+        downloader = await blob_client.download_blob(**download_kwargs)
+        hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        chunks = [] if keep_content else None
+        size = 0
+        async for chunk in downloader.chunks():
+            size += len(chunk)
+            for hasher in hashers.values():
+                hasher.update(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+        return {
+            "size": size,
+            "hashes": {
+                algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()
+            },
+            "etag": downloader.properties.etag,
+            "content": b"".join(chunks) if chunks is not None else None,
+        }
+
+    def container_client(self, container_name):
+        container_client = self._container_clients.get(container_name)
+        if container_client is None:
+            container_client = self._blobserviceclient.get_container_client(
+                container_name
+            )
+            self._container_clients[container_name] = container_client
+        return container_client
+
+    async def stream_container_file(
+        self,
+        blob_name,
+        container_name,
+        algorithms=("sha256",),
+        keep_content=False,
+        etag=None,
+        match_condition=None,
+    ):
+        try:
+            _blobclient = self.container_client(container_name).get_blob_client(
+                blob=blob_name
+            )
+            return await BlobService.hash_blob_stream(
+                _blobclient,
+                algorithms=algorithms,
+                keep_content=keep_content,
+                etag=etag,
+                match_condition=match_condition,
+            )
+        except ResourceNotModifiedError:
+            raise
+        except Exception as e:
+            logging.error(f"Failed to stream {e}")
+            return None
 
     async def read_container_file(self, blob_name, container_name):
         try:
-            self._container_client = ContainerClient.from_connection_string(
-                conn_str=self.conn_str, container_name=container_name
+            _blobclient = self.container_client(container_name).get_blob_client(
+                blob=blob_name
             )
-            _blobclient = self._container_client.get_blob_client(blob=blob_name)
-            blob_data = await _blobclient.download_blob()
-            blob_text = await blob_data.readall()
-            logging.info(f"Check blob details")
-            return blob_text.decode("utf-8")
+            blob_data = await BlobService.hash_blob_stream(
+                _blobclient, algorithms=(), keep_content=True
+            )
+            return blob_data["content"].decode("utf-8")
         except Exception as e:
             logging.error(f"Failed to fetch {e}")
             return None
-        finally:
-            await self._blobserviceclient.close()
-            await self._container_client.close()
+
+    async def download_many(self, blob_names, container_name):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def download(blob_name):
+            async with semaphore:
+                return await self.read_container_file(blob_name, container_name)
+
+        contents = await asyncio.gather(*(download(name) for name in blob_names))
+        return dict(zip(blob_names, contents))
 
     async def check_container_exists(self, container_name):
+        if container_name in self._existing_containers:
+            return
+        container_client = self.container_client(container_name)
         try:
-            self._container_client = ContainerClient.from_connection_string(
-                conn_str=self.conn_str, container_name=container_name
-            )
-            await self._container_client.get_container_properties()
+            await container_client.get_container_properties()
             logging.info("Container Is present")
         except ResourceNotFoundError:
-            logging.error(f"Creating container")
-            await self._container_client.create_container()
-            logging.info("Created Container")
-        finally:
-            await self._container_client.close()
+            logging.info(f"Creating container {container_name}")
+            try:
+                await container_client.create_container()
+                logging.info("Created Container")
+            except ResourceExistsError:
+                pass
+        self._existing_containers.add(container_name)
 
     async def upload_blob_to_container(self, data, file_name: str, container_name):
         try:
             await self.check_container_exists(container_name)
-            _blobclient = self._blobserviceclient.get_blob_client(
-                container=container_name, blob=file_name
+            _blobclient = self.container_client(container_name).get_blob_client(
+                blob=file_name
             )
             await _blobclient.upload_blob(data=data, overwrite=True)
             logging.info("Blob File Uploaded")
@@ -57,6 +160,35 @@ class BlobService:
         except Exception as e:
             logging.error(f"Failed to push blob {e}")
             return None
-        finally:
-            await self._blobserviceclient.close()
-            await self._container_client.close()
+
+    async def upload_many(self, blobs, container_name):
+        try:
+            await self.check_container_exists(container_name)
+        except Exception as e:
+            logging.error(f"Failed to check container {container_name} {e}")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def upload(file_name, data):
+            async with semaphore:
+                return await self.upload_blob_to_container(
+                    data=data, file_name=file_name, container_name=container_name
+                )
+
+        results = await asyncio.gather(
+            *(upload(file_name, data) for file_name, data in blobs.items())
+        )
+        return dict(zip(blobs, results))
+
+    async def list_blob_names(self, container_name, name_starts_with=None):
+        try:
+            return [
+                blob.name
+                async for blob in self.container_client(container_name).list_blobs(
+                    name_starts_with=name_starts_with
+                )
+            ]
+        except ResourceNotFoundError:
+            return []
+        except Exception as e:
+            logging.error(f"Failed to list blobs {e}")
+            return None
@@ -0,0 +1,265 @@
+from services.blob_service import BlobService
+from services.account_record import AccountRecord
+from datetime import datetime, timezone
+import asyncio, json, logging, os, sqlite3, time, uuid
+
+
+class CheckpointStore:
+
+    def __init__(self, run_id=None, batch_size=None, flush_interval=None) -> None:
+        self.run_id = run_id or os.getenv(
+            "checkpoint_run_id", datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        )
+        self.batch_size = int(batch_size or os.getenv("checkpoint_batch_size", "50"))
+        self.flush_interval = float(
+            flush_interval or os.getenv("checkpoint_flush_interval", "5")
+        )
+        self._completed = {}
+        self._fingerprints = {}
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._flush_lock = asyncio.Lock()
+
+    @staticmethod
+    def create(run_id=None, backend=None):
+        backend = (backend or os.getenv("checkpoint_backend", "none")).lower()
+        if backend == "sqlite":
+            return SqliteCheckpointStore(run_id=run_id)
+        if backend == "blob":
+            return BlobCheckpointStore(run_id=run_id)
+        return None
+
+    @staticmethod
+    def account_key(account):
+        return AccountRecord.key_of(account)
+
+    async def __aenter__(self):
+        await self.load()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.flush()
+
+    async def load(self):
+        try:
+            for record in await self._read():
+                key = (record["account"], record["stage"])
+                self._completed[key] = record["result"]
+                self._fingerprints[key] = record.get("fingerprint")
+            logging.info(
+                f"Loaded {len(self._completed)} checkpoints for run {self.run_id}"
+            )
+        except Exception as e:
+            logging.warning(f"Error loading checkpoints for run {self.run_id} {e}")
+
+    def is_complete(self, account, stage, fingerprint=None):
+        # A stage whose desired inputs changed since it was recorded is done again
+        key = (self.account_key(account), stage)
+        return key in self._completed and (
+            fingerprint is None or self._fingerprints.get(key) == fingerprint
+        )
+
+    def result(self, account, stage):
+        return self._completed.get((self.account_key(account), stage))
+
+    async def mark(self, account, stage):
+        """Leaves a marker count() sees without reading the recorded results"""
+
+    async def count(self, stage):
+        return await self._count(stage)
+
+    def results(self, stage):
+        return [
+            result
+            for (account_key, result_stage), result in self._completed.items()
+            if result_stage == stage
+        ]
+
+    async def record(self, account, stage, result, fingerprint=None):
+        record = {
+            "run_id": self.run_id,
+            "account": self.account_key(account),
+            "stage": stage,
+            "result": json.loads(json.dumps(result, default=list)),
+            "fingerprint": fingerprint,
+            "completed_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self._completed[(record["account"], stage)] = record["result"]
+        self._fingerprints[(record["account"], stage)] = fingerprint
+        self._pending.append(record)
+        if (
+            len(self._pending) >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logging.warning(f"Error writing {len(batch)} checkpoints {e}")
+                self._pending = batch + self._pending
+
+    async def _read(self):
+        raise NotImplementedError
+
+    async def _write(self, batch):
+        raise NotImplementedError
+
+    async def _count(self, stage):
+        raise NotImplementedError
+
+
+class SqliteCheckpointStore(CheckpointStore):
+
+    def __init__(self, run_id=None, path=None, **kwargs) -> None:
+        super().__init__(run_id=run_id, **kwargs)
+        self.path = path or os.getenv(
+            "checkpoint_sqlite_path", "/tmp/automation_checkpoints.db"
+        )
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "run_id TEXT, account TEXT, stage TEXT, result TEXT, completed_at TEXT, "
+            "fingerprint TEXT, PRIMARY KEY (run_id, account, stage))"
+        )
+        columns = [
+            row[1] for row in connection.execute("PRAGMA table_info(checkpoints)")
+        ]
+        if "fingerprint" not in columns:
+            # Rows written before fingerprints read as changed and are redone
+            connection.execute("ALTER TABLE checkpoints ADD COLUMN fingerprint TEXT")
+        return connection
+
+    def _read_sync(self):
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT account, stage, result, fingerprint FROM checkpoints "
+                "WHERE run_id = ?",
+                (self.run_id,),
+            ).fetchall()
+        return [
+            {
+                "account": account,
+                "stage": stage,
+                "result": json.loads(result),
+                "fingerprint": fingerprint,
+            }
+            for account, stage, result, fingerprint in rows
+        ]
+
+    def _write_sync(self, batch):
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO checkpoints "
+                "(run_id, account, stage, result, completed_at, fingerprint) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        record["run_id"],
+                        record["account"],
+                        record["stage"],
+                        json.dumps(record["result"]),
+                        record["completed_at"],
+                        record["fingerprint"],
+                    )
+                    for record in batch
+                ],
+            )
+
+    async def _read(self):
+        return await asyncio.to_thread(self._read_sync)
+
+    async def _write(self, batch):
+        await asyncio.to_thread(self._write_sync, batch)
+
+    def _count_sync(self, stage):
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM checkpoints WHERE run_id = ? AND stage = ?",
+                (self.run_id, stage),
+            ).fetchone()[0]
+
+    async def _count(self, stage):
+        # Rows are flushed before they are counted, so the table is the marker
+        return await asyncio.to_thread(self._count_sync, stage)
+
+
+class BlobCheckpointStore(CheckpointStore):
+
+    def __init__(self, run_id=None, container_name=None, **kwargs) -> None:
+        super().__init__(run_id=run_id, **kwargs)
+        self.container_name = container_name or os.getenv(
+            "checkpoint_container", "automation-checkpoints"
+        )
+        self._blob_service = None
+
+    def blob_service(self):
+        if self._blob_service is None:
+            self._blob_service = BlobService(
+                storageaccount_endpoint=os.getenv("storageaccountendpoint"),
+                conn_str=os.getenv("storage_connection_str"),
+            )
+        return self._blob_service
+
+    async def close(self):
+        await super().close()
+        if self._blob_service is not None:
+            await self._blob_service.close()
+            self._blob_service = None
+
+    async def _read(self):
+        blob_names = await self.blob_service().list_blob_names(
+            container_name=self.container_name, name_starts_with=f"{self.run_id}/"
+        )
+        contents = await self.blob_service().download_many(
+            sorted(blob_names or []), container_name=self.container_name
+        )
+        records = []
+        for content in contents.values():
+            for line in (content or "").splitlines():
+                if line.strip():
+                    records.append(json.loads(line))
+        return records
+
+    async def _write(self, batch):
+        # One segment per flush, the log is the union of all segments of a run
+        segment_name = f"{self.run_id}/{time.time_ns()}-{uuid.uuid4().hex[:8]}.jsonl"
+        uploaded = await self.blob_service().upload_blob_to_container(
+            data="\n".join(json.dumps(record) for record in batch) + "\n",
+            file_name=segment_name,
+            container_name=self.container_name,
+        )
+        if uploaded is None:
+            raise RuntimeError(f"Upload of checkpoint segment {segment_name} failed")
+
+    def marker_prefix(self, stage):
+        # Outside the run prefix, so load() never downloads the markers
+        return f"markers/{self.run_id}/{stage}/"
+
+    async def mark(self, account, stage):
+        marker_name = f"{self.marker_prefix(stage)}{self.account_key(account)}"
+        uploaded = await self.blob_service().upload_blob_to_container(
+            data=b"",
+            file_name=marker_name,
+            container_name=self.container_name,
+        )
+        if uploaded is None:
+            raise RuntimeError(f"Upload of checkpoint marker {marker_name} failed")
+
+    async def _count(self, stage):
+        blob_names = await self.blob_service().list_blob_names(
+            container_name=self.container_name,
+            name_starts_with=self.marker_prefix(stage),
+        )
+        return len(blob_names or [])
@@ -0,0 +1,245 @@
+from services.arm_scheduler import ArmRequestScheduler
+from services.credential_cache import credential_cache
+from contextlib import asynccontextmanager
+import aiohttp, asyncio, logging, os
+
+
+class AutomationClientRegistry:
+
+    _shared = None
+
+    def __init__(
+        self,
+        connection_limit=None,
+        connection_limit_per_host=None,
+        keepalive_timeout=None,
+    ) -> None:
+        self.connection_limit = int(
+            connection_limit or os.getenv("http_connection_limit", "100")
+        )
+        self.connection_limit_per_host = int(
+            connection_limit_per_host
+            or os.getenv("http_connection_limit_per_host", "50")
+        )
+        self.keepalive_timeout = float(
+            keepalive_timeout or os.getenv("http_keepalive_timeout", "60")
+        )
+        self.scheduler = ArmRequestScheduler()
+        self._loop = None
+        self._session = None
+        self._credentials = {}
+        self._clients = {}
+        self._resource_clients = {}
+        self._resource_graph_clients = {}
+        self._storage_clients = {}
+        self.stats = {
+            "credentials_created": 0,
+            "credentials_reused": 0,
+            "clients_created": 0,
+            "clients_reused": 0,
+            "connections_opened": 0,
+            "connections_reused": 0,
+        }
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @staticmethod
+    @asynccontextmanager
+    async def scoped(client_registry=None):
+        if client_registry is not None:
+            yield client_registry
+            return
+        async with AutomationClientRegistry() as registry:
+            yield registry
+
+    @staticmethod
+    def shared():
+        # Kept at module scope so warm invocations reuse credentials, clients and
+        # connections; a new event loop cannot use the old session, so start over
+        loop = asyncio.get_running_loop()
+        registry = AutomationClientRegistry._shared
+        if registry is None or registry._loop is not loop:
+            registry = AutomationClientRegistry()
+            registry._loop = loop
+            AutomationClientRegistry._shared = registry
+        return registry
+
+    def _trace_config(self):
+        async def on_connection_create_end(session, context, params):
+            self.stats["connections_opened"] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.stats["connections_reused"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                limit_per_host=self.connection_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, trace_configs=[self._trace_config()]
+            )
+        return self._session
+
+    def http_session(self):
+        return self._get_session()
+
+    def transport(self):
+        from azure.core.pipeline.transport import AioHttpTransport
+
+        return AioHttpTransport(session=self._get_session(), session_owner=False)
+
+    def get_credential(self, tenant_name):
+        credential = self._credentials.get(tenant_name)
+        if credential is not None:
+            self.stats["credentials_reused"] += 1
+            return credential
+        credential = credential_cache.async_credential(tenant_name)
+        self._credentials[tenant_name] = credential
+        self.stats["credentials_created"] += 1
+        return credential
+
+    def get_client(self, tenant_name, subscription_id):
+        key = (tenant_name, subscription_id)
+        automation_client = self._clients.get(key)
+        if automation_client is not None:
+            self.stats["clients_reused"] += 1
+            return automation_client
+        from azure.mgmt.automation.aio import AutomationClient
+
+        automation_client = AutomationClient(
+            credential=self.get_credential(tenant_name),
+            subscription_id=subscription_id,
+            transport=self.transport(),
+            retry_policy=self.scheduler.policy(subscription_id),
+        )
+        self._clients[key] = automation_client
+        self.stats["clients_created"] += 1
+        return automation_client
+
+    def get_resource_client(self, tenant_name, subscription_id):
+        key = (tenant_name, subscription_id)
+        resource_client = self._resource_clients.get(key)
+        if resource_client is not None:
+            self.stats["clients_reused"] += 1
+            return resource_client
+        from azure.mgmt.resource.resources.aio import ResourceManagementClient
+
+        resource_client = ResourceManagementClient(
+            credential=self.get_credential(tenant_name),
+            subscription_id=subscription_id,
+            base_url="https://management.azure.com",
+            transport=self.transport(),
+            retry_policy=self.scheduler.policy(subscription_id),
+        )
+        self._resource_clients[key] = resource_client
+        self.stats["clients_created"] += 1
+        return resource_client
+
+    def get_resource_graph_client(self, tenant_name):
+        resource_graph_client = self._resource_graph_clients.get(tenant_name)
+        if resource_graph_client is not None:
+            self.stats["clients_reused"] += 1
+            return resource_graph_client
+        from azure.mgmt.resourcegraph.aio import ResourceGraphClient
+
+        resource_graph_client = ResourceGraphClient(
+            credential=self.get_credential(tenant_name),
+            base_url="https://management.azure.com",
+            transport=self.transport(),
+            retry_policy=self.scheduler.policy(f"tenant:{tenant_name}"),
+        )
+        self._resource_graph_clients[tenant_name] = resource_graph_client
+        self.stats["clients_created"] += 1
+        return resource_graph_client
+
+    def get_storage_client(self, tenant_name, subscription_id):
+        key = (tenant_name, subscription_id)
+        storage_client = self._storage_clients.get(key)
+        if storage_client is not None:
+            self.stats["clients_reused"] += 1
+            return storage_client
+        from azure.mgmt.storage.aio import StorageManagementClient
+
+        storage_client = StorageManagementClient(
+            credential=self.get_credential(tenant_name),
+            subscription_id=subscription_id,
+            transport=self.transport(),
+            retry_policy=self.scheduler.policy(subscription_id),
+        )
+        self._storage_clients[key] = storage_client
+        self.stats["clients_created"] += 1
+        return storage_client
+
+    async def close(self):
+        for key, client in [
+            *self._clients.items(),
+            *self._resource_clients.items(),
+            *self._resource_graph_clients.items(),
+            *self._storage_clients.items(),
+        ]:
+            try:
+                await client.close()
+            except Exception as e:
+                logging.warning(f"Error closing client {key} {e}")
+        for tenant_name, credential in self._credentials.items():
+            try:
+                await credential.close()
+            except Exception as e:
+                logging.warning(f"Error closing credential {tenant_name} {e}")
+        if self._session is not None:
+            await self._session.close()
+        self._clients = {}
+        self._resource_clients = {}
+        self._resource_graph_clients = {}
+        self._storage_clients = {}
+        self._credentials = {}
+        self._session = None
+        self.log_stats()
+
+    def snapshot(self):
+        # The shared registry outlives invocations, each one reports against this
+        return {
+            "registry": dict(self.stats),
+            "scheduler": {
+                scope: dict(stats) for scope, stats in self.scheduler.stats.items()
+            },
+            "credentials": dict(credential_cache.stats),
+        }
+
+    @staticmethod
+    def since(current, baseline):
+        return {
+            key: round(value - baseline.get(key, 0), 3)
+            for key, value in current.items()
+        }
+
+    def log_stats(self, baseline=None):
+        stats = self.snapshot()
+        if baseline is not None:
+            stats = {
+                "registry": self.since(stats["registry"], baseline["registry"]),
+                "scheduler": {
+                    scope: self.since(scope_stats, baseline["scheduler"].get(scope, {}))
+                    for scope, scope_stats in stats["scheduler"].items()
+                    if scope_stats != baseline["scheduler"].get(scope)
+                },
+                "credentials": self.since(
+                    stats["credentials"], baseline["credentials"]
+                ),
+            }
+        logging.info(f"Automation client registry stats {stats['registry']}")
+        logging.info(f"ARM scheduler stats per subscription {stats['scheduler']}")
+        logging.info(f"Credential cache stats {stats['credentials']}")
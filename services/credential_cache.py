@@ -0,0 +1,195 @@
+import asyncio, logging, os, time
+
+
+class AsyncCachedCredential:
+
+    def __init__(self, cache, tenant_name, credential) -> None:
+        self.cache = cache
+        self.tenant_name = tenant_name
+        self.credential = credential
+
+    async def get_token(self, *scopes, claims=None, **kwargs):
+        return await self.cache.get_token(
+            self.tenant_name, self.credential, scopes, claims=claims, **kwargs
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        # Shared by the whole process, CredentialCache.close releases it
+        pass
+
+
+class CredentialCache:
+
+    # azure-identity hands out its own cached token until this many seconds are left
+    identity_refresh_offset = 300
+
+    def __init__(self, refresh_margin=None) -> None:
+        self.refresh_margin = float(
+            refresh_margin or os.getenv("credential_refresh_margin", "120")
+        )
+        if self.refresh_margin >= self.identity_refresh_offset:
+            logging.warning(
+                f"credential_refresh_margin {self.refresh_margin} leaves no room to "
+                f"refresh ahead, using {self.identity_refresh_offset / 2}"
+            )
+            self.refresh_margin = self.identity_refresh_offset / 2
+        # Inside the azure-identity window, so the refresh gets a new token, and
+        # ahead of the margin, so callers never wait for one
+        self.refresh_lead = (self.identity_refresh_offset + self.refresh_margin) / 2
+        self._spns = {}
+        self._async_credentials = {}
+        self._tokens = {}
+        self._last_used = {}
+        self._refresh_tasks = {}
+        self._closing = set()
+        self._loop = None
+        self._async_locks = {}
+        self.stats = {
+            "spn_parsed": 0,
+            "credentials_created": 0,
+            "token_acquisitions": 0,
+            "token_hits": 0,
+            "background_refreshes": 0,
+            "refresh_failures": 0,
+        }
+
+    @staticmethod
+    def parse_spn(value):
+        # "tenantId:<id>,clientId:<id>,clientSecret:<secret>"
+        spn = {}
+        for pair in value.split(","):
+            key, _, item = pair.partition(":")
+            spn[key.strip()] = item.strip()
+        return spn
+
+    def spn(self, tenant_name):
+        spn = self._spns.get(tenant_name)
+        if spn is None:
+            value = os.getenv(tenant_name, "").strip()
+            if not value:
+                return None
+            spn = self.parse_spn(value)
+            self._spns[tenant_name] = spn
+            self.stats["spn_parsed"] += 1
+        return spn
+
+    def _check_loop(self):
+        # Async credentials own transports bound to a loop, tokens are not
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            for task in self._refresh_tasks.values():
+                task.cancel()
+            if self._async_credentials:
+                # Released on the new loop, they must not leak their sessions
+                task = loop.create_task(
+                    self._close_credentials(self._async_credentials)
+                )
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            self._async_credentials = {}
+            self._async_locks = {}
+            self._refresh_tasks = {}
+
+    def async_credential(self, tenant_name):
+        self._check_loop()
+        credential = self._async_credentials.get(tenant_name)
+        if credential is None:
+            spn = self.spn(tenant_name)
+            if spn is not None:
+                from azure.identity.aio import ClientSecretCredential
+
+                source = ClientSecretCredential(
+                    tenant_id=spn.get("tenantId"),
+                    client_id=spn.get("clientId"),
+                    client_secret=spn.get("clientSecret"),
+                )
+            else:
+                from azpoe.services import AuthService
+
+                source, cloud = AuthService.get_credential(tenant_name)
+            credential = AsyncCachedCredential(self, tenant_name, source)
+            self._async_credentials[tenant_name] = credential
+            self.stats["credentials_created"] += 1
+        return credential
+
+    def cached_token(self, key):
+        token = self._tokens.get(key)
+        if token is not None and token.expires_on - time.time() > self.refresh_margin:
+            self._last_used[key] = time.time()
+            self.stats["token_hits"] += 1
+            return token
+        return None
+
+    def store_token(self, key, token):
+        self._tokens[key] = token
+        self._last_used[key] = time.time()
+        self.stats["token_acquisitions"] += 1
+
+    async def get_token(self, tenant_name, credential, scopes, claims=None, **kwargs):
+        key = (tenant_name, tuple(sorted(scopes)))
+        if claims is None:
+            token = self.cached_token(key)
+            if token is not None:
+                return token
+        lock = self._async_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if claims is None:
+                token = self.cached_token(key)
+                if token is not None:
+                    return token
+            token = await credential.get_token(*scopes, claims=claims, **kwargs)
+            self.store_token(key, token)
+        self.schedule_refresh(key, credential, scopes)
+        return token
+
+    def schedule_refresh(self, key, credential, scopes):
+        task = self._refresh_tasks.get(key)
+        if task is None or task.done():
+            self._refresh_tasks[key] = asyncio.create_task(
+                self._refresh(key, credential, scopes)
+            )
+
+    async def _refresh(self, key, credential, scopes):
+        while True:
+            token = self._tokens[key]
+            lifetime = token.expires_on - time.time()
+            delay = lifetime - self.refresh_lead
+            if delay <= 0:
+                # Too short lived to refresh ahead, get_token renews it on demand
+                return
+            await asyncio.sleep(delay)
+            # Stop refreshing tokens nobody asked for during their lifetime
+            if time.time() - self._last_used.get(key, 0) > lifetime:
+                return
+            try:
+                self._tokens[key] = await credential.get_token(*scopes)
+                self.stats["background_refreshes"] += 1
+            except Exception as e:
+                self.stats["refresh_failures"] += 1
+                logging.warning(f"Background token refresh failed for {key[0]} {e}")
+                return
+
+    async def _close_credentials(self, credentials):
+        for tenant_name, credential in credentials.items():
+            try:
+                await credential.credential.close()
+            except Exception as e:
+                logging.warning(f"Error closing credential {tenant_name} {e}")
+
+    async def close(self):
+        for task in self._refresh_tasks.values():
+            task.cancel()
+        await self._close_credentials(self._async_credentials)
+        self._refresh_tasks = {}
+        self._async_credentials = {}
+        logging.info(f"Credential cache stats {self.stats}")
+
+
+credential_cache = CredentialCache()
@@ -0,0 +1,162 @@
+from services.client_registry import AutomationClientRegistry
+from services.tracing import tracer
+from services.log_policy import log_policy, payload
+from services.account_record import AccountRecord
+import asyncio, logging, os
+
+
+class ResourceDiscovery:
+
+    filter_query = "resourceType eq 'Microsoft.Storage/storageAccounts'"
+
+    def __init__(
+        self, client_registry: AutomationClientRegistry, concurrency=None
+    ) -> None:
+        self.client_registry = client_registry
+        self.concurrency = int(concurrency or os.getenv("discovery_concurrency", "16"))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.collect_metrics = os.getenv(
+            "discovery_collect_storage_metrics", "false"
+        ).lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def create(client_registry, backend=None):
+        backend = (backend or os.getenv("discovery_backend", "arm")).lower()
+        if backend == "resourcegraph":
+            from services.resource_graph_discovery import ResourceGraphDiscovery
+
+            return ResourceGraphDiscovery(client_registry=client_registry)
+        return ResourceDiscovery(client_registry=client_registry)
+
+    @staticmethod
+    def automation_account_name(rg_name):
+        return (
+            "aa"
+            + str(rg_name.split("-")[0].lower())
+            + str(rg_name.split("-")[1].lower())
+            + "backup0001"
+        )
+
+    @staticmethod
+    def build_record(sub, rg_name, rg_location, afs_storage_list):
+        return AccountRecord(
+            subscription_id=sub["subid"],
+            subscription_name=sub["subname"],
+            rg_name=rg_name,
+            resource_name=afs_storage_list,
+            createdTime=sub["createdtime"],
+            automationaccountname=ResourceDiscovery.automation_account_name(rg_name),
+            location=rg_location,
+        )
+
+    async def add_storage_metrics(self, tenant_name, record):
+        storage_client = self.client_registry.get_storage_client(
+            tenant_name, record["subscription_id"]
+        )
+
+        async def share_stats(account_name):
+            try:
+                async with self._semaphore:
+                    shares = [
+                        share
+                        async for share in storage_client.file_shares.list(
+                            resource_group_name=record["rg_name"],
+                            account_name=account_name,
+                            expand="stats",
+                        )
+                    ]
+                return {
+                    "share_count": len(shares),
+                    "used_bytes": sum(share.share_usage_bytes or 0 for share in shares),
+                    "quota_gib": sum(share.share_quota or 0 for share in shares),
+                }
+            except Exception as e:
+                logging.warning(f"Error reading share stats for {account_name} {e}")
+                return {}
+
+        stats = await asyncio.gather(
+            *(share_stats(name) for name in record["resource_name"])
+        )
+        record["storage_metrics"] = dict(zip(record["resource_name"], stats))
+        return record
+
+    async def collect(self, new_sub_list):
+        resource_group_with_afs = [
+            record async for record in self.discover(new_sub_list)
+        ]
+        return {
+            "tenantName": new_sub_list["tenantName"],
+            "data": resource_group_with_afs,
+        }
+
+    async def discover(self, new_sub_list):
+        tenant_name = new_sub_list["tenantName"]
+        results = asyncio.Queue()
+        finished = object()
+        tasks = [
+            asyncio.create_task(self._scan_subscription(tenant_name, sub, results))
+            for sub in new_sub_list["data"]
+        ]
+
+        def scan_finished(future):
+            if not future.cancelled():
+                future.exception()
+            results.put_nowait(finished)
+
+        done = asyncio.gather(*tasks, return_exceptions=True)
+        done.add_done_callback(scan_finished)
+        try:
+            while True:
+                record = await results.get()
+                if record is finished:
+                    break
+                yield record
+        finally:
+            if not done.done():
+                done.cancel()
+
+    async def _scan_subscription(self, tenant_name, sub, results):
+        with tracer.span(
+            "discovery", operation="scan_subscription", subscription=sub["subid"]
+        ), log_policy.stage("discovery"):
+            try:
+                logging.info("Processing subscription %s", payload(sub))
+                resource_client = self.client_registry.get_resource_client(
+                    tenant_name, sub["subid"]
+                )
+                async with self._semaphore:
+                    rg_list = [
+                        rg async for rg in resource_client.resource_groups.list()
+                    ]
+                await asyncio.gather(
+                    *(
+                        self._scan_resource_group(
+                            tenant_name, resource_client, sub, rg, results
+                        )
+                        for rg in rg_list
+                        if rg.name.startswith("HEC")
+                    )
+                )
+            except Exception as e:
+                tracer.set_status("error")
+                logging.warning(f"Error processing for subscription {sub['subid']} {e}")
+
+    async def _scan_resource_group(
+        self, tenant_name, resource_client, sub, rg, results
+    ):
+        try:
+            async with self._semaphore:
+                afs_storage_list = [
+                    resources.name
+                    async for resources in resource_client.resources.list_by_resource_group(
+                        resource_group_name=rg.name, filter=self.filter_query
+                    )
+                    if resources.kind == "FileStorage"
+                ]
+            if len(afs_storage_list) > 0:
+                record = self.build_record(sub, rg.name, rg.location, afs_storage_list)
+                if self.collect_metrics:
+                    await self.add_storage_metrics(tenant_name, record)
+                results.put_nowait(record)
+        except Exception as e:
+            logging.warning(f"Error processing resource group {rg.name} {e}")
@@ -0,0 +1,164 @@
+from services.work_queue import WorkQueue
+from services.checkpoint_store import CheckpointStore
+from services.account_record import AccountRecord
+from datetime import datetime, timezone
+import asyncio, logging, os, time, uuid
+
+
+class FanoutOrchestrator:
+
+    def __init__(
+        self,
+        account_queue: WorkQueue,
+        aggregate_queue: WorkQueue,
+        aggregate_interval=None,
+        aggregate_timeout=None,
+        batch_size=None,
+    ) -> None:
+        self.account_queue = account_queue
+        self.aggregate_queue = aggregate_queue
+        self.aggregate_interval = float(
+            aggregate_interval or os.getenv("fanout_aggregate_interval", "60")
+        )
+        self.aggregate_timeout = float(
+            aggregate_timeout or os.getenv("fanout_aggregate_timeout", "3600")
+        )
+        self.batch_size = int(batch_size or os.getenv("fanout_batch_size", "100"))
+
+    @staticmethod
+    def run_id():
+        # Dated for the operator, unique so a second run that day starts clean
+        return f"{datetime.now(timezone.utc):%Y-%m-%d}-{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def result_stage(message):
+        # Results are kept per enqueue, a rerun under the same run id has its own
+        return f"account/{message['enqueue_id']}"
+
+    async def enqueue(self, subscription_list, discovery, options):
+        options = {**options, "enqueue_id": uuid.uuid4().hex}
+        counts = {}
+
+        async def enqueue_tenant(tenant):
+            tenant_name = tenant["tenantName"]
+            counts[tenant_name] = 0
+            batch = []
+            async for account in discovery.discover(tenant):
+                batch.append(
+                    {
+                        "type": "account",
+                        "tenantName": tenant_name,
+                        "account": account.to_dict(),
+                        **options,
+                    }
+                )
+                counts[tenant_name] += 1
+                if len(batch) >= self.batch_size:
+                    await self.account_queue.send_many(batch)
+                    batch = []
+            if batch:
+                await self.account_queue.send_many(batch)
+
+        await asyncio.gather(*(enqueue_tenant(tenant) for tenant in subscription_list))
+        expected = sum(counts.values())
+        # One aggregate message per run, it re-enqueues itself until all results are in
+        await self.aggregate_queue.send(
+            {
+                "type": "aggregate",
+                "tenants": list(counts),
+                "expected": expected,
+                "deadline": time.time() + self.aggregate_timeout,
+                **options,
+            },
+            delay=self.aggregate_interval,
+        )
+        logging.info(
+            f"Enqueued {expected} accounts for run {options['run_id']} {counts}"
+        )
+        return {
+            "run_id": options["run_id"],
+            "enqueue_id": options["enqueue_id"],
+            "enqueued": expected,
+            "tenants": counts,
+        }
+
+    @staticmethod
+    async def process(message, pipeline, checkpoint_store: CheckpointStore):
+        account = AccountRecord.from_dict(message["account"])
+        await pipeline.run_account(tenant_name=message["tenantName"], account=account)
+        stage = FanoutOrchestrator.result_stage(message)
+        await checkpoint_store.record(
+            account,
+            stage,
+            {"tenantName": message["tenantName"], "account": account.to_dict()},
+        )
+        await checkpoint_store.flush()
+        await checkpoint_store.mark(account, stage)
+        return account
+
+    async def aggregate(self, message, checkpoint_store: CheckpointStore):
+        stage = self.result_stage(message)
+        # Only the markers are counted until the run is complete
+        completed = await checkpoint_store.count(stage)
+        # Failed account messages never record a result
+        expected = message["expected"] - message.get("failed", 0)
+        if completed < expected and time.time() < message["deadline"]:
+            logging.info(
+                f"Run {message['run_id']} has {completed} of {expected} accounts"
+            )
+            await self.aggregate_queue.send(message, delay=self.aggregate_interval)
+            return None
+        if completed < expected:
+            logging.warning(
+                f"Run {message['run_id']} timed out with {completed} of {expected} accounts"
+            )
+        if message.get("failed"):
+            logging.warning(
+                f"Run {message['run_id']} had {message['failed']} failed account messages"
+            )
+        rg_with_afs_storage = [
+            {"tenantName": tenant_name, "data": []}
+            for tenant_name in message["tenants"]
+        ]
+        by_tenant = {tenant["tenantName"]: tenant for tenant in rg_with_afs_storage}
+        await checkpoint_store.load()
+        for result in checkpoint_store.results(stage):
+            if result["tenantName"] not in by_tenant:
+                continue
+            by_tenant[result["tenantName"]]["data"].append(
+                AccountRecord.from_dict(result["account"])
+            )
+        return rg_with_afs_storage
+
+    async def run_local(self, handle_account, handle_aggregate, poll_interval=0.1):
+        # Stands in for the Functions host when the queues are in memory or SQLite
+        failed = 0
+        while True:
+            received = await self.account_queue.receive()
+            if received:
+                handled = await asyncio.gather(
+                    *(
+                        self._handle(self.account_queue, handle_account, *item)
+                        for item in received
+                    )
+                )
+                failed += handled.count(False)
+                continue
+            for handle, message in await self.aggregate_queue.receive(max_messages=1):
+                # The account queue is drained, so every failure is known by now
+                result = await handle_aggregate({**message, "failed": failed})
+                await self.aggregate_queue.complete(handle)
+                if result is not None:
+                    return result
+            await asyncio.sleep(poll_interval)
+
+    @staticmethod
+    async def _handle(queue, handler, handle, message):
+        try:
+            await handler(message)
+            handled = True
+        except Exception as e:
+            logging.warning(f"Error handling {message.get('type')} message {e}")
+            handled = False
+        await queue.complete(handle)
+        return handled
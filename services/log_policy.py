@@ -0,0 +1,166 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json, logging, os, random, re, time
+
+_current_stage = ContextVar("log_stage", default=None)
+
+
+class Payload:
+    """Formats a logged structure only when a handler actually emits the record"""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=None) -> None:
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        return log_policy.render(self.value, self.limit)
+
+
+def payload(value, limit=None):
+    return Payload(value, limit)
+
+
+class LogPolicy(logging.Filter):
+
+    # A content link carries its SAS token in the query string, drop all of it
+    redactions = (
+        (
+            re.compile(r"(https?://[^\s'\"?]+)\?[^\s'\"]*\bsig=[^\s'\"]*", re.I),
+            r"\1?<redacted>",
+        ),
+        (
+            re.compile(
+                r"\b(sig|AccountKey|SharedAccessSignature|clientSecret|client_secret)([=:]\s*)"
+                r"[^\s&;,'\"]+",
+                re.I,
+            ),
+            r"\1\2<redacted>",
+        ),
+    )
+    markers = (
+        "sig=",
+        "accountkey=",
+        "sharedaccesssignature=",
+        "clientsecret",
+        "client_secret",
+    )
+
+    def __init__(
+        self,
+        payload_limit=None,
+        message_limit=None,
+        redact=None,
+        sample_rates=None,
+        rate_limits=None,
+    ) -> None:
+        super().__init__()
+        self.payload_limit = int(payload_limit or os.getenv("log_payload_limit", "512"))
+        self.message_limit = int(
+            message_limit or os.getenv("log_message_limit", "4096")
+        )
+        self.redact = (redact or os.getenv("log_redact", "true")).lower() in (
+            "1",
+            "true",
+            "yes",
+        )
+        # Per stage settings, e.g. {"publish_runbooks": 0.1, "default": 1}
+        self.sample_rates = (
+            sample_rates
+            if sample_rates is not None
+            else json.loads(os.getenv("log_sample_rates", "{}"))
+        )
+        # Records per second per stage, 0 or missing means unlimited
+        self.rate_limits = (
+            rate_limits
+            if rate_limits is not None
+            else json.loads(os.getenv("log_rate_limits", "{}"))
+        )
+        self._buckets = {}
+        self._installed = False
+        self.stats = {
+            "sampled_out": 0,
+            "rate_limited": 0,
+            "redacted": 0,
+            "truncated": 0,
+        }
+
+    def install(self, logger=None):
+        # Root logger filters see every logging.info/warning call in the app
+        if not self._installed:
+            (logger or logging.getLogger()).addFilter(self)
+            self._installed = True
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        token = _current_stage.set(name)
+        try:
+            yield
+        finally:
+            _current_stage.reset(token)
+
+    def setting(self, settings, stage, default):
+        value = settings.get(stage)
+        if value is None:
+            value = settings.get("default", default)
+        return float(value)
+
+    def sanitize(self, text):
+        if self.redact:
+            lowered = text.lower()
+            if any(marker in lowered for marker in self.markers):
+                for pattern, replacement in self.redactions:
+                    text = pattern.sub(replacement, text)
+                self.stats["redacted"] += 1
+        return text
+
+    def truncate(self, text, limit):
+        if limit and len(text) > limit:
+            self.stats["truncated"] += 1
+            return f"{text[:limit]}... ({len(text) - limit} more chars)"
+        return text
+
+    def render(self, value, limit=None):
+        return self.truncate(self.sanitize(str(value)), limit or self.payload_limit)
+
+    def allow(self, stage, levelno):
+        # Warnings are never sampled and errors are never rate limited
+        if levelno < logging.WARNING:
+            rate = self.setting(self.sample_rates, stage, 1.0)
+            if rate < 1.0 and random.random() >= rate:
+                self.stats["sampled_out"] += 1
+                return False
+        if levelno < logging.ERROR:
+            limit = self.setting(self.rate_limits, stage, 0)
+            if limit > 0 and not self._take(stage, limit):
+                self.stats["rate_limited"] += 1
+                return False
+        return True
+
+    def _take(self, stage, limit):
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(stage, (limit, now))
+        tokens = min(limit, tokens + (now - updated) * limit)
+        if tokens < 1:
+            self._buckets[stage] = (tokens, now)
+            return False
+        self._buckets[stage] = (tokens - 1, now)
+        return True
+
+    def filter(self, record):
+        stage = getattr(record, "stage", None) or _current_stage.get() or "default"
+        record.stage = stage
+        if not self.allow(stage, record.levelno):
+            return False
+        # f-string messages arrive preformatted, Payload arguments clean themselves
+        if not record.args and isinstance(record.msg, str):
+            record.msg = self.truncate(self.sanitize(record.msg), self.message_limit)
+        return True
+
+    def log_stats(self):
+        logging.info(f"Log policy stats {self.stats}")
+
+
+log_policy = LogPolicy()
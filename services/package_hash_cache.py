@@ -0,0 +1,83 @@
+from urllib.parse import urlparse
+import aiohttp, asyncio, hashlib, logging, os
+
+
+class PackageHashCache:
+
+    def __init__(self, session=None, mirror=None, chunk_size=None) -> None:
+        self.mirror = mirror or os.getenv("python_package_mirror")
+        self.chunk_size = int(
+            chunk_size or os.getenv("python_package_chunk_size", str(1024 * 1024))
+        )
+        self._session = session
+        self._session_owner = session is None
+        self._hashes = {}
+        self.stats = {"resolved": 0, "reused": 0, "pinned": 0, "bytes": 0}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session_owner and self._session is not None:
+            await self._session.close()
+            self._session = None
+        logging.info(f"Package hash cache stats {self.stats}")
+
+    def source(self, uri):
+        # A mirror is either a local directory or a base url holding the same wheel names
+        if not self.mirror:
+            return uri
+        wheel_name = os.path.basename(urlparse(uri).path)
+        if os.path.isdir(self.mirror):
+            return os.path.join(self.mirror, wheel_name)
+        return f"{self.mirror.rstrip('/')}/{wheel_name}"
+
+    def _hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as wheel:
+            for chunk in iter(lambda: wheel.read(self.chunk_size), b""):
+                digest.update(chunk)
+                self.stats["bytes"] += len(chunk)
+        return digest.hexdigest()
+
+    async def _hash_url(self, url):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        digest = hashlib.sha256()
+        async with self._session.get(url, raise_for_status=True) as response:
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                digest.update(chunk)
+                self.stats["bytes"] += len(chunk)
+        return digest.hexdigest()
+
+    async def _resolve(self, uri):
+        fragment = urlparse(uri).fragment
+        if fragment.startswith("sha256="):
+            self.stats["pinned"] += 1
+            return fragment.split("=", 1)[1]
+        source = self.source(uri)
+        if os.path.isfile(source):
+            value = await asyncio.to_thread(self._hash_file, source)
+        else:
+            value = await self._hash_url(source)
+        logging.info(f"Resolved sha256 {value} for {uri}")
+        return value
+
+    async def sha256(self, uri):
+        # Concurrent callers for the same wheel share one download
+        task = self._hashes.get(uri)
+        if task is None:
+            self.stats["resolved"] += 1
+            task = asyncio.ensure_future(self._resolve(uri))
+            self._hashes[uri] = task
+        else:
+            self.stats["reused"] += 1
+        return await task
+
+    async def content_hash(self, package):
+        if package.get("sha256"):
+            return package["sha256"]
+        return await self.sha256(package["packageuri"])
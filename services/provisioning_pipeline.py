@@ -0,0 +1,370 @@
+from services.automation_account_service import Automationaccount
+from services.client_registry import AutomationClientRegistry
+from services.reconciliation_service import ReconciliationService
+from services.checkpoint_store import CheckpointStore
+from services.publish_progress import PublishProgress
+from services.package_hash_cache import PackageHashCache
+from services.report_writer import ReportWriter
+from services.tracing import tracer
+from services.log_policy import log_policy
+from services.account_record import StageResultLog
+from utils.schedule_spec import ScheduleSpec
+from utils.variable_registry import VariableRegistry
+import asyncio, hashlib, json, logging, os, time
+
+
+class ProvisioningPipeline:
+
+    # Run after the account releases its provisioning slot
+    unbounded_stages = ("install_python_packages",)
+
+    def __init__(
+        self,
+        variables_names_list,
+        runbook_with_contentlink,
+        automation_schedule_list,
+        link_runbook_relation_list,
+        python_package_list,
+        client_registry: AutomationClientRegistry,
+        concurrency=None,
+        reconcile=None,
+        dry_run=None,
+        checkpoint_store: CheckpointStore = None,
+        report_writer: ReportWriter = None,
+    ) -> None:
+        self.variables_names_list = variables_names_list
+        self.runbook_with_contentlink = runbook_with_contentlink
+        self.automation_schedule_list = automation_schedule_list
+        self.link_runbook_relation_list = ScheduleSpec.check_links(
+            link_runbook_relation_list, automation_schedule_list
+        )
+        self.python_package_list = python_package_list
+        self.client_registry = client_registry
+        self.concurrency = int(
+            concurrency or os.getenv("provisioning_concurrency", "16")
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.reconcile = self.flag(reconcile, "reconcile_enabled", "true")
+        self.dry_run = self.flag(dry_run, "reconcile_dry_run", "false")
+        self.plan_summary = {"create": 0, "update": 0, "skip": 0}
+        self.checkpoint_store = checkpoint_store
+        self.report_writer = report_writer
+        self.publish_progress = PublishProgress()
+        self.stage_log = StageResultLog()
+        self.package_hashes = PackageHashCache(session=client_registry.http_session())
+        self.package_poll_semaphore = asyncio.Semaphore(
+            int(os.getenv("python_package_poll_concurrency", "8"))
+        )
+
+    @staticmethod
+    def flag(value, setting, default):
+        if value is None:
+            value = os.getenv(setting, default)
+        return str(value).strip().lower() in ("1", "true", "yes")
+
+    def desired(self):
+        return {
+            "variables_names_list": self.variables_names_list,
+            "runbook_with_contentlink": self.runbook_with_contentlink,
+            "automation_schedule_list": self.automation_schedule_list,
+            "link_runbook_relation_list": self.link_runbook_relation_list,
+            "python_package_list": self.python_package_list,
+        }
+
+    async def plan_account(self, automation_client, account):
+        state = await ReconciliationService.read_state(automation_client, account)
+        plan = ReconciliationService.plan_account(account, state, **self.desired())
+        for action, count in plan.summary().items():
+            self.plan_summary[action] += count
+        return plan
+
+    def stages(self):
+        return [
+            (
+                "create_automation_account",
+                Automationaccount.provision_automation_account,
+                {},
+                "automationaccountid",
+            ),
+            (
+                "update_variables",
+                Automationaccount.provision_variables,
+                {"variables_names_list": self.variables_names_list},
+                "variableadditionlist",
+            ),
+            (
+                "publish_runbooks",
+                Automationaccount.provision_runbooks,
+                {
+                    "runbook_with_contentlink": self.runbook_with_contentlink,
+                    "progress": self.publish_progress,
+                },
+                "published_runbooks",
+            ),
+            (
+                "create_schedules",
+                Automationaccount.provision_schedules,
+                {"automation_schedule_list": self.automation_schedule_list},
+                "schedule_id",
+            ),
+            (
+                "link_runbooks",
+                Automationaccount.provision_runbook_links,
+                {"link_runbook_relation_list": self.link_runbook_relation_list},
+                "linkingrunbook",
+            ),
+            (
+                "install_python_packages",
+                Automationaccount.provision_python_packages,
+                {
+                    "python_package_list": self.python_package_list,
+                    "package_hashes": self.package_hashes,
+                    "poll_semaphore": self.package_poll_semaphore,
+                },
+                "python_packages",
+            ),
+        ]
+
+    def stage_complete(self, stage_name, account, result_key):
+        if result_key is None:
+            return True
+        result = account.get(result_key)
+        if stage_name == "publish_runbooks":
+            return (
+                bool(self.runbook_with_contentlink)
+                and result is not None
+                and len(result) == len(self.runbook_with_contentlink)
+            )
+        if stage_name == "create_schedules":
+            return result is not None and len(result) == len(
+                self.automation_schedule_list
+            )
+        if stage_name == "install_python_packages":
+            return (
+                result is not None
+                and len(result) == len(self.python_package_list)
+                and all(
+                    package["provisioning_state"].lower() == "succeeded"
+                    for package in result
+                )
+            )
+        if stage_name == "link_runbooks":
+            return result is not None and len(result) == len(
+                self.link_runbook_relation_list
+            )
+        return bool(result)
+
+    def stage_inputs(self, stage_name, account):
+        if stage_name == "create_automation_account":
+            return [
+                account["location"],
+                os.getenv("automationaccounttags"),
+                os.getenv("automationaccountsku"),
+            ]
+        if stage_name == "update_variables":
+            # A variable with its own matcher is placed against the current value,
+            # only its name is pinned
+            return {
+                var: (
+                    None
+                    if (VariableRegistry.get(var) or {}).get("matches")
+                    else VariableRegistry.resolve(account, var)
+                )
+                for var in self.variables_names_list
+            }
+        if stage_name == "publish_runbooks":
+            return [
+                [
+                    runbook["runbookname"],
+                    runbook["contentlink"]["content_hash"]["value"],
+                ]
+                for runbook in self.runbook_with_contentlink
+            ]
+        if stage_name == "create_schedules":
+            # The start time moves every run, the rest of the spec pins the schedule
+            return [
+                {key: value for key, value in sch.items() if key != "start_time"}
+                for sch in self.automation_schedule_list
+            ]
+        if stage_name == "link_runbooks":
+            return self.link_runbook_relation_list
+        if stage_name == "install_python_packages":
+            return [
+                [package["packagename"], package["version"], package["packageuri"]]
+                for package in self.python_package_list
+            ]
+        return None
+
+    def fingerprint(self, stage_name, account):
+        return hashlib.sha256(
+            json.dumps(
+                self.stage_inputs(stage_name, account), sort_keys=True, default=str
+            ).encode()
+        ).hexdigest()[:16]
+
+    def restore_checkpoints(self, account):
+        if self.checkpoint_store is None:
+            return False
+        restored = 0
+        for stage_name, stage, kwargs, result_key in self.stages():
+            if not self.checkpoint_store.is_complete(
+                account, stage_name, self.fingerprint(stage_name, account)
+            ):
+                continue
+            restored += 1
+            if result_key is not None:
+                account[result_key] = self.checkpoint_store.result(account, stage_name)
+            self.stage_log.append(account, stage_name, "checkpointed")
+        return restored == len(self.stages())
+
+    async def run_stream(self, tenant_name, accounts, rg_afslist):
+        tasks = []
+        async for account in accounts:
+            rg_afslist["data"].append(account)
+            tasks.append(
+                asyncio.create_task(
+                    self.process_account(tenant_name=tenant_name, account=account)
+                )
+            )
+        await asyncio.gather(*tasks)
+        return rg_afslist
+
+    def log_plan_summary(self):
+        if self.reconcile or self.dry_run:
+            logging.info(
+                f"Reconciliation plan {self.plan_summary} dry_run={self.dry_run}"
+            )
+
+    def log_stage_summary(self):
+        logging.info(f"Stage results {self.stage_log.summary()}")
+
+    async def log_publish_progress(self, interval=None):
+        interval = float(interval or os.getenv("publish_progress_interval", "5"))
+        async for snapshot in self.publish_progress.stream(interval):
+            for runbookname, counts in snapshot.items():
+                logging.info(f"Runbook {runbookname} publish progress {counts}")
+
+    async def process_account(self, tenant_name, account):
+        await self.run_account(tenant_name=tenant_name, account=account)
+        if self.report_writer is not None:
+            try:
+                self.report_writer.write(tenant_name, account)
+            except Exception as e:
+                logging.warning(
+                    f"Error reporting {account['automationaccountname']} {e}"
+                )
+
+    async def run_account(self, tenant_name, account):
+        async with self._semaphore:
+            prepared = await self.prepare_account(tenant_name, account)
+            if prepared is None:
+                return
+            automation_client, plan = prepared
+            for stage_name, stage, kwargs, result_key in self.stages():
+                if stage_name not in self.unbounded_stages:
+                    await self.run_stage(
+                        stage_name,
+                        stage,
+                        kwargs,
+                        result_key,
+                        automation_client,
+                        account,
+                        plan,
+                    )
+        # Package installs mostly wait on the service, so the account slot is handed
+        # on and package_poll_semaphore alone bounds their requests
+        for stage_name, stage, kwargs, result_key in self.stages():
+            if stage_name in self.unbounded_stages:
+                await self.run_stage(
+                    stage_name,
+                    stage,
+                    kwargs,
+                    result_key,
+                    automation_client,
+                    account,
+                    plan,
+                )
+
+    async def prepare_account(self, tenant_name, account):
+        try:
+            automation_client = self.client_registry.get_client(
+                tenant_name, account["subscription_id"]
+            )
+        except Exception as e:
+            logging.warning(
+                f"Error with automation client for {account['automationaccountname']} {e}"
+            )
+            return None
+        if self.restore_checkpoints(account) and not self.dry_run:
+            logging.info(
+                f"All stages checkpointed for {account['automationaccountname']}"
+            )
+            return None
+        plan = None
+        if self.reconcile or self.dry_run:
+            started = time.perf_counter()
+            try:
+                with tracer.span(
+                    "stage",
+                    stage="plan",
+                    subscription=account["subscription_id"],
+                    account=account["automationaccountname"],
+                ), log_policy.stage("plan"):
+                    plan = await self.plan_account(automation_client, account)
+            except Exception as e:
+                # Without a plan every stage writes as before
+                logging.warning(
+                    f"Plan failed for {account['automationaccountname']} {e}"
+                )
+                self.stage_log.append(account, "plan", "failed", started, e)
+                if self.dry_run:
+                    return None
+            else:
+                self.stage_log.append(account, "plan", "planned", started)
+            if self.dry_run:
+                account["plannedoperations"] = plan.writes()
+                account["skippedoperations"] = plan.summary()["skip"]
+                return None
+            if plan is not None and not plan.writes():
+                logging.info(f"No changes for {account['automationaccountname']}")
+        return automation_client, plan
+
+    async def run_stage(
+        self, stage_name, stage, kwargs, result_key, automation_client, account, plan
+    ):
+        fingerprint = self.fingerprint(stage_name, account)
+        if self.checkpoint_store is not None and self.checkpoint_store.is_complete(
+            account, stage_name, fingerprint
+        ):
+            return
+        started = time.perf_counter()
+        try:
+            with tracer.span(
+                "stage",
+                stage=stage_name,
+                subscription=account["subscription_id"],
+                account=account["automationaccountname"],
+            ), log_policy.stage(stage_name):
+                await stage(
+                    automation_client=automation_client,
+                    account=account,
+                    plan=plan,
+                    **kwargs,
+                )
+        except Exception as e:
+            logging.warning(
+                f"Stage {stage_name} failed for {account['automationaccountname']} {e}"
+            )
+            self.stage_log.append(account, stage_name, "failed", started, e)
+            return
+        complete = self.stage_complete(stage_name, account, result_key)
+        self.stage_log.append(
+            account, stage_name, "done" if complete else "incomplete", started
+        )
+        if self.checkpoint_store is not None and complete:
+            await self.checkpoint_store.record(
+                account,
+                stage_name,
+                account.get(result_key) if result_key else None,
+                fingerprint,
+            )
@@ -0,0 +1,51 @@
+import asyncio
+
+
+class PublishProgress:
+
+    outcomes = ("published", "skipped", "failed")
+
+    def __init__(self) -> None:
+        self.counts = {}
+        self._changed = asyncio.Event()
+        self._done = asyncio.Event()
+        self._closed = False
+
+    def record(self, runbookname, outcome):
+        counts = self.counts.setdefault(
+            runbookname, {outcome: 0 for outcome in self.outcomes}
+        )
+        counts[outcome] += 1
+        self._changed.set()
+
+    def snapshot(self):
+        snapshot = {}
+        for runbookname, counts in self.counts.items():
+            attempted = counts["published"] + counts["failed"]
+            snapshot[runbookname] = {
+                **counts,
+                "success_rate": (
+                    round(counts["published"] / attempted, 4) if attempted else 1.0
+                ),
+            }
+        return snapshot
+
+    def close(self):
+        self._closed = True
+        self._done.set()
+        self._changed.set()
+
+    async def stream(self, interval=5.0):
+        # Yields at most one snapshot per interval, and only when something changed
+        while not self._closed:
+            await self._changed.wait()
+            self._changed.clear()
+            if self._closed:
+                break
+            yield self.snapshot()
+            # Closing cuts the pause short, the run must not wait out the interval
+            try:
+                await asyncio.wait_for(self._done.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+        yield self.snapshot()
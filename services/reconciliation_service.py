@@ -0,0 +1,243 @@
+from azure.core.exceptions import ResourceNotFoundError
+from utils.variable_registry import VariableRegistry
+from utils.schedule_spec import ScheduleSpec
+import asyncio, logging, os
+
+
+class AccountPlan:
+
+    def __init__(self, account_name, state) -> None:
+        self.account_name = account_name
+        self.state = state
+        self.operations = []
+        self._actions = {}
+
+    def add(self, stage, target, action):
+        self.operations.append({"stage": stage, "target": target, "action": action})
+        self._actions[(stage, target)] = action
+
+    def needs(self, stage, target=None):
+        if target is not None:
+            return self._actions.get((stage, target), "create") != "skip"
+        return any(
+            action != "skip"
+            for (op_stage, op_target), action in self._actions.items()
+            if op_stage == stage
+        )
+
+    def writes(self):
+        return [op for op in self.operations if op["action"] != "skip"]
+
+    def summary(self):
+        counts = {"create": 0, "update": 0, "skip": 0}
+        for op in self.operations:
+            counts[op["action"]] += 1
+        return counts
+
+
+class ReconciliationService:
+
+    @staticmethod
+    def enum_value(value):
+        return str(getattr(value, "value", value))
+
+    @staticmethod
+    def package_state(package):
+        return {
+            "version": package.version,
+            "provisioning_state": ReconciliationService.enum_value(
+                package.provisioning_state
+            ),
+        }
+
+    @staticmethod
+    def package_matches(current, package):
+        return (
+            current is not None
+            and current["version"] == package["version"]
+            and current["provisioning_state"].lower() == "succeeded"
+        )
+
+    @staticmethod
+    def schedule_state(schedule):
+        return {
+            "id": schedule.id,
+            "frequency": ReconciliationService.enum_value(schedule.frequency),
+            "interval": str(schedule.interval),
+            "time_zone": schedule.time_zone,
+            "start_time": (
+                schedule.start_time.isoformat() if schedule.start_time else None
+            ),
+            "expiry_time": (
+                schedule.expiry_time.isoformat() if schedule.expiry_time else None
+            ),
+            "advanced_schedule": ScheduleSpec.advanced(schedule.advanced_schedule),
+        }
+
+    @staticmethod
+    def state_entry(kind, item):
+        if kind == "schedules":
+            return item.name, ReconciliationService.schedule_state(item)
+        if kind == "job_schedules":
+            return (item.runbook.name, item.schedule.name), item.job_schedule_id
+        if kind == "packages":
+            return item.name, ReconciliationService.package_state(item)
+        raise ValueError(f"Unknown state kind {kind}")
+
+    @staticmethod
+    async def read_state(automation_client, account):
+        resource_group_name = account["rg_name"]
+        automation_account_name = account["automationaccountname"]
+        try:
+            current_account = await automation_client.automation_account.get(
+                resource_group_name=resource_group_name,
+                automation_account_name=automation_account_name,
+            )
+        except ResourceNotFoundError:
+            return {
+                "account": None,
+                "variables": {},
+                "runbooks": {},
+                "schedules": {},
+                "job_schedules": {},
+                "packages": {},
+            }
+        except Exception as e:
+            logging.warning(f"Error reading state for {automation_account_name} {e}")
+            return None
+
+        async def collect(paged):
+            return [item async for item in paged]
+
+        try:
+            variables, runbooks, schedules, job_schedules, packages = (
+                await asyncio.gather(
+                    *(
+                        collect(
+                            operations.list_by_automation_account(
+                                resource_group_name=resource_group_name,
+                                automation_account_name=automation_account_name,
+                            )
+                        )
+                        for operations in (
+                            automation_client.variable,
+                            automation_client.runbook,
+                            automation_client.schedule,
+                            automation_client.job_schedule,
+                            automation_client.python3_package,
+                        )
+                    )
+                )
+            )
+        except Exception as e:
+            logging.warning(f"Error reading state for {automation_account_name} {e}")
+            return None
+        return {
+            "account": {
+                "id": current_account.id,
+                "location": current_account.location,
+                "sku": current_account.sku.name if current_account.sku else None,
+                "tags": current_account.tags or {},
+            },
+            "variables": {variable.name: variable.value for variable in variables},
+            "runbooks": {
+                runbook.name: {
+                    "id": runbook.id,
+                    "content_hash": (runbook.tags or {}).get("contenthash"),
+                }
+                for runbook in runbooks
+            },
+            "schedules": dict(
+                ReconciliationService.state_entry("schedules", schedule)
+                for schedule in schedules
+            ),
+            "job_schedules": dict(
+                ReconciliationService.state_entry("job_schedules", job_schedule)
+                for job_schedule in job_schedules
+            ),
+            "packages": dict(
+                ReconciliationService.state_entry("packages", package)
+                for package in packages
+            ),
+        }
+
+    @staticmethod
+    def plan_account(
+        account,
+        state,
+        variables_names_list,
+        runbook_with_contentlink,
+        automation_schedule_list,
+        link_runbook_relation_list,
+        python_package_list,
+    ):
+        plan = AccountPlan(account["automationaccountname"], state)
+        if state is None:
+            # Current state is unknown, write everything as before
+            plan.add("automation_account", account["automationaccountname"], "update")
+            return plan
+        current_account = state["account"]
+        if current_account is None:
+            plan.add("automation_account", account["automationaccountname"], "create")
+        else:
+            unchanged = (
+                current_account["location"].replace(" ", "").lower()
+                == account["location"].replace(" ", "").lower()
+                and (current_account["sku"] or "").lower()
+                == (os.getenv("automationaccountsku") or "").lower()
+                and current_account["tags"].get("accounttype")
+                == os.getenv("automationaccounttags")
+            )
+            plan.add(
+                "automation_account",
+                account["automationaccountname"],
+                "skip" if unchanged else "update",
+            )
+
+        for var in variables_names_list:
+            current_value = state["variables"].get(var)
+            if VariableRegistry.matches(account, var, current_value):
+                plan.add("variable", var, "skip")
+            else:
+                plan.add(
+                    "variable", var, "create" if current_value is None else "update"
+                )
+
+        for runbook in runbook_with_contentlink:
+            current_runbook = state["runbooks"].get(runbook["runbookname"])
+            if current_runbook is None:
+                plan.add("runbook", runbook["runbookname"], "create")
+            elif (
+                current_runbook["content_hash"]
+                == runbook["contentlink"]["content_hash"]["value"]
+            ):
+                plan.add("runbook", runbook["runbookname"], "skip")
+            else:
+                plan.add("runbook", runbook["runbookname"], "update")
+
+        for sch in automation_schedule_list:
+            current_schedule = state["schedules"].get(sch["name"])
+            if current_schedule is None:
+                plan.add("schedule", sch["name"], "create")
+            elif ScheduleSpec.matches(current_schedule, sch):
+                plan.add("schedule", sch["name"], "skip")
+            else:
+                plan.add("schedule", sch["name"], "update")
+
+        for link in link_runbook_relation_list:
+            key = (link["runbookname"], link["schedulename"])
+            plan.add(
+                "job_schedule",
+                f"{key[0]}/{key[1]}",
+                "skip" if key in state["job_schedules"] else "create",
+            )
+
+        for package in python_package_list:
+            current_package = state["packages"].get(package["packagename"])
+            if current_package is None:
+                plan.add("python_package", package["packagename"], "create")
+            elif ReconciliationService.package_matches(current_package, package):
+                plan.add("python_package", package["packagename"], "skip")
+            else:
+                plan.add("python_package", package["packagename"], "update")
+        return plan
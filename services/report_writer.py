@@ -0,0 +1,162 @@
+from services.blob_service import BlobService
+import csv, json, logging, os
+
+
+class ReportWriter:
+
+    extension = None
+    # One encoder for every line, json.dumps builds a new one per call with options
+    encoder = json.JSONEncoder(default=str, allow_nan=False)
+    columns = (
+        "subscription_id",
+        "subscription_name",
+        "rg_name",
+        "resource_name",
+        "createdTime",
+        "automationaccountname",
+        "location",
+        "automationaccountid",
+        "variableadditionlist",
+        "published_runbooks",
+        "schedule_id",
+        "linkingrunbook",
+        "python_packages",
+        "plannedoperations",
+        "skippedoperations",
+        "stages",
+    )
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.rows = 0
+
+    @staticmethod
+    def create(path=None, report_format=None):
+        report_format = (report_format or os.getenv("report_format", "xlsx")).lower()
+        writer_class = {
+            "xlsx": XlsxReportWriter,
+            "csv": CsvReportWriter,
+            "jsonl": JsonLinesReportWriter,
+        }.get(report_format)
+        if writer_class is None:
+            return None
+        return writer_class(
+            path
+            or os.getenv("report_path", f"automationoutput.{writer_class.extension}")
+        )
+
+    @staticmethod
+    def json_line(tenant_name, account):
+        return (
+            ReportWriter.encoder.encode({"tenantName": tenant_name, **account}) + "\n"
+        )
+
+    @staticmethod
+    def json_lines(rg_with_afs_storage, summary=None):
+        for tenant in rg_with_afs_storage:
+            for account in tenant["data"]:
+                yield ReportWriter.json_line(tenant["tenantName"], account)
+        if summary is not None:
+            yield ReportWriter.encoder.encode({"summary": summary}) + "\n"
+
+    @staticmethod
+    def cell(value):
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return json.dumps(value, default=str)
+
+    def row(self, account):
+        # Fields outside the known columns are kept together in one json cell
+        other = {
+            key: value for key, value in account.items() if key not in self.columns
+        }
+        return [self.cell(account.get(column)) for column in self.columns] + [
+            self.cell(other) if other else None
+        ]
+
+    def start_tenant(self, tenant_name):
+        pass
+
+    def write(self, tenant_name, account):
+        raise NotImplementedError
+
+    def close(self):
+        logging.info(f"Report {self.path} written with {self.rows} rows")
+
+    async def upload(self, blob_service: BlobService, container_name, blob_name=None):
+        with open(self.path, "rb") as report:
+            return await blob_service.upload_blob_to_container(
+                data=report,
+                file_name=blob_name or os.path.basename(self.path),
+                container_name=container_name,
+            )
+
+
+class XlsxReportWriter(ReportWriter):
+
+    extension = "xlsx"
+
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        from openpyxl import Workbook
+
+        # Write-only sheets stream rows to temp files instead of holding cells
+        self.workbook = Workbook(write_only=True)
+        self.sheets = {}
+
+    def sheet(self, tenant_name):
+        sheet = self.sheets.get(tenant_name)
+        if sheet is None:
+            sheet = self.workbook.create_sheet(title=tenant_name[:31])
+            sheet.append([*self.columns, "other"])
+            self.sheets[tenant_name] = sheet
+        return sheet
+
+    def start_tenant(self, tenant_name):
+        self.sheet(tenant_name)
+
+    def write(self, tenant_name, account):
+        self.sheet(tenant_name).append(self.row(account))
+        self.rows += 1
+
+    def close(self):
+        if not self.sheets:
+            self.workbook.create_sheet()
+        self.workbook.save(self.path)
+        super().close()
+
+
+class CsvReportWriter(ReportWriter):
+
+    extension = "csv"
+
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["tenantName", *self.columns, "other"])
+
+    def write(self, tenant_name, account):
+        self.writer.writerow([tenant_name, *self.row(account)])
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class JsonLinesReportWriter(ReportWriter):
+
+    extension = "jsonl"
+
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, tenant_name, account):
+        self.file.write(self.json_line(tenant_name, account))
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+        super().close()
@@ -0,0 +1,98 @@
+from azure.mgmt.resourcegraph.models import QueryRequest, QueryRequestOptions
+from services.discovery_service import ResourceDiscovery
+from services.tracing import tracer
+import asyncio, logging, os
+
+
+class ResourceGraphDiscovery(ResourceDiscovery):
+
+    query = """
+Resources
+| where type =~ 'microsoft.storage/storageaccounts' and kind == 'FileStorage'
+| extend rgKey = tolower(resourceGroup)
+| join kind=inner (
+    ResourceContainers
+    | where type =~ 'microsoft.resources/subscriptions/resourcegroups'
+    | where name startswith_cs 'HEC'
+    | project subscriptionId, rgKey = tolower(name), rgName = name, rgLocation = location
+  ) on subscriptionId, rgKey
+| project subscriptionId, rgName, rgLocation, name
+| order by subscriptionId asc, rgName asc, name asc
+"""
+
+    def __init__(self, client_registry, page_size=None, concurrency=None) -> None:
+        # One query per page, the semaphore only bounds the storage metric reads
+        super().__init__(client_registry=client_registry, concurrency=concurrency)
+        self.page_size = int(page_size or os.getenv("resource_graph_page_size", "1000"))
+
+    async def discover(self, new_sub_list):
+        tenant_name = new_sub_list["tenantName"]
+        subscriptions = {sub["subid"].lower(): sub for sub in new_sub_list["data"]}
+        if not subscriptions:
+            return
+        try:
+            graph_client = self.client_registry.get_resource_graph_client(tenant_name)
+            current_key = None
+            current_rg = None
+            afs_storage_list = []
+            skip_token = None
+            while True:
+                # Spans must not stay open across the yield below
+                with tracer.span(
+                    "discovery",
+                    operation="resource_graph_page",
+                    subscription=tenant_name,
+                ):
+                    response = await graph_client.resources(
+                        QueryRequest(
+                            subscriptions=[
+                                sub["subid"] for sub in subscriptions.values()
+                            ],
+                            query=self.query,
+                            options=QueryRequestOptions(
+                                skip_token=skip_token,
+                                top=self.page_size,
+                                result_format="objectArray",
+                            ),
+                        )
+                    )
+                ready = []
+                for row in response.data:
+                    key = (row["subscriptionId"].lower(), row["rgName"])
+                    if key != current_key:
+                        if afs_storage_list:
+                            ready.append(
+                                self.build_record(
+                                    subscriptions[current_key[0]],
+                                    current_rg["rgName"],
+                                    current_rg["rgLocation"],
+                                    afs_storage_list,
+                                )
+                            )
+                        current_key = key
+                        current_rg = row
+                        afs_storage_list = []
+                    afs_storage_list.append(row["name"])
+                skip_token = response.skip_token
+                if not skip_token and afs_storage_list:
+                    ready.append(
+                        self.build_record(
+                            subscriptions[current_key[0]],
+                            current_rg["rgName"],
+                            current_rg["rgLocation"],
+                            afs_storage_list,
+                        )
+                    )
+                if self.collect_metrics:
+                    await asyncio.gather(
+                        *(
+                            self.add_storage_metrics(tenant_name, record)
+                            for record in ready
+                        )
+                    )
+                for record in ready:
+                    yield record
+                if not skip_token:
+                    break
+        except Exception as e:
+            logging.warning(f"Error querying resource graph for {tenant_name} {e}")
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+import json, logging, os, time
+
+
+class RunbookContentCache:
+
+    def __init__(self, max_entries=None, ttl=None, path=None) -> None:
+        self.max_entries = int(
+            max_entries or os.getenv("runbook_cache_max_entries", "128")
+        )
+        self.ttl = float(ttl or os.getenv("runbook_cache_ttl", "300"))
+        self.path = path if path is not None else os.getenv("runbook_cache_path")
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0}
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def key(container_name, blob_name):
+        return f"{container_name}/{blob_name}"
+
+    def get(self, container_name, blob_name):
+        key = self.key(container_name, blob_name)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry["validated_at"] < self.ttl
+
+    def put(self, container_name, blob_name, etag, content_hash, uri):
+        key = self.key(container_name, blob_name)
+        self._entries[key] = {
+            "etag": etag,
+            "content_hash": content_hash,
+            "uri": uri,
+            "validated_at": time.time(),
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def touch(self, container_name, blob_name):
+        entry = self.get(container_name, blob_name)
+        if entry is not None:
+            entry["validated_at"] = time.time()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                for key, entry in json.load(cache_file).items():
+                    # Entries from disk are always revalidated before use
+                    entry["validated_at"] = 0
+                    self._entries[key] = entry
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Error loading runbook cache {self.path} {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "w", encoding="utf-8") as cache_file:
+                json.dump(dict(self._entries), cache_file)
+        except Exception as e:
+            logging.warning(f"Error saving runbook cache {self.path} {e}")
+
+
+runbook_content_cache = RunbookContentCache()
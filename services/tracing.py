@@ -0,0 +1,196 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import bisect, logging, os, time
+
+_current_span = ContextVar("current_span", default=None)
+_current_run = ContextVar("current_run", default=None)
+_disabled = nullcontext()
+
+
+class Span:
+
+    __slots__ = ("kind", "attributes", "status", "retries", "started", "duration")
+
+    def __init__(self, kind, attributes) -> None:
+        self.kind = kind
+        self.attributes = attributes
+        self.status = "ok"
+        self.retries = 0
+        self.started = time.perf_counter()
+        self.duration = 0.0
+
+
+class RunTrace:
+
+    # Upper bounds in milliseconds, the last bucket is open ended
+    buckets = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.rows = {}
+
+    def add(self, span):
+        key = (
+            span.kind,
+            span.attributes.get("stage") or span.attributes.get("operation"),
+        )
+        row = self.rows.get(key)
+        if row is None:
+            row = {
+                "count": 0,
+                "errors": 0,
+                "retries": 0,
+                "total": 0.0,
+                "max": 0.0,
+                "histogram": [0] * (len(self.buckets) + 1),
+            }
+            self.rows[key] = row
+        milliseconds = span.duration * 1000
+        row["count"] += 1
+        row["errors"] += span.status != "ok"
+        row["retries"] += span.retries
+        row["total"] += milliseconds
+        row["max"] = max(row["max"], milliseconds)
+        row["histogram"][bisect.bisect_left(self.buckets, milliseconds)] += 1
+
+    def percentile(self, histogram, fraction, maximum):
+        # Upper bound of the bucket holding the requested rank, capped at the slowest
+        # span seen, which also stands in for the open ended last bucket
+        rank = fraction * sum(histogram)
+        seen = 0
+        for index, count in enumerate(histogram):
+            seen += count
+            if count and seen >= rank:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], round(maximum, 1))
+                return round(maximum, 1)
+        return 0
+
+    def summary(self):
+        return [
+            {
+                "kind": kind,
+                "name": name,
+                "count": row["count"],
+                "errors": row["errors"],
+                "retries": row["retries"],
+                "avg_ms": round(row["total"] / row["count"], 1),
+                "p50_ms": self.percentile(row["histogram"], 0.5, row["max"]),
+                "p95_ms": self.percentile(row["histogram"], 0.95, row["max"]),
+                "max_ms": round(row["max"], 1),
+                "total_ms": round(row["total"], 1),
+            }
+            for (kind, name), row in sorted(
+                self.rows.items(), key=lambda item: str(item[0])
+            )
+        ]
+
+    def table(self):
+        lines = [
+            f"{'kind':<10}{'name':<40}{'count':>7}{'errors':>7}{'retries':>8}"
+            f"{'avg ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>10}"
+        ]
+        for row in self.summary():
+            lines.append(
+                f"{row['kind']:<10}{str(row['name'])[:39]:<40}{row['count']:>7}"
+                f"{row['errors']:>7}{row['retries']:>8}{row['avg_ms']:>10}"
+                f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['max_ms']:>10}"
+            )
+        lines.append(f"run wall time {time.perf_counter() - self.started:.2f}s")
+        return "\n".join(lines)
+
+
+class Tracer:
+
+    def __init__(self, mode=None) -> None:
+        self.mode = (mode or os.getenv("tracing_mode", "summary")).lower()
+        self._otel_tracer = None
+        self._otel_histogram = None
+        if self.mode == "otel":
+            try:
+                from opentelemetry import metrics, trace
+
+                self._otel_tracer = trace.get_tracer("automationrunbook")
+                self._otel_histogram = metrics.get_meter(
+                    "automationrunbook"
+                ).create_histogram("automation.span.duration", unit="ms")
+            except ImportError:
+                logging.warning(
+                    "opentelemetry is not installed, tracing to summary only"
+                )
+
+    @property
+    def enabled(self):
+        return self.mode != "none"
+
+    def run(self):
+        # Disabled tracing hands out one shared no-op context, nothing is allocated
+        if not self.enabled:
+            return _disabled
+        return self._run()
+
+    def span(self, kind, **attributes):
+        if not self.enabled:
+            return _disabled
+        return self._span(kind, attributes)
+
+    @contextmanager
+    def _run(self):
+        run_trace = RunTrace()
+        token = _current_run.set(run_trace)
+        try:
+            yield run_trace
+        finally:
+            _current_run.reset(token)
+
+    @contextmanager
+    def _span(self, kind, attributes):
+        span = Span(kind, attributes)
+        token = _current_span.set(span)
+        otel_context = None
+        if self._otel_tracer is not None:
+            # Entered as the current span so nested spans become its children
+            otel_context = self._otel_tracer.start_as_current_span(
+                kind,
+                attributes={key: str(value) for key, value in attributes.items()},
+            )
+            otel_span = otel_context.__enter__()
+        try:
+            yield span
+        except BaseException:
+            span.status = "error"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.duration = time.perf_counter() - span.started
+            run_trace = _current_run.get()
+            if run_trace is not None:
+                run_trace.add(span)
+            if otel_context is not None:
+                otel_span.set_attribute("status", span.status)
+                otel_span.set_attribute("retries", span.retries)
+                otel_context.__exit__(None, None, None)
+                self._otel_histogram.record(
+                    span.duration * 1000,
+                    {
+                        "kind": kind,
+                        "name": str(
+                            attributes.get("stage") or attributes.get("operation")
+                        ),
+                    },
+                )
+
+    @staticmethod
+    def add_retry():
+        span = _current_span.get()
+        if span is not None:
+            span.retries += 1
+
+    @staticmethod
+    def set_status(status):
+        span = _current_span.get()
+        if span is not None:
+            span.status = status
+
+
+tracer = Tracer()
@@ -0,0 +1,215 @@
+import asyncio, json, logging, os, sqlite3, time
+
+
+class WorkQueue:
+
+    def __init__(self, queue_name, visibility_timeout=None) -> None:
+        self.queue_name = queue_name
+        self.visibility_timeout = int(
+            visibility_timeout or os.getenv("work_queue_visibility_timeout", "300")
+        )
+
+    @staticmethod
+    def create(queue_name, backend=None):
+        backend = (backend or os.getenv("work_queue_backend", "storage")).lower()
+        if backend == "memory":
+            return MemoryWorkQueue(queue_name)
+        if backend == "sqlite":
+            return SqliteWorkQueue(queue_name)
+        return StorageWorkQueue(queue_name)
+
+    @staticmethod
+    def is_local(backend=None):
+        return (backend or os.getenv("work_queue_backend", "storage")).lower() in (
+            "memory",
+            "sqlite",
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        pass
+
+    async def send_many(self, messages, delay=0):
+        for message in messages:
+            await self.send(message, delay=delay)
+
+    async def send(self, message, delay=0):
+        raise NotImplementedError
+
+    async def receive(self, max_messages=32):
+        """Returns (handle, message) pairs, hidden until completed or the lease ends"""
+        raise NotImplementedError
+
+    async def complete(self, handle):
+        raise NotImplementedError
+
+
+class MemoryWorkQueue(WorkQueue):
+
+    # Queues with the same name share messages within the process
+    _queues = {}
+
+    def __init__(self, queue_name, **kwargs) -> None:
+        super().__init__(queue_name, **kwargs)
+        self.messages = MemoryWorkQueue._queues.setdefault(queue_name, [])
+
+    async def send(self, message, delay=0):
+        self.messages.append((time.monotonic() + delay, json.dumps(message)))
+
+    async def receive(self, max_messages=32):
+        now = time.monotonic()
+        received = []
+        for entry in list(self.messages):
+            if len(received) >= max_messages:
+                break
+            if entry[0] <= now:
+                self.messages.remove(entry)
+                received.append((None, json.loads(entry[1])))
+        return received
+
+    async def complete(self, handle):
+        pass
+
+
+class SqliteWorkQueue(WorkQueue):
+
+    def __init__(self, queue_name, path=None, **kwargs) -> None:
+        super().__init__(queue_name, **kwargs)
+        self.path = path or os.getenv(
+            "work_queue_sqlite_path", "/tmp/automation_queue.db"
+        )
+        self._lock = asyncio.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, queue TEXT, body TEXT, "
+            "visible_at REAL)"
+        )
+        return connection
+
+    def _send_sync(self, messages, delay):
+        visible_at = time.time() + delay
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO messages (queue, body, visible_at) VALUES (?, ?, ?)",
+                [
+                    (self.queue_name, json.dumps(message), visible_at)
+                    for message in messages
+                ],
+            )
+
+    def _receive_sync(self, max_messages):
+        now = time.time()
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT id, body FROM messages WHERE queue = ? AND visible_at <= ? "
+                "ORDER BY id LIMIT ?",
+                (self.queue_name, now, max_messages),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE messages SET visible_at = ? WHERE id = ?",
+                [(now + self.visibility_timeout, row_id) for row_id, body in rows],
+            )
+        return [(row_id, json.loads(body)) for row_id, body in rows]
+
+    def _complete_sync(self, handle):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM messages WHERE id = ?", (handle,))
+
+    async def send_many(self, messages, delay=0):
+        async with self._lock:
+            await asyncio.to_thread(self._send_sync, messages, delay)
+
+    async def send(self, message, delay=0):
+        await self.send_many([message], delay=delay)
+
+    async def receive(self, max_messages=32):
+        async with self._lock:
+            return await asyncio.to_thread(self._receive_sync, max_messages)
+
+    async def complete(self, handle):
+        async with self._lock:
+            await asyncio.to_thread(self._complete_sync, handle)
+
+
+class StorageWorkQueue(WorkQueue):
+
+    def __init__(self, queue_name, conn_str=None, concurrency=None, **kwargs) -> None:
+        super().__init__(queue_name, **kwargs)
+        self.conn_str = conn_str or os.getenv("AzureWebJobsStorage")
+        self.concurrency = int(concurrency or os.getenv("work_queue_concurrency", "16"))
+        self._queue_client = None
+        self._queue_checked = False
+
+    async def queue_client(self):
+        if self._queue_client is None:
+            from azure.storage.queue import (
+                TextBase64EncodePolicy,
+                TextBase64DecodePolicy,
+            )
+            from azure.storage.queue.aio import QueueClient
+
+            # The Functions queue trigger expects base64 encoded messages
+            self._queue_client = QueueClient.from_connection_string(
+                conn_str=self.conn_str,
+                queue_name=self.queue_name,
+                message_encode_policy=TextBase64EncodePolicy(),
+                message_decode_policy=TextBase64DecodePolicy(),
+            )
+        if not self._queue_checked:
+            from azure.core.exceptions import ResourceExistsError
+
+            try:
+                await self._queue_client.create_queue()
+            except ResourceExistsError:
+                pass
+            self._queue_checked = True
+        return self._queue_client
+
+    async def close(self):
+        if self._queue_client is not None:
+            await self._queue_client.close()
+            self._queue_client = None
+
+    async def send(self, message, delay=0):
+        queue_client = await self.queue_client()
+        await queue_client.send_message(
+            json.dumps(message), visibility_timeout=int(delay) or None
+        )
+
+    async def send_many(self, messages, delay=0):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(message):
+            async with semaphore:
+                await self.send(message, delay=delay)
+
+        results = await asyncio.gather(
+            *(send(message) for message in messages), return_exceptions=True
+        )
+        failed = [result for result in results if isinstance(result, Exception)]
+        if failed:
+            logging.warning(f"Failed to enqueue {len(failed)} messages {failed[0]}")
+            raise failed[0]
+
+    async def receive(self, max_messages=32):
+        queue_client = await self.queue_client()
+        received = []
+        async for queue_message in queue_client.receive_messages(
+            messages_per_page=min(max_messages, 32),
+            visibility_timeout=self.visibility_timeout,
+            max_messages=max_messages,
+        ):
+            received.append((queue_message, json.loads(queue_message.content)))
+        return received
+
+    async def complete(self, handle):
+        queue_client = await self.queue_client()
+        await queue_client.delete_message(handle)
@@ -0,0 +1,42 @@
+from services.checkpoint_store import SqliteCheckpointStore
+import asyncio, sqlite3
+
+ACCOUNT = {
+    "subscription_id": "sub-1",
+    "rg_name": "HEC01-P00001-rg",
+    "automationaccountname": "aahec01p00001backup0001",
+}
+
+
+async def record_and_reload(path, fingerprint):
+    async with SqliteCheckpointStore(run_id="run", path=path) as store:
+        await store.record(
+            ACCOUNT, "link_runbooks", [{"runbookname": "a"}], fingerprint
+        )
+    store = SqliteCheckpointStore(run_id="run", path=path)
+    await store.load()
+    return store
+
+
+def test_changed_inputs_reopen_a_recorded_stage(tmp_path):
+    store = asyncio.run(record_and_reload(str(tmp_path / "checkpoints.db"), "abc"))
+    assert store.is_complete(ACCOUNT, "link_runbooks", "abc")
+    assert not store.is_complete(ACCOUNT, "link_runbooks", "def")
+    assert store.result(ACCOUNT, "link_runbooks") == [{"runbookname": "a"}]
+
+
+def test_rows_without_a_fingerprint_are_redone(tmp_path):
+    path = str(tmp_path / "checkpoints.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE checkpoints (run_id TEXT, account TEXT, stage TEXT, "
+            "result TEXT, completed_at TEXT, PRIMARY KEY (run_id, account, stage))"
+        )
+        connection.execute(
+            "INSERT INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+            ("run", SqliteCheckpointStore.account_key(ACCOUNT), "schedules", "[]", ""),
+        )
+    store = asyncio.run(record_and_reload(path, "abc"))
+    assert store.is_complete(ACCOUNT, "link_runbooks", "abc")
+    assert store.is_complete(ACCOUNT, "schedules")
+    assert not store.is_complete(ACCOUNT, "schedules", "abc")
@@ -0,0 +1,77 @@
+from fakes.discovery import compare_discovery_backends
+import asyncio, pytest
+
+SUBSCRIPTIONS = {
+    "tenantName": "CredSAPTenant",
+    "data": [
+        {"subname": "sub-one", "subid": "sub-1", "createdtime": "createdtime"},
+        {"subname": "sub-two", "subid": "sub-2", "createdtime": "createdtime"},
+        {"subname": "sub-empty", "subid": "sub-3", "createdtime": "createdtime"},
+    ],
+}
+
+ESTATE = {
+    "sub-1": [
+        {
+            "name": "HEC01-P00001-rg",
+            "location": "westeurope",
+            "resources": [
+                {"name": "hec01afs0", "kind": "FileStorage"},
+                {"name": "hec01afs1", "kind": "FileStorage"},
+                {"name": "hec01afs2", "kind": "FileStorage"},
+                {"name": "hec01blob", "kind": "StorageV2"},
+            ],
+        },
+        {
+            # Not a HEC resource group, its FileStorage account is ignored
+            "name": "shared-tools-rg",
+            "location": "westeurope",
+            "resources": [{"name": "toolsafs", "kind": "FileStorage"}],
+        },
+        {
+            # HEC, but nothing to back up
+            "name": "HEC02-P00002-rg",
+            "location": "northeurope",
+            "resources": [{"name": "hec02blob", "kind": "StorageV2"}],
+        },
+    ],
+    "sub-2": [
+        {
+            "name": "HEC03-P00003-rg",
+            "location": "eastus",
+            "resources": [
+                {"name": "hec03blob", "kind": "BlobStorage"},
+                {"name": "hec03afs0", "kind": "FileStorage"},
+            ],
+        },
+        {
+            "name": "HEC04-P00004-rg",
+            "location": "eastus",
+            "resources": [
+                {"name": "hec04afs1", "kind": "FileStorage"},
+                {"name": "hec04afs0", "kind": "FileStorage"},
+            ],
+        },
+    ],
+}
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 100])
+def test_backends_return_the_same_records(page_size):
+    same, arm_records, graph_records = asyncio.run(
+        compare_discovery_backends(SUBSCRIPTIONS, ESTATE, page_size=page_size)
+    )
+    assert same, (arm_records, graph_records)
+    assert [
+        (record["subscription_id"], record["rg_name"], record["resource_name"])
+        for record in arm_records
+    ] == [
+        ("sub-1", "HEC01-P00001-rg", ["hec01afs0", "hec01afs1", "hec01afs2"]),
+        ("sub-2", "HEC03-P00003-rg", ["hec03afs0"]),
+        ("sub-2", "HEC04-P00004-rg", ["hec04afs0", "hec04afs1"]),
+    ]
+    assert {record["automationaccountname"] for record in graph_records} == {
+        "aahec01p00001backup0001",
+        "aahec03p00003backup0001",
+        "aahec04p00004backup0001",
+    }
@@ -0,0 +1,133 @@
+from fakes.azure_backend import FakeAzureBackend, FakeClientRegistry, synthetic_estate
+from services.blob_service import BlobService
+import azure.functions as func
+import asyncio, base64, function_app, pytest
+
+SETTINGS = {
+    "scriptstoragename": "teststorage",
+    "containername": "runbooks",
+    "backuprunbookblob": "afs_backuprunbook.py",
+    "deletionrunbookblob": "afs_deletionrunbook.py",
+    "backupsastoken": "?sv=2022-11-02&sp=r&sig=fake",
+    "deletionsastoken": "?sv=2022-11-02&sp=r&sig=fake",
+    "storageaccountendpoint": "https://teststorage.blob.core.windows.net",
+    "storage_connection_str": (
+        "DefaultEndpointsProtocol=https;AccountName=teststorage;"
+        f"AccountKey={base64.b64encode(b'0' * 64).decode()};EndpointSuffix=core.windows.net"
+    ),
+    "schedule_name": "afs_daily",
+    "automationaccounttags": "hec",
+    "automationaccountsku": "Basic",
+    "RetentionDays": "30",
+    "report_format": "none",
+    "arm_requests_per_second": "100000",
+    "arm_request_burst": "100000",
+    "python_package_poll_interval": "0.01",
+    "python_package_poll_max_interval": "0.01",
+    "publish_progress_interval": "3600",
+}
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    for key, value in SETTINGS.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setenv("checkpoint_sqlite_path", str(tmp_path / "checkpoints.db"))
+    monkeypatch.setenv("work_queue_sqlite_path", str(tmp_path / "queue.db"))
+    # The wheel hash is read from a local mirror instead of PyPI
+    (tmp_path / "azure_mgmt_resource-23.2.0-py3-none-any.whl").write_bytes(b"wheel")
+    monkeypatch.setenv("python_package_mirror", str(tmp_path))
+    monkeypatch.setenv("runbook_cache_path", str(tmp_path / "runbook_cache.json"))
+    subscriptions = [
+        sub["subid"]
+        for tenant in function_app.subscription_list()
+        for sub in tenant["data"]
+    ]
+    backend = FakeAzureBackend(synthetic_estate(4, subscriptions))
+    for setting in ("backuprunbookblob", "deletionrunbookblob"):
+        backend.put_blob(SETTINGS["containername"], SETTINGS[setting], b"# runbook\n")
+    monkeypatch.setattr(BlobService, "transport_factory", backend.transport)
+    return backend
+
+
+def writes(backend):
+    return sum(
+        count
+        for operation, count in backend.operations.items()
+        if operation.startswith("PUT automationAccounts")
+    )
+
+
+async def fan_out(backend, delivered, **params):
+    async def provision_account_message(message):
+        delivered.append(message)
+        await handle_account(message)
+
+    handle_account = function_app.provision_account_message
+    function_app.provision_account_message = provision_account_message
+    try:
+        client_registry = FakeClientRegistry(backend).install()
+        summary = await function_app.fan_out(
+            func.HttpRequest(
+                method="GET",
+                url="/api/http_trigger_automation_account",
+                body=b"",
+                params={
+                    "mode": "fanout",
+                    "work_queue_backend": "sqlite",
+                    "checkpoint_backend": "sqlite",
+                    **params,
+                },
+            ),
+            function_app.subscription_list(),
+        )
+        await client_registry.close()
+        return summary
+    finally:
+        function_app.provision_account_message = handle_account
+
+
+def accounts(summary):
+    return sorted(
+        account["automationaccountname"]
+        for tenant in summary["result"]
+        for account in tenant["data"]
+    )
+
+
+def test_repeated_run_reports_only_its_own_accounts(backend):
+    async def scenario():
+        first = await fan_out(backend, [])
+        first_writes = writes(backend)
+        # Same day, same accounts: a new run id, and a new count
+        second = await fan_out(backend, [])
+        # Reusing the run id resumes from its checkpoints, and is still counted alone
+        resumed = await fan_out(backend, [], run_id=first["run_id"])
+        return first, first_writes, second, resumed
+
+    first, first_writes, second, resumed = asyncio.run(scenario())
+    assert first["enqueued"] == 4
+    assert first["run_id"] != second["run_id"]
+    assert first["run_id"].startswith(second["run_id"][:10])
+    assert accounts(first) == accounts(second) == accounts(resumed)
+    assert len(accounts(first)) == 4
+    assert first_writes > 0
+    # The second run found every account in place, the resumed one never looked
+    assert writes(backend) == first_writes
+
+
+def test_redelivered_message_skips_completed_stages(backend):
+    async def scenario():
+        delivered = []
+        await fan_out(backend, delivered)
+        requests = backend.stats["requests"]
+        client_registry = FakeClientRegistry(backend).install()
+        await function_app.provision_account_message(delivered[0])
+        await client_registry.close()
+        return delivered[0], requests
+
+    message, requests = asyncio.run(scenario())
+    # Every stage was checkpointed, so nothing is read or written again
+    assert backend.stats["requests"] == requests
+    assert "start_time" not in message["schedule_specs"][0]
+    assert "automation_schedule_list" not in message["desired"]
@@ -0,0 +1,153 @@
+from fakes.azure_backend import FakeAzureBackend, FakeClientRegistry
+from services.automation_account_service import Automationaccount
+from services.reconciliation_service import ReconciliationService
+from utils.automationaccountutils import Automationaccountutils
+from utils.schedule_spec import ScheduleSpec
+import asyncio, pytest
+
+ACCOUNT = {
+    "subscription_id": "sub-1",
+    "rg_name": "HEC01-P00001-rg",
+    "automationaccountname": "aahec01p00001backup0001",
+    "location": "westeurope",
+}
+
+VARIABLES = ["RESOURCE_GROUP", "SUBSCRIPTION_ID"]
+
+PACKAGE_URI = (
+    "https://files.pythonhosted.org/packages/azure_mgmt_resource-23.2.0-py3-none-any.whl"
+    "#sha256=0123456789abcdef"
+)
+
+
+def desired(schedule_interval=1, package_version="23.2.0", schedulename="afs_daily"):
+    return {
+        "variables_names_list": VARIABLES,
+        "runbook_with_contentlink": [],
+        "automation_schedule_list": [
+            ScheduleSpec.build(
+                "afs_daily", start_at="02:00", interval=schedule_interval
+            )
+        ],
+        "link_runbook_relation_list": [
+            {"runbookname": "afs_backup", "schedulename": schedulename}
+        ],
+        "python_package_list": [
+            {
+                "packagename": "azure_mgmt_resource",
+                "version": package_version,
+                "packageuri": PACKAGE_URI,
+            }
+        ],
+    }
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    for key, value in {
+        "automationaccounttags": "hec",
+        "automationaccountsku": "Basic",
+        "arm_requests_per_second": "100000",
+        "arm_request_burst": "100000",
+        "arm_max_retries": "0",
+        "python_package_poll_interval": "0.01",
+        "python_package_poll_max_interval": "0.01",
+    }.items():
+        monkeypatch.setenv(key, value)
+
+
+async def deploy(automation_client):
+    wanted = desired()
+    account = dict(ACCOUNT)
+    await Automationaccount.provision_automation_account(automation_client, account)
+    await Automationaccount.provision_variables(
+        automation_client, account, wanted["variables_names_list"]
+    )
+    await Automationaccount.provision_schedules(
+        automation_client, account, wanted["automation_schedule_list"]
+    )
+    await Automationaccount.provision_runbook_links(
+        automation_client, account, wanted["link_runbook_relation_list"]
+    )
+    await Automationaccount.provision_python_packages(
+        automation_client, account, wanted["python_package_list"]
+    )
+
+
+async def plan(backend, deployed=False, drift=None, **wanted):
+    async with FakeClientRegistry(backend) as registry:
+        automation_client = registry.get_client("tenant", ACCOUNT["subscription_id"])
+        if deployed:
+            await deploy(automation_client)
+        if drift is not None:
+            await drift(automation_client)
+        state = await ReconciliationService.read_state(automation_client, ACCOUNT)
+        return ReconciliationService.plan_account(ACCOUNT, state, **desired(**wanted))
+
+
+def actions(account_plan):
+    return {(op["stage"], op["target"]): op["action"] for op in account_plan.operations}
+
+
+def test_new_account_creates_everything():
+    account_plan = asyncio.run(plan(FakeAzureBackend({})))
+    assert actions(account_plan) == {
+        ("automation_account", ACCOUNT["automationaccountname"]): "create",
+        ("variable", "RESOURCE_GROUP"): "create",
+        ("variable", "SUBSCRIPTION_ID"): "create",
+        ("schedule", "afs_daily"): "create",
+        ("job_schedule", "afs_backup/afs_daily"): "create",
+        ("python_package", "azure_mgmt_resource"): "create",
+    }
+
+
+def test_deployed_account_skips_everything():
+    account_plan = asyncio.run(plan(FakeAzureBackend({}), deployed=True))
+    assert account_plan.writes() == []
+    assert account_plan.summary() == {"create": 0, "update": 0, "skip": 6}
+
+
+def test_drifted_account_updates_what_changed():
+    async def stale_variable(automation_client):
+        await automation_client.variable.create_or_update(
+            resource_group_name=ACCOUNT["rg_name"],
+            automation_account_name=ACCOUNT["automationaccountname"],
+            variable_name="RESOURCE_GROUP",
+            parameters=Automationaccountutils.aaupdate_runbook_variables(
+                variable_name="RESOURCE_GROUP",
+                variable_value='"HEC99-P00099-rg"',
+                description="runbook_variable",
+                is_encrypted=False,
+            ),
+        )
+
+    account_plan = asyncio.run(
+        plan(
+            FakeAzureBackend({}),
+            deployed=True,
+            drift=stale_variable,
+            schedule_interval=2,
+            package_version="23.3.0",
+            schedulename="afs_weekly",
+        )
+    )
+    assert actions(account_plan) == {
+        ("automation_account", ACCOUNT["automationaccountname"]): "skip",
+        ("variable", "RESOURCE_GROUP"): "update",
+        ("variable", "SUBSCRIPTION_ID"): "skip",
+        ("schedule", "afs_daily"): "update",
+        ("job_schedule", "afs_backup/afs_weekly"): "create",
+        ("python_package", "azure_mgmt_resource"): "update",
+    }
+
+
+def test_unreadable_state_writes_everything():
+    account_plan = asyncio.run(plan(FakeAzureBackend({}, failure_rate=1.0)))
+    assert account_plan.state is None
+    for stage, target in [
+        ("variable", "RESOURCE_GROUP"),
+        ("schedule", "afs_daily"),
+        ("job_schedule", "afs_backup/afs_daily"),
+        ("python_package", "azure_mgmt_resource"),
+    ]:
+        assert account_plan.needs(stage, target)
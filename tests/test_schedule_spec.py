@@ -0,0 +1,36 @@
+from utils.schedule_spec import ScheduleSpec
+import pytest
+
+RUNBOOKS = ["afs_backuprunbook", "afs_deletionrunbook"]
+
+
+def test_links_follow_the_configured_schedules():
+    schedules = [
+        ScheduleSpec.build("afs_daily", start_at="02:00"),
+        ScheduleSpec.build(
+            "afs_weekly", frequency="Week", runbooks=["afs_deletionrunbook"]
+        ),
+    ]
+    assert ScheduleSpec.links(RUNBOOKS, schedules) == [
+        {"runbookname": "afs_backuprunbook", "schedulename": "afs_daily"},
+        {"runbookname": "afs_deletionrunbook", "schedulename": "afs_daily"},
+        {"runbookname": "afs_deletionrunbook", "schedulename": "afs_weekly"},
+    ]
+
+
+def test_links_reject_unknown_runbooks_and_unnamed_schedules():
+    with pytest.raises(ValueError):
+        ScheduleSpec.links(RUNBOOKS, [ScheduleSpec.build("afs_daily", runbooks=["x"])])
+    with pytest.raises(ValueError):
+        ScheduleSpec.links(RUNBOOKS, [ScheduleSpec.build(None, start_at="00:00")])
+
+
+def test_check_links_rejects_schedules_outside_the_spec():
+    schedules = [ScheduleSpec.build("afs_daily", start_at="02:00")]
+    links = [{"runbookname": "afs_backuprunbook", "schedulename": "afs_daily"}]
+    assert ScheduleSpec.check_links(links, schedules) == links
+    with pytest.raises(ValueError):
+        ScheduleSpec.check_links(
+            links + [{"runbookname": "afs_backuprunbook", "schedulename": None}],
+            schedules,
+        )
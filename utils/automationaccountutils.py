@@ -7,18 +7,96 @@ from azure.mgmt.automation.models import (
     ScheduleAssociationProperty,
     RunbookAssociationProperty,
 )
-import logging, os, json
+import logging, os, json, re
+
+
+class BodyTemplate:
+    """A request body serialised once, with placeholders for the per-account fields"""
+
+    __slots__ = ("segments", "fields")
+
+    def __init__(self, body, fields) -> None:
+        text = json.dumps(body, separators=(",", ":"))
+        self.segments = []
+        self.fields = []
+        position = 0
+        if fields:
+            pattern = re.compile(
+                '"@@(' + "|".join(re.escape(field) for field in fields) + ')@@"'
+            )
+            for match in pattern.finditer(text):
+                self.segments.append(text[position : match.start()])
+                self.fields.append(match.group(1))
+                position = match.end()
+        self.segments.append(text[position:])
+
+    @staticmethod
+    def placeholder(field):
+        return f"@@{field}@@"
+
+    def render(self, **values):
+        # The SDK sends bytes bodies as they are, skipping model serialisation
+        parts = [self.segments[0]]
+        for field, segment in zip(self.fields, self.segments[1:]):
+            parts.append(json.dumps(values[field]))
+            parts.append(segment)
+        return "".join(parts).encode()
 
 
 class Automationaccountutils:
 
+    _templates = {}
+    _serializer = None
+    stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def serializer():
+        # Built the way AutomationClient builds its own, dict attributes included
+        if Automationaccountutils._serializer is None:
+            from azure.mgmt.automation import models
+            from azure.mgmt.automation._serialization import Serializer
+
+            Automationaccountutils._serializer = Serializer(
+                {
+                    name: value
+                    for name, value in vars(models).items()
+                    if isinstance(value, type)
+                }
+            )
+        return Automationaccountutils._serializer
+
+    @staticmethod
+    def template(model_name, build, invariants, fields=()):
+        """Returns the cached body template for these invariant inputs, building the
+        model with placeholders for the per-account fields on first use"""
+        key = (model_name, json.dumps(invariants, sort_keys=True, default=str))
+        template = Automationaccountutils._templates.get(key)
+        if template is not None:
+            Automationaccountutils.stats["hits"] += 1
+            return template
+        model = build(**{field: BodyTemplate.placeholder(field) for field in fields})
+        template = BodyTemplate(
+            Automationaccountutils.serializer().body(model, model_name), fields
+        )
+        templates = Automationaccountutils._templates
+        if len(templates) >= int(os.getenv("parameter_template_cache_size", "256")):
+            # Oldest first, content hashes change between runs and old ones go stale
+            templates.pop(next(iter(templates)))
+        templates[key] = template
+        Automationaccountutils.stats["misses"] += 1
+        return template
+
     @staticmethod
     def aacreate_or_update_parameters(accountname, location, tags: dict[str, str], sku):
         try:
-            parameters = AutomationAccountCreateOrUpdateParameters(
-                name=accountname, location=location, tags=tags, sku=sku
-            )
-            return parameters
+            return Automationaccountutils.template(
+                "AutomationAccountCreateOrUpdateParameters",
+                lambda accountname, location: AutomationAccountCreateOrUpdateParameters(
+                    name=accountname, location=location, tags=tags, sku=sku
+                ),
+                invariants={"tags": tags, "sku": sku},
+                fields=("accountname", "location"),
+            ).render(accountname=accountname, location=location)
         except Exception as e:
             logging.warning(f"Error with util {e}")
             return None
@@ -36,18 +114,31 @@ class Automationaccountutils:
         log_activity_trace,
     ):
         try:
-            parameters = RunbookCreateOrUpdateParameters(
-                runbook_type=runbook_type,
-                name=name,
-                location=location,
-                tags=tags,
-                log_verbose=log_verbose,
-                log_progress=log_progress,
-                publish_content_link=publish_content_link,
-                description=description,
-                log_activity_trace=log_activity_trace,
-            )
-            return parameters
+            return Automationaccountutils.template(
+                "RunbookCreateOrUpdateParameters",
+                lambda location: RunbookCreateOrUpdateParameters(
+                    runbook_type=runbook_type,
+                    name=name,
+                    location=location,
+                    tags=tags,
+                    log_verbose=log_verbose,
+                    log_progress=log_progress,
+                    publish_content_link=publish_content_link,
+                    description=description,
+                    log_activity_trace=log_activity_trace,
+                ),
+                invariants={
+                    "name": name,
+                    "tags": tags,
+                    "log_verbose": log_verbose,
+                    "log_progress": log_progress,
+                    "runbook_type": runbook_type,
+                    "publish_content_link": publish_content_link,
+                    "description": description,
+                    "log_activity_trace": log_activity_trace,
+                },
+                fields=("location",),
+            ).render(location=location)
         except Exception as e:
             logging.info(f"Error fetching parameter for runbooks {e}")
             return None
@@ -57,14 +148,21 @@ class Automationaccountutils:
         variable_name, variable_value, description, is_encrypted
     ):
         try:
-            parameters = VariableCreateOrUpdateParameters(
-                name=variable_name,
-                value=variable_value,
-                description=description,
-                is_encrypted=is_encrypted,
-            )
-            logging.info(f"Fetching variable parameters {parameters}")
-            return parameters
+            return Automationaccountutils.template(
+                "VariableCreateOrUpdateParameters",
+                lambda value: VariableCreateOrUpdateParameters(
+                    name=variable_name,
+                    value=value,
+                    description=description,
+                    is_encrypted=is_encrypted,
+                ),
+                invariants={
+                    "name": variable_name,
+                    "description": description,
+                    "is_encrypted": is_encrypted,
+                },
+                fields=("value",),
+            ).render(value=variable_value)
         except Exception as e:
             logging.warning(f"Error with updating runbook variables utils {e}")
             return None
@@ -81,17 +179,30 @@ class Automationaccountutils:
         advanced_schedule,
     ):
         try:
-            parameters = ScheduleCreateOrUpdateParameters(
-                name=schedule_name,
-                start_time=start_time,
-                expiry_time=expiry_time,
-                frequency=frequency,
-                description=description,
-                advanced_schedule=advanced_schedule,
-                time_zone=time_zone,
-                interval=interval,
-            )
-            return parameters
+            # The schedule spec is the same for every account, so is the body
+            return Automationaccountutils.template(
+                "ScheduleCreateOrUpdateParameters",
+                lambda: ScheduleCreateOrUpdateParameters(
+                    name=schedule_name,
+                    start_time=start_time,
+                    expiry_time=expiry_time,
+                    frequency=frequency,
+                    description=description,
+                    advanced_schedule=advanced_schedule,
+                    time_zone=time_zone,
+                    interval=interval,
+                ),
+                invariants={
+                    "name": schedule_name,
+                    "start_time": start_time,
+                    "expiry_time": expiry_time,
+                    "frequency": frequency,
+                    "description": description,
+                    "advanced_schedule": advanced_schedule,
+                    "time_zone": time_zone,
+                    "interval": interval,
+                },
+            ).render()
         except Exception as e:
             logging.info(f"Error assigning parameter for schedule {e}")
             return None
@@ -99,13 +210,21 @@ class Automationaccountutils:
     @staticmethod
     def aalink_runbook_to_aa(schedule_name, runbook_name, run_on, addparameters):
         try:
-            parameters = JobScheduleCreateParameters(
-                schedule=ScheduleAssociationProperty(name=schedule_name),
-                runbook=RunbookAssociationProperty(name=runbook_name),
-                run_on=run_on,
-                parameters=addparameters,
-            )
-            return parameters
+            return Automationaccountutils.template(
+                "JobScheduleCreateParameters",
+                lambda: JobScheduleCreateParameters(
+                    schedule=ScheduleAssociationProperty(name=schedule_name),
+                    runbook=RunbookAssociationProperty(name=runbook_name),
+                    run_on=run_on,
+                    parameters=addparameters,
+                ),
+                invariants={
+                    "schedule": schedule_name,
+                    "runbook": runbook_name,
+                    "run_on": run_on,
+                    "parameters": addparameters,
+                },
+            ).render()
         except Exception as e:
             logging.warning(f"Error creating parameters for Automation account {e}")
             return None
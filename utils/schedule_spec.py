@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import json, os
+
+
+class ScheduleSpec:
+
+    # Automation rejects schedules starting less than five minutes from now
+    min_lead = timedelta(minutes=5)
+
+    @staticmethod
+    def zone(time_zone):
+        try:
+            return ZoneInfo(time_zone or "UTC")
+        except (ZoneInfoNotFoundError, ValueError):
+            return timezone.utc
+
+    @staticmethod
+    def start_time(start_at=None, start_in_minutes=None, time_zone="UTC", now=None):
+        now = (now or datetime.now(timezone.utc)).astimezone(
+            ScheduleSpec.zone(time_zone)
+        )
+        earliest = now + ScheduleSpec.min_lead
+        if start_at:
+            hour, minute = (int(part) for part in start_at.split(":"))
+            start = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            while start < earliest:
+                start += timedelta(days=1)
+            return start
+        return max(earliest, now + timedelta(minutes=float(start_in_minutes or 0)))
+
+    @staticmethod
+    def build(
+        name,
+        frequency="Day",
+        interval=1,
+        start_at=None,
+        start_in_minutes=None,
+        expiry_time=None,
+        time_zone="UTC",
+        description=None,
+        advanced_schedule=None,
+        runbooks=None,
+        now=None,
+    ):
+        return {
+            "name": name,
+            "runbooks": runbooks,
+            "start_at": start_at,
+            "start_time": ScheduleSpec.start_time(
+                start_at=start_at,
+                start_in_minutes=start_in_minutes,
+                time_zone=time_zone,
+                now=now,
+            ).isoformat(),
+            "expiry_time": expiry_time,
+            "frequency": frequency,
+            "description": description,
+            "interval": str(interval),
+            "time_zone": time_zone,
+            "advanced_schedule": advanced_schedule,
+        }
+
+    @staticmethod
+    def specs_from_env(setting="automation_schedules"):
+        raw = os.getenv(setting)
+        if raw:
+            return json.loads(raw)
+        return [{"name": os.getenv("schedule_name"), "start_at": "00:00"}]
+
+    @staticmethod
+    def from_env(setting="automation_schedules", now=None):
+        return ScheduleSpec.build_all(ScheduleSpec.specs_from_env(setting), now=now)
+
+    @staticmethod
+    def build_all(specs, now=None):
+        return [ScheduleSpec.build(**spec, now=now) for spec in specs]
+
+    @staticmethod
+    def links(runbook_names, schedules):
+        # Each schedule runs the runbooks it lists, or all of them when it lists none
+        links = []
+        for sch in schedules:
+            if not sch["name"]:
+                raise ValueError("Schedule without a name cannot be linked")
+            for runbookname in sch.get("runbooks") or runbook_names:
+                if runbookname not in runbook_names:
+                    raise ValueError(
+                        f"Schedule {sch['name']} links unknown runbook {runbookname}"
+                    )
+                links.append({"runbookname": runbookname, "schedulename": sch["name"]})
+        return links
+
+    @staticmethod
+    def check_links(links, schedules):
+        names = {sch["name"] for sch in schedules}
+        for link in links:
+            if link["schedulename"] not in names:
+                raise ValueError(
+                    f"Runbook {link['runbookname']} is linked to schedule "
+                    f"{link['schedulename']} which is not configured"
+                )
+        return links
+
+    @staticmethod
+    def instant(value):
+        # The service reports a schedule that never expires as 9999-12-31
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        if value.year >= 9999:
+            return None
+        return value.astimezone(timezone.utc).replace(microsecond=0)
+
+    @staticmethod
+    def time_of_day(value, time_zone):
+        value = ScheduleSpec.instant(value)
+        if value is None:
+            return None
+        return value.astimezone(ScheduleSpec.zone(time_zone)).strftime("%H:%M")
+
+    @staticmethod
+    def advanced(value):
+        # SDK model or REST dict, unset and empty lists mean the same thing
+        if value is None:
+            return None
+        if hasattr(value, "as_dict"):
+            value = value.as_dict()
+        normalised = {
+            key.replace("_", "").lower(): item for key, item in value.items() if item
+        }
+        return normalised or None
+
+    @staticmethod
+    def matches(current, sch):
+        # Relative starts move every run, only a fixed start_at pins the time of day
+        return (
+            current is not None
+            and current["frequency"].lower() == str(sch["frequency"]).lower()
+            and current["interval"] == str(sch["interval"])
+            and current["time_zone"] == sch["time_zone"]
+            and (
+                not sch.get("start_at")
+                or ScheduleSpec.time_of_day(current["start_time"], sch["time_zone"])
+                == ScheduleSpec.time_of_day(sch["start_time"], sch["time_zone"])
+            )
+            and ScheduleSpec.instant(current["expiry_time"])
+            == ScheduleSpec.instant(sch["expiry_time"])
+            and ScheduleSpec.advanced(current["advanced_schedule"])
+            == ScheduleSpec.advanced(sch["advanced_schedule"])
+        )
@@ -0,0 +1,50 @@
+import hashlib, json, os
+
+
+class StoragePlacement:
+
+    @staticmethod
+    def policy():
+        return os.getenv("object_storage_policy", "hash").lower()
+
+    @staticmethod
+    def rank(key, candidate):
+        return hashlib.sha256(f"{key}/{candidate}".encode("utf-8")).digest()
+
+    @staticmethod
+    def select(account, policy=None):
+        candidates = sorted(account["resource_name"])
+        if not candidates:
+            return None
+        key = account["automationaccountname"]
+        policy = policy or StoragePlacement.policy()
+        metrics = account.get("storage_metrics") or {}
+        if policy == "least_loaded" and metrics:
+            # Ties (and accounts without metrics) fall back to the stable hash order
+            return min(
+                candidates,
+                key=lambda candidate: (
+                    metrics.get(candidate, {}).get("used_bytes", float("inf")),
+                    metrics.get(candidate, {}).get("share_count", float("inf")),
+                    StoragePlacement.rank(key, candidate),
+                ),
+            )
+        # Rendezvous hashing keeps the choice stable when other accounts come and go
+        return max(
+            candidates, key=lambda candidate: StoragePlacement.rank(key, candidate)
+        )
+
+    @staticmethod
+    def sticky(policy=None):
+        # A placement by load is made once, later load changes must not move it
+        return (policy or StoragePlacement.policy()) == "least_loaded"
+
+    @staticmethod
+    def matches(account, current_value, policy=None):
+        policy = policy or StoragePlacement.policy()
+        if StoragePlacement.sticky(policy):
+            return current_value in [
+                json.dumps(name) for name in account["resource_name"]
+            ]
+        # Accounts pinned by an older choice move to the policy's target once
+        return current_value == json.dumps(StoragePlacement.select(account, policy))
@@ -0,0 +1,81 @@
+from utils.storage_placement import StoragePlacement
+import json, os
+
+
+class VariableRegistry:
+
+    _variables = {}
+
+    @staticmethod
+    def register(
+        name,
+        resolver,
+        matches=None,
+        description="runbook_variable",
+        is_encrypted=False,
+        sticky=None,
+    ):
+        # sticky: a callable saying whether a matching current value is kept even
+        # when the state was not read, the write path then reads it first
+        VariableRegistry._variables[name] = {
+            "resolver": resolver,
+            "matches": matches,
+            "description": description,
+            "is_encrypted": is_encrypted,
+            "sticky": sticky,
+        }
+
+    @staticmethod
+    def constant(value):
+        return lambda account: value
+
+    @staticmethod
+    def from_env(setting):
+        return lambda account: os.getenv(setting)
+
+    @staticmethod
+    def from_account(field):
+        return lambda account: account[field]
+
+    @staticmethod
+    def names():
+        return list(VariableRegistry._variables)
+
+    @staticmethod
+    def get(name):
+        return VariableRegistry._variables.get(name)
+
+    @staticmethod
+    def resolve(account, name):
+        variable = VariableRegistry.get(name)
+        if variable is None:
+            return None
+        return json.dumps(variable["resolver"](account))
+
+    @staticmethod
+    def sticky(name):
+        variable = VariableRegistry.get(name)
+        return bool(variable and variable["sticky"] and variable["sticky"]())
+
+    @staticmethod
+    def matches(account, name, current_value):
+        variable = VariableRegistry.get(name)
+        if variable is None or current_value is None:
+            return False
+        if variable["matches"] is not None:
+            return variable["matches"](account, current_value)
+        return current_value == VariableRegistry.resolve(account, name)
+
+
+VariableRegistry.register("EXCLUDE_AFS", VariableRegistry.constant("vol-install-xsc"))
+VariableRegistry.register(
+    "OBJECT_STORAGE",
+    StoragePlacement.select,
+    matches=StoragePlacement.matches,
+    sticky=StoragePlacement.sticky,
+)
+VariableRegistry.register("RESOURCE_GROUP", VariableRegistry.from_account("rg_name"))
+VariableRegistry.register("RetentionDays", VariableRegistry.from_env("RetentionDays"))
+VariableRegistry.register(
+    "SUBSCRIPTION_ID", VariableRegistry.from_account("subscription_id")
+)